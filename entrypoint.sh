@@ -60,15 +60,33 @@ python manage.py migrate --noinput
 python manage.py popular_dados
 
 
-# Coletar arquivos estáticos
-python manage.py collectstatic --noinput
+# Coletar arquivos estáticos (só se mudaram desde a última coleta no volume)
+python manage.py coletar_estaticos
+
+
+# Métricas Prometheus agregadas entre os workers (modo multiprocesso)
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
 
 
 # Start Gunicorn
 # Em desenvolvimento pode preferir: python manage.py runserver 0.0.0.0:8000
 
 
+# SERVIDOR_ASGI=True usa o worker uvicorn e as views assíncronas
+if [ "${SERVIDOR_ASGI:-False}" = "True" ]; then
+exec gunicorn workflow.asgi:application \
+--config gunicorn.conf.py \
+--worker-class uvicorn.workers.UvicornWorker \
+--bind 0.0.0.0:8000 \
+--workers ${GUNICORN_WORKERS:-3} \
+--log-level ${GUNICORN_LOG_LEVEL:-info}
+fi
+
 exec gunicorn workflow.wsgi:application \
+--config gunicorn.conf.py \
 --bind 0.0.0.0:8000 \
 --workers ${GUNICORN_WORKERS:-3} \
+--threads ${GUNICORN_THREADS:-1} \
 --log-level ${GUNICORN_LOG_LEVEL:-info}
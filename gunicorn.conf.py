@@ -0,0 +1,22 @@
+# Configuração do Gunicorn
+# Os parâmetros de linha de comando do entrypoint.sh continuam valendo.
+from prometheus_client import multiprocess
+
+
+def post_worker_init(worker):
+    """
+    Cada worker escuta as invalidações de cache dos outros nós (workflow/invalidacao.py)
+    e se candidata à limpeza periódica das sessões expiradas (workflow/sessoes.py)
+    e das chaves de idempotência (workflow/idempotencia.py)
+    """
+    from workflow import idempotencia
+    from workflow.invalidacao import ouvinte
+    from workflow.sessoes import limpeza
+    ouvinte.iniciar()
+    limpeza.iniciar()
+    idempotencia.limpeza.iniciar()
+
+
+def child_exit(server, worker):
+    """Descarta as métricas "live" do worker que saiu (modo multiprocesso)"""
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,8 +1,10 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from . import atribuicao, condicoes, fluxo
 from .models import (
     TemplateProcesso, Etapa, Encaminhamento,
     ProcessoInstancia, EtapaExecutada, Documento, LogAuditoria
 )
+from .services import cancelar_processos_em_lote, encaminhar_processos_em_lote, finalizar_processos_em_lote
 
 
 class EtapaInline(admin.TabularInline):
@@ -35,8 +37,8 @@ class TemplateProcessoAdmin(admin.ModelAdmin):
 @admin.register(Etapa)
 class EtapaAdmin(admin.ModelAdmin):
     """Admin para etapas"""
-    list_display = ['nome', 'template', 'ordem', 'tipo', 'prazo_dias', 'requer_aprovacao']
-    list_filter = ['tipo', 'requer_aprovacao', 'template']
+    list_display = ['nome', 'template', 'ordem', 'tipo', 'prazo_dias', 'requer_aprovacao', 'atribuicao']
+    list_filter = ['tipo', 'requer_aprovacao', 'atribuicao', 'template']
     search_fields = ['nome', 'descricao', 'template__nome']
     filter_horizontal = ['usuarios_permitidos']
     ordering = ['template', 'ordem']
@@ -61,10 +63,15 @@ class EtapaExecutadaInline(admin.TabularInline):
 @admin.register(ProcessoInstancia)
 class ProcessoInstanciaAdmin(admin.ModelAdmin):
     """Admin para processos"""
-    list_display = ['numero_processo', 'titulo', 'template', 'status', 'etapa_atual', 'usuario_atual', 'data_criacao']
-    list_filter = ['status', 'template', 'data_criacao']
+    list_display = [
+        'numero_processo', 'titulo', 'template', 'status', 'prioridade', 'etapa_atual', 'usuario_atual', 'data_criacao',
+    ]
+    list_filter = ['status', 'prioridade', 'template', 'data_criacao']
     search_fields = ['numero_processo', 'titulo', 'descricao']
-    readonly_fields = ['numero_processo', 'data_criacao', 'data_conclusao', 'data_atualizacao']
+    readonly_fields = [
+        'numero_processo', 'data_criacao', 'data_conclusao', 'data_atualizacao', 'data_entrada_etapa',
+        'reservado_por', 'reservado_ate',
+    ]
     inlines = [EtapaExecutadaInline]
     
     fieldsets = (
@@ -74,10 +81,61 @@ class ProcessoInstanciaAdmin(admin.ModelAdmin):
         ('Status e Fluxo', {
             'fields': ('status', 'etapa_atual', 'usuario_atual')
         }),
+        ('Fila de Tarefas', {
+            'fields': ('prioridade', 'data_entrada_etapa', 'reservado_por', 'reservado_ate')
+        }),
         ('Auditoria', {
             'fields': ('criado_por', 'data_criacao', 'data_conclusao', 'data_atualizacao')
         }),
     )
+    actions = ['encaminhar_proxima_etapa', 'cancelar_processos', 'finalizar_processos']
+
+    def _informar(self, request, alterados, total, verbo, motivo='já concluídos ou cancelados'):
+        self.message_user(request, f'{len(alterados)} de {total} processo(s) {verbo}.')
+        if len(alterados) < total:
+            self.message_user(request, f'{total - len(alterados)} processo(s) ignorado(s): {motivo}.', messages.WARNING)
+
+    @admin.action(description='Encaminhar para a próxima etapa')
+    def encaminhar_proxima_etapa(self, request, queryset):
+        # (processo, etapa de destino, responsável)
+        linhas: list[tuple[int, int, int]] = []
+        rotas = {}
+        for processo in queryset.exclude(status__in=['CONCLUIDO', 'CANCELADO']).filter(
+            etapa_atual__isnull=False,
+        ).values('pk', 'template_id', 'etapa_atual_id', 'usuario_atual_id', *condicoes.CAMPOS_PROCESSO):
+            # Destino da tabela de transições do template, sem resultado de execução
+            tabela = fluxo.do_template(processo['template_id'])
+            etapa_id = processo['etapa_atual_id']
+            destino = tabela.proxima(etapa_id, contexto=condicoes.contexto(processo=processo))
+            if destino is not None:  # fluxo.FIM: última etapa, nada a encaminhar
+                linhas.append((processo['pk'], destino, processo['usuario_atual_id'] or request.user.pk))
+                rotas[processo['pk']] = (tabela, etapa_id, destino)
+        # Atribuição automática de cada etapa de destino; sem candidatos, o
+        # responsável continua o mesmo (ou passa a ser quem encaminhou, se não havia)
+        responsaveis = atribuicao.distribuir([(pk, destino) for pk, destino, _ in linhas])
+        linhas = [(pk, destino, responsaveis.get(pk, usuario_id)) for pk, destino, usuario_id in linhas]
+        alterados = encaminhar_processos_em_lote(
+            [pk for pk, _, _ in linhas],
+            [destino for _, destino, _ in linhas],
+            [usuario_id for _, _, usuario_id in linhas],
+            'Encaminhado em lote pelo admin',
+        )
+        for pk in alterados:
+            tabela, origem, destino = rotas[pk]
+            tabela.registrar(origem, destino)
+        self._informar(
+            request, alterados, queryset.count(), 'encaminhado(s)', 'já concluídos/cancelados ou na última etapa',
+        )
+
+    @admin.action(description='Cancelar processos selecionados')
+    def cancelar_processos(self, request, queryset):
+        alterados = cancelar_processos_em_lote(list(queryset.values_list('pk', flat=True)), request.user.pk)
+        self._informar(request, alterados, queryset.count(), 'cancelado(s)')
+
+    @admin.action(description='Finalizar processos selecionados')
+    def finalizar_processos(self, request, queryset):
+        alterados = finalizar_processos_em_lote(list(queryset.values_list('pk', flat=True)))
+        self._informar(request, alterados, queryset.count(), 'finalizado(s)')
 
 
 @admin.register(EtapaExecutada)
@@ -95,7 +153,7 @@ class DocumentoAdmin(admin.ModelAdmin):
     list_display = ['nome', 'tipo', 'etapa_executada', 'enviado_por', 'data_envio', 'tamanho_formatado']
     list_filter = ['tipo', 'data_envio']
     search_fields = ['nome', 'descricao', 'etapa_executada__processo__numero_processo']
-    readonly_fields = ['data_envio', 'tamanho']
+    readonly_fields = ['data_envio', 'tamanho', 'indexado_em']
     
     def tamanho_formatado(self, obj):
         return obj.get_tamanho_formatado()
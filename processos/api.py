@@ -0,0 +1,170 @@
+# processos/api.py
+"""
+API JSON de leitura (v1) para os sistemas que sincronizam o status dos processos.
+
+- ``fields=id,status,...`` escolhe os campos (sparse fieldset);
+- paginação por cursor (keyset em ``id``): ``proximo`` traz a URL da página
+  seguinte, e o custo de cada página não cresce com a posição na lista;
+- as linhas saem de ``values_list`` direto para o JSON, sem instanciar modelos;
+- ETag/304 como nas páginas HTML (workflow/condicional.py).
+
+A visibilidade e os filtros (``status``, ``template``, ``numero_processo``...)
+são os mesmos da listagem HTML (``filtrar_processos``).
+"""
+import base64
+import binascii
+import functools
+
+from django.http import JsonResponse
+from django.views.decorators.http import require_safe
+
+from workflow.condicional import get_condicional
+from workflow.routers import leitura_replica
+from .models import EtapaExecutada
+from .views import filtrar_processos, validadores_processo_detail, validadores_processo_list
+
+LIMITE_PADRAO = 50
+LIMITE_MAXIMO = 200
+
+# Campo da API -> lookup do ORM
+CAMPOS_PROCESSO = {
+    'id': 'id',
+    'numero_processo': 'numero_processo',
+    'titulo': 'titulo',
+    'descricao': 'descricao',
+    'status': 'status',
+    'template_id': 'template_id',
+    'template': 'template__nome',
+    'etapa_atual_id': 'etapa_atual_id',
+    'etapa_atual': 'etapa_atual__nome',
+    'usuario_atual_id': 'usuario_atual_id',
+    'usuario_atual': 'usuario_atual__username',
+    'criado_por_id': 'criado_por_id',
+    'criado_por': 'criado_por__username',
+    'data_criacao': 'data_criacao',
+    'data_atualizacao': 'data_atualizacao',
+    'data_conclusao': 'data_conclusao',
+}
+CAMPOS_PROCESSO_PADRAO = (
+    'id', 'numero_processo', 'titulo', 'status', 'template', 'etapa_atual', 'usuario_atual', 'data_atualizacao',
+)
+
+CAMPOS_HISTORICO = {
+    'id': 'id',
+    'etapa_id': 'etapa_id',
+    'etapa': 'etapa__nome',
+    'ordem': 'etapa__ordem',
+    'executado_por_id': 'executado_por_id',
+    'executado_por': 'executado_por__username',
+    'resultado': 'resultado',
+    'observacoes': 'observacoes',
+    'data_inicio': 'data_inicio',
+    'data_conclusao': 'data_conclusao',
+    'tempo_execucao': 'tempo_execucao',
+}
+CAMPOS_HISTORICO_PADRAO = ('id', 'etapa', 'executado_por', 'resultado', 'data_inicio', 'data_conclusao')
+
+
+class ErroAPI(Exception):
+    """Parâmetro inválido; vira uma resposta 400 com a mensagem"""
+
+
+def erro(mensagem: str, status: int) -> JsonResponse:
+    return JsonResponse({'erro': mensagem}, status=status)
+
+
+def api_view(view):
+    """Login obrigatório (401 em vez de redirecionar) e ``ErroAPI`` como 400"""
+    @functools.wraps(view)
+    def _view(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return erro('Autenticação necessária', 401)
+        try:
+            return view(request, *args, **kwargs)
+        except ErroAPI as e:
+            return erro(str(e), 400)
+    return require_safe(_view)
+
+
+def _campos(request, disponiveis: dict, padrao: tuple) -> list[str]:
+    if not request.GET.get('fields'):
+        return list(padrao)
+    campos = [campo.strip() for campo in request.GET['fields'].split(',') if campo.strip()]
+    desconhecidos = [campo for campo in campos if campo not in disponiveis]
+    if desconhecidos:
+        raise ErroAPI(f'Campos desconhecidos: {", ".join(desconhecidos)}')
+    return list(dict.fromkeys(campos))
+
+
+def _limite(request) -> int:
+    try:
+        limite = int(request.GET.get('limite', LIMITE_PADRAO))
+    except ValueError:
+        raise ErroAPI('limite deve ser um número')
+    return max(1, min(limite, LIMITE_MAXIMO))
+
+
+def codificar_cursor(ultimo_id: int) -> str:
+    return base64.urlsafe_b64encode(str(ultimo_id).encode()).decode().rstrip('=')
+
+
+# Ids são BIGINT: um cursor fora disso estouraria na consulta (500) em vez de 400
+CURSOR_MAXIMO = 2 ** 63 - 1
+
+
+def decodificar_cursor(cursor: str) -> int:
+    try:
+        ultimo_id = int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ErroAPI('cursor inválido')
+    if not 1 <= ultimo_id <= CURSOR_MAXIMO:
+        raise ErroAPI('cursor inválido')
+    return ultimo_id
+
+
+def paginar(request, queryset, disponiveis: dict, padrao: tuple, decrescente: bool) -> JsonResponse:
+    """Página de ``queryset`` ordenada por id a partir do ``cursor``, só com os campos pedidos"""
+    campos = _campos(request, disponiveis, padrao)
+    limite = _limite(request)
+
+    if request.GET.get('cursor'):
+        ultimo_id = decodificar_cursor(request.GET['cursor'])
+        queryset = queryset.filter(id__lt=ultimo_id) if decrescente else queryset.filter(id__gt=ultimo_id)
+
+    # O id vem sempre (primeira coluna) para montar o próximo cursor
+    lookups = ['id'] + [disponiveis[campo] for campo in campos]
+    linhas = list(queryset.order_by('-id' if decrescente else 'id').values_list(*lookups)[:limite + 1])
+
+    proximo = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        parametros = request.GET.copy()
+        parametros['cursor'] = codificar_cursor(linhas[-1][0])
+        proximo = f'{request.path}?{parametros.urlencode()}'
+
+    return JsonResponse({
+        'resultados': [dict(zip(campos, linha[1:])) for linha in linhas],
+        'proximo': proximo,
+    })
+
+
+# ==================== ENDPOINTS ====================
+
+@api_view
+@leitura_replica
+@get_condicional(validadores_processo_list)
+def processos(request):
+    """Processos visíveis ao usuário, mais recentes primeiro"""
+    queryset = filtrar_processos(request.user, request.GET)
+    return paginar(request, queryset, CAMPOS_PROCESSO, CAMPOS_PROCESSO_PADRAO, decrescente=True)
+
+
+@api_view
+@get_condicional(validadores_processo_detail)
+def historico(request, pk):
+    """Etapas executadas do processo, na ordem em que foram executadas"""
+    # Mesma regra de visibilidade da listagem
+    if not filtrar_processos(request.user, {}).filter(pk=pk).exists():
+        return erro('Processo não encontrado', 404)
+    queryset = EtapaExecutada.objects.filter(processo_id=pk)
+    return paginar(request, queryset, CAMPOS_HISTORICO, CAMPOS_HISTORICO_PADRAO, decrescente=False)
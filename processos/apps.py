@@ -5,3 +5,14 @@ class ProcessosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'processos'
     verbose_name = 'Processos e Workflows'
+
+    def ready(self):
+        from workflow.invalidacao import conectar_sinais
+        conectar_sinais()
+        # Registra no barramento a invalidação do cache de templates e etapas
+        # e das tabelas de transições compiladas
+        from . import cache, fluxo  # noqa: F401
+
+        from workflow.metricas import registrar_coletor_banco
+        from .fila import ColetorFila
+        registrar_coletor_banco(ColetorFila())
@@ -0,0 +1,144 @@
+# processos/atribuicao.py
+"""
+Atribuição automática: quem assume o processo encaminhado sem usuário escolhido.
+
+Os candidatos são os usuários ativos em ``Etapa.usuarios_permitidos`` da etapa
+de destino; a estratégia é o campo ``Etapa.atribuicao``:
+
+- ``MENOS_CARGA``: quem tem menos processos em aberto (empate: quem recebeu
+  processo há mais tempo);
+- ``RODIZIO``: quem recebeu processo há mais tempo, independente da carga;
+- ``ULTIMO_EXECUTOR``: quem executou essa etapa por último no mesmo processo
+  (se ainda é candidato); senão, ``MENOS_CARGA``.
+
+A carga vem de ``CargaUsuario``, mantida pelas triggers da migração 0016 a cada
+INSERT/UPDATE/DELETE de processos (inclusive pelas procedures e UPDATEs em
+lote). Assim escolher é uma consulta com ``LIMIT 1`` pelos candidatos da
+etapa, sem contar processos de cada um. ``distribuir`` faz o mesmo para um lote
+inteiro com uma consulta por etapa, somando na memória o que já distribuiu.
+"""
+import heapq
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+from workflow.marcacao_sql import marcar_origem
+from .models import Etapa, EtapaExecutada
+from usuarios.models import Usuario
+
+# Nunca recebeu processo: vai antes de todos no rodízio e nos empates
+_NUNCA = datetime.min.replace(tzinfo=dt_timezone.utc)
+_SEMPRE = datetime.max.replace(tzinfo=dt_timezone.utc)
+
+SQL_CONTAGEM = """
+    SELECT usuario_atual_id AS usuario_id, COUNT(*) AS abertos
+    FROM processos_processoinstancia
+    WHERE usuario_atual_id IS NOT NULL AND status NOT IN ('CONCLUIDO', 'CANCELADO')
+    GROUP BY usuario_atual_id
+"""
+
+SQL_RECALCULAR = f"""
+    INSERT INTO processos_cargausuario AS c (usuario_id, abertos)
+    SELECT usuario_id, abertos FROM ({SQL_CONTAGEM}) contagem ORDER BY usuario_id
+    ON CONFLICT (usuario_id) DO UPDATE SET abertos = EXCLUDED.abertos
+    WHERE c.abertos <> EXCLUDED.abertos
+"""
+
+SQL_ZERAR = f"""
+    UPDATE processos_cargausuario c SET abertos = 0
+    WHERE c.abertos <> 0 AND c.usuario_id NOT IN (SELECT usuario_id FROM ({SQL_CONTAGEM}) contagem)
+"""
+
+
+def candidatos(etapa_id: int):
+    """Usuários ativos que podem executar a etapa, com ``abertos`` e ``ultima``"""
+    return Usuario.objects.filter(is_active=True, etapas_permitidas=etapa_id).annotate(
+        abertos=Coalesce('carga__abertos', 0),
+        ultima=Coalesce('carga__ultima_atribuicao', Value(_NUNCA)),
+    ).order_by()
+
+
+def _entrada(estrategia: str, abertos: int, ultima: tuple, usuario_id: int) -> tuple:
+    # Entrada do heap de ``distribuir``: (chave na ordem de ``_ordem``, abertos, usuário)
+    chave = (ultima, usuario_id) if estrategia == 'RODIZIO' else (abertos, ultima, usuario_id)
+    return chave, abertos, usuario_id
+
+
+def _ordem(estrategia: str):
+    if estrategia == 'RODIZIO':
+        return [F('ultima').asc(), 'id']
+    return ['abertos', F('ultima').asc(), 'id']
+
+
+def _ultimos_executores(processo_ids: list[int], etapa_id: int) -> dict[int, int]:
+    """Quem executou a etapa por último em cada processo, se ainda é candidato"""
+    return dict(EtapaExecutada.objects.filter(
+        processo_id__in=processo_ids, etapa_id=etapa_id,
+        executado_por__is_active=True, executado_por__etapas_permitidas=etapa_id,
+    ).order_by('processo_id', '-data_inicio', '-id').distinct('processo_id').values_list(
+        'processo_id', 'executado_por_id',
+    ))
+
+
+@marcar_origem('servico.escolher_responsavel')
+def escolher(etapa_id: int, processo_id: int | None = None) -> int | None:
+    """Responsável pelo processo na etapa (``None``: a etapa não tem candidatos)"""
+    estrategia = Etapa.objects.filter(pk=etapa_id).values_list('atribuicao', flat=True).first()
+    if estrategia is None:
+        return None
+    if estrategia == 'ULTIMO_EXECUTOR' and processo_id is not None:
+        usuario_id = _ultimos_executores([processo_id], etapa_id).get(processo_id)
+        if usuario_id is not None:
+            return usuario_id
+    return candidatos(etapa_id).order_by(*_ordem(estrategia)).values_list('id', flat=True).first()
+
+
+@marcar_origem('servico.distribuir_responsaveis')
+def distribuir(destinos: list[tuple[int, int]]) -> dict[int, int]:
+    """
+    Responsáveis para um lote ``[(processo_id, etapa_id)]``: ``{processo_id:
+    usuario_id}``, sem os processos cuja etapa não tem candidatos. Cada
+    processo distribuído conta como carga do usuário para os seguintes.
+    """
+    por_etapa: dict[int, list[int]] = {}
+    for processo_id, etapa_id in destinos:
+        por_etapa.setdefault(etapa_id, []).append(processo_id)
+    estrategias = dict(Etapa.objects.filter(pk__in=list(por_etapa)).values_list('id', 'atribuicao'))
+
+    escolhidos = {}
+    for etapa_id, processos in por_etapa.items():
+        estrategia = estrategias.get(etapa_id)
+        if estrategia is None:
+            continue
+        if estrategia == 'ULTIMO_EXECUTOR':
+            escolhidos.update(_ultimos_executores(processos, etapa_id))
+            processos = [processo_id for processo_id in processos if processo_id not in escolhidos]
+            if not processos:
+                continue
+
+        # O heap segue a mesma ordem de ``_ordem``; quem recebe volta com a
+        # carga somada e depois de todos os que ainda não receberam neste lote
+        fila = [
+            _entrada(estrategia, abertos, (ultima, 0), usuario_id)
+            for usuario_id, abertos, ultima in candidatos(etapa_id).values_list('id', 'abertos', 'ultima')
+        ]
+        if not fila:
+            continue
+        heapq.heapify(fila)
+        for sequencia, processo_id in enumerate(processos, start=1):
+            _, abertos, usuario_id = heapq.heappop(fila)
+            escolhidos[processo_id] = usuario_id
+            heapq.heappush(fila, _entrada(estrategia, abertos + 1, (_SEMPRE, sequencia), usuario_id))
+    return escolhidos
+
+
+@marcar_origem('servico.recalcular_cargas')
+def recalcular_cargas() -> int:
+    """Recalcula ``CargaUsuario`` a partir dos processos; retorna quantos usuários mudaram"""
+    with connection.cursor() as cursor:
+        cursor.execute(SQL_RECALCULAR)
+        alterados = cursor.rowcount
+        cursor.execute(SQL_ZERAR)
+        return alterados + cursor.rowcount
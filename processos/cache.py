@@ -0,0 +1,194 @@
+# processos/cache.py
+"""
+Cache versionado de templates e etapas (mudam poucas vezes por mês).
+
+As entradas ficam no cache ``default`` do Django (memória local por padrão,
+``CACHE_BACKEND`` para um compartilhado como o Redis). A chave de cada entrada
+leva as versões de tudo de que ela depende:
+
+- ``(grupo, id)``: o objeto, que muda a cada escrita nele;
+- ``(grupo, None)``: a lista do grupo, que muda a cada escrita em qualquer objeto dele.
+
+Invalidar é só incrementar versões (``invalidar``, ligado ao barramento de
+workflow/invalidacao.py): as entradas antigas deixam de ser lidas e expiram
+sozinhas. Entradas caras usam ``single_flight``: quando a entrada falta, só
+uma requisição recalcula e as outras esperam o resultado.
+"""
+import logging
+import time
+from functools import partial
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from usuarios.models import Usuario
+from workflow import metricas
+from workflow.invalidacao import ao_invalidar
+from .models import Etapa, TemplateProcesso
+
+logger = logging.getLogger(__name__)
+
+# Quanto tempo a trava do single-flight vale (se quem recalcula morrer) e
+# quanto as outras requisições esperam por ela antes de calcular por conta própria
+TRAVA_SEGUNDOS = 30
+ESPERA_TRAVA_SEGUNDOS = 5.0
+INTERVALO_ESPERA_SEGUNDOS = 0.05
+
+_AUSENTE = object()
+
+
+def _chave_versao(grupo: str, ident) -> str:
+    return f'versao:{grupo}:{"lista" if ident is None else ident}'
+
+
+def _chaves_dependencia(grupo: str, ident) -> list[str]:
+    if ident is None:
+        return [_chave_versao(grupo, None)]
+    # O objeto também muda quando o grupo inteiro é invalidado
+    return [_chave_versao(grupo, ident), f'versao:{grupo}:geral']
+
+
+def _incrementar(chave: str):
+    try:
+        cache.incr(chave)
+    except ValueError:
+        # Versão nova nunca repete uma antiga, mesmo se a chave foi descartada pelo cache
+        if not cache.add(chave, time.time_ns(), None):
+            cache.incr(chave)
+
+
+def versoes(dependencias) -> list[int]:
+    """Versões atuais das dependências ``[(grupo, id ou None), ...]``"""
+    chaves = [chave for grupo, ident in dependencias for chave in _chaves_dependencia(grupo, ident)]
+    atuais = cache.get_many(chaves)
+    for chave in chaves:
+        if chave not in atuais:
+            cache.add(chave, time.time_ns(), None)
+            atuais[chave] = cache.get(chave)
+    return [atuais[chave] for chave in chaves]
+
+
+def invalidar(grupo: str, ident: int | None = None):
+    """Nova versão do objeto (``ident=None``: de todos os objetos do grupo) e da lista do grupo"""
+    _incrementar(_chave_versao(grupo, None))
+    _incrementar(f'versao:{grupo}:geral' if ident is None else _chave_versao(grupo, ident))
+
+
+for _grupo in ('template', 'etapa', 'usuario'):
+    ao_invalidar(_grupo)(partial(invalidar, _grupo))
+
+
+def obter(nome: str, dependencias, calcular, timeout=None, single_flight=False):
+    """
+    Valor de ``calcular()`` guardado sob as versões atuais das ``dependencias``.
+
+    Com ``single_flight``, uma entrada que falta é calculada por uma requisição
+    só; as demais esperam até ``ESPERA_TRAVA_SEGUNDOS`` e então calculam também.
+    """
+    chave = ':'.join(['cache', nome, *map(str, versoes(dependencias))])
+    valor = cache.get(chave, _AUSENTE)
+    if valor is not _AUSENTE:
+        metricas.CACHE_CONSULTAS.labels(nome.split(':')[0], 'acerto').inc()
+        return valor
+    metricas.CACHE_CONSULTAS.labels(nome.split(':')[0], 'falta').inc()
+
+    if not single_flight:
+        valor = calcular()
+        cache.set(chave, valor, timeout)
+        return valor
+
+    trava = f'{chave}:trava'
+    if not cache.add(trava, 1, TRAVA_SEGUNDOS):
+        limite = time.monotonic() + ESPERA_TRAVA_SEGUNDOS
+        while time.monotonic() < limite:
+            time.sleep(INTERVALO_ESPERA_SEGUNDOS)
+            valor = cache.get(chave, _AUSENTE)
+            if valor is not _AUSENTE:
+                return valor
+            if cache.get(trava) is None:
+                break
+        logger.warning('Cache %s: trava não liberada, recalculando sem esperar', nome)
+        return calcular()
+    try:
+        valor = calcular()
+        cache.set(chave, valor, timeout)
+        return valor
+    finally:
+        cache.delete(trava)
+
+
+# ==================== ENTRADAS ====================
+
+def usuario(usuario_id: int | None) -> Usuario | None:
+    """Usuário (ex: criador de um template), para exibição"""
+    if usuario_id is None:
+        return None
+    return obter(
+        f'usuario:{usuario_id}', [('usuario', usuario_id)],
+        # Só os campos exibidos (o cache pode ser compartilhado)
+        lambda: Usuario.objects.only('username', 'first_name', 'last_name').filter(pk=usuario_id).first(),
+    )
+
+
+def template_detalhe(pk: int):
+    """``(template, etapas em ordem)`` ou ``(None, [])`` se não existe"""
+    def calcular():
+        template = TemplateProcesso.objects.filter(pk=pk).first()
+        if template is None:
+            return None, []
+        return template, list(template.etapas.order_by('ordem'))
+
+    template, etapas = obter(
+        f'template_detalhe:{pk}', [('template', pk), ('etapa', None)], calcular, single_flight=True,
+    )
+    if template is not None:
+        # O criador vem do próprio cache, com a versão dele
+        template.criado_por = usuario(template.criado_por_id)
+    return template, etapas
+
+
+def templates_com_etapas(somente_ativos: bool) -> list[TemplateProcesso]:
+    """Templates com ``num_etapas``, para a listagem"""
+    def calcular():
+        queryset = TemplateProcesso.objects.all()
+        if somente_ativos:
+            queryset = queryset.filter(ativo=True)
+        return list(queryset.annotate(num_etapas=Count('etapas')))
+
+    return obter(
+        f'templates_com_etapas:{int(somente_ativos)}', [('template', None), ('etapa', None)],
+        calcular, single_flight=True,
+    )
+
+
+def opcoes_templates() -> list[tuple[int, str]]:
+    """``(pk, nome)`` de todos os templates, para campos de escolha"""
+    return obter(
+        'opcoes_templates', [('template', None)],
+        lambda: [(template.pk, str(template)) for template in TemplateProcesso.objects.all()],
+    )
+
+
+def proxima_ordem(template_id: int) -> int:
+    """Ordem sugerida para uma nova etapa no fim do template"""
+    def calcular():
+        ultima_etapa = Etapa.objects.filter(template_id=template_id).order_by('-ordem').first()
+        return (ultima_etapa.ordem + 1) if ultima_etapa else 1
+
+    return obter(f'proxima_ordem:{template_id}', [('etapa', None)], calcular)
+
+
+def usuario_autenticado(usuario_id) -> Usuario | None:
+    """
+    Usuário da sessão (``request.user``) com ``etapas_permitidas_ids``.
+
+    Guarda a linha inteira (inclusive o hash da senha, que o Django confere a
+    cada requisição): um cache compartilhado precisa ser tão restrito quanto as sessões.
+    """
+    def calcular():
+        usuario = Usuario.objects.filter(pk=usuario_id).first()
+        if usuario is not None:
+            usuario.etapas_permitidas_ids = frozenset(usuario.etapas_permitidas.order_by().values_list('pk', flat=True))
+        return usuario
+
+    return obter(f'usuario_autenticado:{usuario_id}', [('usuario', usuario_id), ('etapa', None)], calcular)
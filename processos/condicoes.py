@@ -0,0 +1,169 @@
+# processos/condicoes.py
+"""
+Condições dos encaminhamentos (``Encaminhamento.condicao``).
+
+Dois formatos:
+
+- rótulo, só palavras: ``Aprovado``, ``Precisa Revisão``. Vale quando o
+  resultado da execução é o rótulo normalizado (``APROVADO``, ``PRECISA_REVISAO``);
+- expressão sobre o resultado e os campos do processo, ex:
+  ``resultado == 'REJEITADO' and dias > 30`` ou ``'urgente' in titulo``.
+
+As expressões usam a sintaxe de expressões do Python, mas só comparações,
+``and``/``or``/``not``, constantes, tuplas/listas e as variáveis de
+``VARIAVEIS``: nada de chamadas, atributos ou índices. O texto é analisado uma
+vez e vira uma árvore de funções (``Condicao``), guardada por texto; avaliar é
+só chamar essas funções com o contexto da execução.
+"""
+import ast
+import functools
+import logging
+import operator
+import re
+
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+VARIAVEIS = {
+    'resultado': 'Resultado da execução (APROVADO, REJEITADO, PENDENTE, CONCLUIDO)',
+    'observacoes': 'Observações da execução',
+    'status': 'Status do processo',
+    'titulo': 'Título do processo',
+    'descricao': 'Descrição do processo',
+    'numero_processo': 'Número do processo',
+    'dias': 'Dias desde a abertura do processo',
+}
+# As demais vêm do processo (ver contexto())
+VARIAVEIS_EXECUCAO = frozenset({'resultado', 'observacoes'})
+CAMPOS_PROCESSO = ('status', 'titulo', 'descricao', 'numero_processo', 'data_criacao')
+
+_ROTULO = re.compile(r'[^\W\d][\w\s]*')
+
+_COMPARACOES = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+
+class ErroCondicao(ValueError):
+    """Expressão inválida (sintaxe ou construção não permitida)"""
+
+
+def eh_rotulo(texto: str) -> bool:
+    """Condição no formato antigo (só palavras), comparada com o resultado"""
+    return bool(_ROTULO.fullmatch(texto.strip()))
+
+
+class Condicao:
+    """Expressão compilada: ``avaliar(contexto)`` devolve True/False"""
+
+    def __init__(self, texto: str, funcao, variaveis: frozenset):
+        self.texto = texto
+        self._funcao = funcao
+        self.variaveis = variaveis
+
+    @property
+    def usa_processo(self) -> bool:
+        return not self.variaveis <= VARIAVEIS_EXECUCAO
+
+    def avaliar(self, contexto: dict) -> bool:
+        try:
+            return bool(self._funcao(contexto))
+        except TypeError:
+            # Ex: comparar texto com número; a condição simplesmente não vale
+            logger.warning('Condição %r não pôde ser avaliada com %r', self.texto, contexto)
+            return False
+
+    def __repr__(self):
+        return f'Condicao({self.texto!r})'
+
+
+def _compilar_no(no, variaveis: set):
+    if isinstance(no, ast.Expression):
+        return _compilar_no(no.body, variaveis)
+
+    if isinstance(no, ast.Constant) and (no.value is None or isinstance(no.value, (str, int, float, bool))):
+        valor = no.value
+        return lambda contexto: valor
+
+    if isinstance(no, ast.Name):
+        if no.id not in VARIAVEIS:
+            raise ErroCondicao(f'Variável desconhecida: {no.id} (disponíveis: {", ".join(VARIAVEIS)})')
+        nome = no.id
+        variaveis.add(nome)
+        return lambda contexto: contexto.get(nome)
+
+    if isinstance(no, (ast.Tuple, ast.List)):
+        itens = [_compilar_no(item, variaveis) for item in no.elts]
+        return lambda contexto: tuple(item(contexto) for item in itens)
+
+    if isinstance(no, ast.BoolOp):
+        partes = [_compilar_no(valor, variaveis) for valor in no.values]
+        if isinstance(no.op, ast.And):
+            return lambda contexto: all(parte(contexto) for parte in partes)
+        return lambda contexto: any(parte(contexto) for parte in partes)
+
+    if isinstance(no, ast.UnaryOp) and isinstance(no.op, (ast.Not, ast.USub)):
+        operando = _compilar_no(no.operand, variaveis)
+        if isinstance(no.op, ast.Not):
+            return lambda contexto: not operando(contexto)
+        return lambda contexto: -operando(contexto)
+
+    if isinstance(no, ast.Compare):
+        esquerda = _compilar_no(no.left, variaveis)
+        passos = []
+        for op, direita in zip(no.ops, no.comparators):
+            if type(op) not in _COMPARACOES:
+                raise ErroCondicao(f'Comparação não permitida: {type(op).__name__}')
+            passos.append((_COMPARACOES[type(op)], _compilar_no(direita, variaveis)))
+
+        def comparar(contexto):
+            # Encadeada como no Python: a < b < c
+            atual = esquerda(contexto)
+            for comparacao, direita in passos:
+                proximo = direita(contexto)
+                if not comparacao(atual, proximo):
+                    return False
+                atual = proximo
+            return True
+        return comparar
+
+    raise ErroCondicao(f'Construção não permitida na condição: {type(no).__name__}')
+
+
+@functools.lru_cache(maxsize=1024)
+def compilar(texto: str) -> Condicao:
+    """Analisa a expressão uma vez (o resultado fica guardado por texto)"""
+    try:
+        arvore = ast.parse(texto.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ErroCondicao(f'Expressão inválida: {e.msg}')
+    variaveis = set()
+    funcao = _compilar_no(arvore, variaveis)
+    return Condicao(texto, funcao, frozenset(variaveis))
+
+
+def validar(texto: str):
+    """Levanta ``ErroCondicao`` se a condição (não vazia e não rótulo) não compila"""
+    if texto and texto.strip() and not eh_rotulo(texto):
+        compilar(texto)
+
+
+def contexto(resultado: str | None = None, observacoes: str = '', processo: dict | None = None, em=None) -> dict:
+    """
+    Variáveis para ``Condicao.avaliar``. ``processo`` traz os ``CAMPOS_PROCESSO``;
+    ``em`` é o momento da execução (agora, ou a data de uma execução antiga na simulação)
+    """
+    valores = {'resultado': resultado, 'observacoes': observacoes or ''}
+    if processo:
+        valores.update({campo: processo.get(campo) for campo in ('status', 'titulo', 'descricao', 'numero_processo')})
+        if processo.get('data_criacao'):
+            valores['dias'] = ((em or timezone.now()) - processo['data_criacao']).days
+    return valores
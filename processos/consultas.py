@@ -0,0 +1,149 @@
+# processos/consultas.py
+"""
+Contagem de consultas SQL, orçamento máximo de consultas por view e execução
+de consultas independentes em paralelo nas views assíncronas.
+"""
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+from workflow.banco.base import execute_wrapper_contexto
+
+logger = logging.getLogger(__name__)
+
+
+class OrcamentoConsultasExcedido(AssertionError):
+    """A view executou mais consultas do que o orçamento permite"""
+
+
+class ContadorConsultas:
+    """
+    Conta as consultas executadas numa conexão enquanto estiver ativo.
+
+    Vale também para as consultas feitas em threads do ``sync_to_async`` e do
+    ``em_paralelo`` iniciadas dentro do bloco.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.total = 0
+        self.sqls = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if context['connection'].alias == self.using:
+            self.total += 1
+            self.sqls.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = execute_wrapper_contexto(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self._wrapper.__exit__(*exc)
+
+
+@contextmanager
+def orcamento_consultas(maximo: int, using=DEFAULT_DB_ALIAS):
+    """Levanta OrcamentoConsultasExcedido se o bloco executar mais de ``maximo`` consultas"""
+    with ContadorConsultas(using) as contador:
+        yield contador
+    if contador.total > maximo:
+        raise OrcamentoConsultasExcedido(
+            f'{contador.total} consultas executadas (máximo {maximo}):\n' + '\n'.join(contador.sqls)
+        )
+
+
+def _verificar_orcamento(request, contador, maximo):
+    if contador.total > maximo:
+        mensagem = f'{request.path}: {contador.total} consultas (máximo {maximo})'
+        if settings.ORCAMENTO_CONSULTAS_ESTRITO:
+            raise OrcamentoConsultasExcedido(mensagem)
+        logger.warning(mensagem)
+
+
+def limitar_consultas(maximo: int):
+    """
+    Decorator de view (síncrona ou assíncrona) que verifica o orçamento de consultas.
+
+    Com ``ORCAMENTO_CONSULTAS_ESTRITO`` (padrão em DEBUG) o excesso vira erro;
+    caso contrário é apenas registrado no log.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def _view_async(request, *args, **kwargs):
+                with ContadorConsultas() as contador:
+                    response = await view(request, *args, **kwargs)
+                _verificar_orcamento(request, contador, maximo)
+                return response
+            return _view_async
+
+        @functools.wraps(view)
+        def _view(request, *args, **kwargs):
+            with ContadorConsultas() as contador:
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render') and not response.is_rendered:
+                    response.render()
+            _verificar_orcamento(request, contador, maximo)
+            return response
+        return _view
+    return decorator
+
+
+# ==================== CONSULTAS EM PARALELO ====================
+
+_executor = None
+
+
+def _executor_consultas():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.CONSULTAS_PARALELAS, thread_name_prefix='consultas')
+    return _executor
+
+
+def _em_conexao_propria(funcao):
+    """Executa ``funcao`` na conexão da thread do pool, com o mesmo ciclo de uma requisição"""
+    def _executar():
+        close_old_connections()
+        try:
+            return funcao()
+        finally:
+            # As threads do pool são fixas, então a conexão delas pode persistir
+            # mesmo com CONN_MAX_AGE=0 (necessário sob ASGI para as threads por requisição)
+            for conexao in connections.all(initialized_only=True):
+                if conexao.connection is not None and conexao.close_at is not None:
+                    conexao.close_at = max(
+                        conexao.close_at, time.monotonic() + settings.CONSULTAS_PARALELAS_CONN_MAX_AGE
+                    )
+            close_old_connections()
+    return _executar
+
+
+async def em_paralelo(*funcoes):
+    """
+    Executa funções síncronas de consulta ao mesmo tempo e devolve os resultados na ordem.
+
+    No Django 4.2 o ORM assíncrono (``acount``, ``aget``...) roda todas as
+    consultas de uma requisição na mesma thread, uma depois da outra. Aqui cada
+    função roda numa thread do pool ``CONSULTAS_PARALELAS``, com a sua própria
+    conexão. Com ``CONSULTAS_PARALELAS = 0`` (ex: testes, que enxergam só a
+    transação da thread principal) executa em sequência na thread da requisição.
+    """
+    if not settings.CONSULTAS_PARALELAS:
+        return [await sync_to_async(funcao)() for funcao in funcoes]
+
+    executor = _executor_consultas()
+    return await asyncio.gather(*(
+        sync_to_async(_em_conexao_propria(funcao), thread_sensitive=False, executor=executor)()
+        for funcao in funcoes
+    ))
@@ -0,0 +1,277 @@
+# processos/extracao.py
+"""
+Extração de texto dos documentos anexados para a busca textual.
+
+A extração roda fora do ciclo da requisição (thread de fundo disparada após o
+commit do upload, ou o comando ``indexar_documentos``) e respeita um orçamento
+de tamanho e de tempo por arquivo.
+"""
+import csv
+import io
+import logging
+import os
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import close_old_connections, connections, transaction
+from django.db.models import CharField, Value
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CONFIG_BUSCA = 'portuguese'
+
+EXTENSOES_TEXTO = {'.txt', '.md', '.log', '.xml', '.json', '.html', '.htm'}
+EXTENSOES_CSV = {'.csv', '.tsv'}
+EXTENSOES_PDF = {'.pdf'}
+
+# Streams e operadores de texto são lidos em varreduras lineares (bytes.find e
+# tokens sem retrocesso): um arquivo montado para forçar retrocesso de expressão
+# regular seguraria o GIL sem passar pelo controle de tempo
+_DICIONARIO_MAX = 4096
+_RE_TOKEN = re.compile(rb'\\[\s\S]|[()\[\]]|[A-Za-z\'"*]+')
+_OPERADORES_STRING = {b'Tj', b"'", b'"'}
+# Tokens entre duas verificações do prazo
+_TOKENS_POR_VERIFICACAO = 10_000
+_ESCAPES_PDF = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+_executor = None
+
+
+class OrcamentoExcedido(Exception):
+    """A extração ultrapassou o tempo permitido para um arquivo"""
+
+
+class _Prazo:
+    """Controla o tempo máximo de extração de um arquivo"""
+
+    def __init__(self, segundos):
+        self.limite = time.monotonic() + segundos
+
+    def verificar(self):
+        if time.monotonic() > self.limite:
+            raise OrcamentoExcedido('Tempo de extração esgotado')
+
+
+def _decodificar(dados: bytes) -> str:
+    try:
+        return dados.decode('utf-8')
+    except UnicodeDecodeError:
+        return dados.decode('latin-1')
+
+
+def _extrair_csv(dados: bytes, prazo: _Prazo) -> str:
+    texto = _decodificar(dados)
+    delimitador = '\t' if texto[:1024].count('\t') > texto[:1024].count(',') else ','
+    partes = []
+    for i, linha in enumerate(csv.reader(io.StringIO(texto), delimiter=delimitador)):
+        if i % 1000 == 0:
+            prazo.verificar()
+        partes.append(' '.join(celula for celula in linha if celula))
+    return '\n'.join(partes)
+
+
+def _desescapar_pdf(bruto: bytes) -> bytes:
+    saida = bytearray()
+    i = 0
+    while i < len(bruto):
+        c = bruto[i:i + 1]
+        if c != b'\\' or i + 1 >= len(bruto):
+            saida += c
+            i += 1
+            continue
+        proximo = bruto[i + 1:i + 2]
+        if proximo in _ESCAPES_PDF:
+            saida += _ESCAPES_PDF[proximo]
+            i += 2
+        elif proximo.isdigit():
+            octal = re.match(rb'[0-7]{1,3}', bruto[i + 1:i + 4])
+            digitos = octal.group(0) if octal else proximo
+            saida.append(int(digitos, 8) & 0xFF)
+            i += 1 + len(digitos)
+        elif proximo in (b'\n', b'\r'):
+            i += 2
+        else:
+            saida += proximo
+            i += 2
+    return bytes(saida)
+
+
+def _streams(dados: bytes, prazo: _Prazo):
+    """``(dicionário, conteúdo)`` de cada ``<<...>> stream ... endstream``, numa varredura linear"""
+    posicao = 0
+    while True:
+        prazo.verificar()
+        inicio = dados.find(b'stream', posicao)
+        if inicio < 0:
+            return
+        palavra_fim = inicio + len(b'stream')
+        if dados[inicio - 3:inicio] == b'end':
+            posicao = palavra_fim
+            continue
+        if dados[palavra_fim:palavra_fim + 2] == b'\r\n':
+            corpo = palavra_fim + 2
+        elif dados[palavra_fim:palavra_fim + 1] == b'\n':
+            corpo = palavra_fim + 1
+        else:
+            posicao = palavra_fim
+            continue
+
+        # O dicionário vem logo antes da palavra stream (e depois do stream anterior)
+        cabecalho = dados[max(posicao, inicio - _DICIONARIO_MAX):inicio].rstrip()
+        abertura = cabecalho.find(b'<<')
+        fim = dados.find(b'endstream', corpo)
+        if fim < 0:
+            return
+        posicao = fim + len(b'endstream')
+        if abertura < 0 or not cabecalho.endswith(b'>>'):
+            continue
+
+        conteudo = dados[corpo:fim]
+        if conteudo.endswith(b'\r\n'):
+            conteudo = conteudo[:-2]
+        elif conteudo.endswith(b'\n'):
+            conteudo = conteudo[:-1]
+        yield cabecalho[abertura + 2:-2], conteudo
+
+
+def _textos(conteudo: bytes, prazo: _Prazo):
+    """Strings dos operadores Tj, ' e " e arrays de TJ de um stream de conteúdo, na ordem"""
+    profundidade = 0  # parênteses abertos da string atual (podem ser aninhados)
+    inicio = 0
+    array = None  # strings do array [ ... ] aberto
+    ultimo = None  # string ou array que precede o próximo operador
+    for i, token in enumerate(_RE_TOKEN.finditer(conteudo)):
+        if i % _TOKENS_POR_VERIFICACAO == 0:
+            prazo.verificar()
+        valor = token.group()
+        if profundidade:
+            if valor == b'(':
+                profundidade += 1
+            elif valor == b')':
+                profundidade -= 1
+                if not profundidade:
+                    string = _desescapar_pdf(conteudo[inicio:token.start()])
+                    if array is not None:
+                        array.append(string)
+                    ultimo = string
+            continue
+        if valor == b'(':
+            profundidade, inicio = 1, token.end()
+        elif valor == b'[':
+            array = []
+        elif valor == b']':
+            ultimo, array = array, None
+        elif valor[:1] != b'\\':
+            if isinstance(ultimo, bytes) and valor in _OPERADORES_STRING:
+                yield ultimo
+            elif isinstance(ultimo, list) and valor == b'TJ':
+                yield b''.join(ultimo)
+            ultimo = None
+
+
+def _extrair_pdf(dados: bytes, prazo: _Prazo, max_bytes: int) -> str:
+    """Extrai texto dos operadores Tj/TJ dos streams de conteúdo do PDF"""
+    partes = []
+    restante = max_bytes
+    for dicionario, conteudo in _streams(dados, prazo):
+        if b'/FlateDecode' in dicionario:
+            try:
+                # max_length limita o estouro de arquivos "bomba" de compressão
+                conteudo = zlib.decompressobj().decompress(conteudo, restante)
+            except zlib.error:
+                continue
+        elif b'/Filter' in dicionario:
+            # Outros filtros (imagens, DCT, LZW...) não carregam texto simples
+            continue
+        restante -= len(conteudo)
+
+        partes.extend(_textos(conteudo, prazo))
+
+        if restante <= 0:
+            break
+    return _decodificar(b' '.join(partes))
+
+
+def extrair_texto(arquivo, nome: str, max_bytes: int | None = None, timeout: float | None = None) -> str:
+    """
+    Extrai o texto de um arquivo (objeto com ``read``) respeitando o orçamento.
+
+    Arquivos maiores que ``max_bytes`` são lidos apenas até o limite; se o tempo
+    ``timeout`` (segundos) esgotar, levanta ``OrcamentoExcedido``.
+    """
+    if max_bytes is None:
+        max_bytes = int(settings.EXTRACAO_TEXTO_MAX_BYTES)
+    if timeout is None:
+        timeout = settings.EXTRACAO_TEXTO_TIMEOUT
+
+    extensao = os.path.splitext(nome)[1].lower()
+    if extensao not in EXTENSOES_TEXTO | EXTENSOES_CSV | EXTENSOES_PDF:
+        return ''
+
+    prazo = _Prazo(timeout)
+    dados = arquivo.read(max_bytes)
+
+    if extensao in EXTENSOES_PDF:
+        return _extrair_pdf(dados, prazo, max_bytes)
+    if extensao in EXTENSOES_CSV:
+        return _extrair_csv(dados, prazo)
+    return _decodificar(dados)
+
+
+def indexar_documento(documento_id: int) -> bool:
+    """Extrai o texto do documento e grava o tsvector de busca"""
+    from .models import Documento
+
+    documento = Documento.objects.filter(pk=documento_id).first()
+    if not documento:
+        return False
+
+    texto = ''
+    try:
+        with documento.arquivo.open('rb') as arquivo:
+            texto = extrair_texto(arquivo, documento.arquivo.name)
+    except OrcamentoExcedido:
+        logger.warning('Extração do documento %s excedeu o tempo limite', documento_id)
+    except (OSError, ValueError) as e:
+        logger.warning('Falha ao extrair texto do documento %s: %s', documento_id, e)
+
+    # Postgres recusa tsvector acima de 1MB; o texto excedente não é indexado
+    texto = texto.replace('\x00', ' ')[:settings.EXTRACAO_TEXTO_MAX_CARACTERES]
+
+    Documento.objects.filter(pk=documento_id).update(
+        conteudo_busca=(
+            SearchVector(Value(documento.nome, output_field=CharField()), weight='A', config=CONFIG_BUSCA)
+            + SearchVector(Value(documento.descricao, output_field=CharField()), weight='B', config=CONFIG_BUSCA)
+            + SearchVector(Value(texto, output_field=CharField()), weight='C', config=CONFIG_BUSCA)
+        ),
+        indexado_em=timezone.now(),
+    )
+    return True
+
+
+def _indexar_em_segundo_plano(documento_id: int):
+    close_old_connections()
+    try:
+        indexar_documento(documento_id)
+    except Exception:
+        logger.exception('Erro ao indexar documento %s', documento_id)
+    finally:
+        connections.close_all()
+
+
+def agendar_indexacao(documento_id: int):
+    """Agenda a indexação do documento para depois do commit, fora da requisição"""
+    global _executor
+
+    if not settings.EXTRACAO_TEXTO_ASSINCRONA:
+        transaction.on_commit(lambda: indexar_documento(documento_id))
+        return
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='extracao')
+    transaction.on_commit(lambda: _executor.submit(_indexar_em_segundo_plano, documento_id))
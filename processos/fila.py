@@ -0,0 +1,190 @@
+# processos/fila.py
+"""
+Fila de tarefas dos operadores ("pegar a próxima tarefa").
+
+Um processo está na fila quando está em andamento numa etapa e não tem
+reserva válida. Quem pega a tarefa só recebe processos sem responsável, dele
+mesmo ou com um responsável que não é candidato da etapa (quem criou o
+processo, por exemplo): os que a atribuição automática (processos/atribuicao.py)
+deu a um candidato ficam com ele. ``reservar`` escolhe, numa única instrução, o de maior
+prioridade (e há mais tempo na etapa) entre as etapas que o usuário pode
+executar e o reserva por ``FILA_RESERVA_SEGUNDOS``. O ``FOR UPDATE SKIP
+LOCKED`` faz dois operadores pedindo ao mesmo tempo receberem processos
+diferentes, sem um esperar pelo outro; o índice parcial
+``processo_fila_idx`` cobre só os processos que podem estar na fila.
+
+A reserva só grava ``reservado_por`` e ``reservado_ate``: o responsável
+(``usuario_atual``) só muda ao encaminhar ou executar, e a ``versao`` não muda
+(migração 0020), então formulários abertos sobre o processo continuam válidos.
+A reserva expira sozinha (o processo volta para a fila) e é desfeita quando o
+processo muda de etapa ou termina (trigger da migração 0015). Enquanto vale,
+só quem reservou executa a etapa (``sp_executar_etapa``, migração 0018, e
+``executar_etapas_em_lote``).
+``resumo`` dá o tamanho da fila e o tempo de espera por etapa, também
+exportados em ``/metrics`` (``ColetorFila``).
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Min, Q, Value
+from django.utils import timezone
+from prometheus_client.core import GaugeMetricFamily
+
+from workflow.marcacao_sql import marcar_origem
+from .models import ProcessoInstancia
+
+logger = logging.getLogger(__name__)
+
+SQL_RESERVAR = """
+    WITH proximo AS (
+        SELECT id
+        FROM processos_processoinstancia
+        WHERE status = 'EM_ANDAMENTO'
+          AND etapa_atual_id IS NOT NULL
+          AND (reservado_ate IS NULL OR reservado_ate < NOW())
+          AND (%(etapas)s::BIGINT[] IS NULL OR etapa_atual_id = ANY(%(etapas)s::BIGINT[]))
+          -- Processo atribuído a um candidato da etapa (processos/atribuicao.py) é dele
+          AND (
+              usuario_atual_id IS NULL
+              OR usuario_atual_id = %(usuario)s
+              OR NOT EXISTS (
+                  SELECT 1
+                  FROM processos_etapa_usuarios_permitidos ep
+                  JOIN usuarios_usuario u ON u.id = ep.usuario_id
+                  WHERE ep.etapa_id = etapa_atual_id AND ep.usuario_id = usuario_atual_id AND u.is_active
+              )
+          )
+        ORDER BY prioridade DESC, data_entrada_etapa, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE processos_processoinstancia p
+    SET reservado_por_id = %(usuario)s,
+        reservado_ate = NOW() + make_interval(secs => %(segundos)s)
+    FROM proximo
+    WHERE p.id = proximo.id
+    RETURNING p.id, p.numero_processo, p.etapa_atual_id, p.reservado_ate, p.versao
+"""
+
+
+def etapas_do_usuario(usuario) -> list[int] | None:
+    """Etapas que o usuário pode executar (``None``: todas, administrador)"""
+    if usuario.perfil == 'ADMIN':
+        return None
+    # Usuário da sessão já traz as etapas permitidas (usuarios/backends.py)
+    etapas = getattr(usuario, 'etapas_permitidas_ids', None)
+    if etapas is None:
+        etapas = usuario.etapas_permitidas.values_list('id', flat=True)
+    return list(etapas)
+
+
+@marcar_origem('servico.reservar_proxima_tarefa')
+def reservar(usuario, etapa_id: int | None = None) -> dict | None:
+    """
+    Reserva o próximo processo da fila para ``usuario`` (só da ``etapa_id``, se
+    informada). Retorna ``id``, ``numero_processo``, ``etapa_atual_id``,
+    ``reservado_ate`` e ``versao``, ou ``None`` se a fila está vazia.
+    """
+    etapas = etapas_do_usuario(usuario)
+    if etapa_id is not None:
+        if etapas is not None and etapa_id not in etapas:
+            return None
+        etapas = [etapa_id]
+    with connection.cursor() as cursor:
+        cursor.execute(SQL_RESERVAR, {
+            'etapas': etapas, 'usuario': usuario.pk, 'segundos': settings.FILA_RESERVA_SEGUNDOS,
+        })
+        linha = cursor.fetchone()
+        if linha is None:
+            return None
+        return dict(zip([coluna.name for coluna in cursor.description], linha))
+
+
+@marcar_origem('servico.renovar_reserva')
+def renovar(processo_id: int, usuario) -> bool:
+    """Estende a reserva do usuário (``False`` se ela já expirou ou é de outro)"""
+    return ProcessoInstancia.objects.filter(
+        pk=processo_id, reservado_por=usuario, reservado_ate__gte=timezone.now(),
+    ).update(reservado_ate=timezone.now() + timedelta(seconds=settings.FILA_RESERVA_SEGUNDOS)) > 0
+
+
+@marcar_origem('servico.liberar_reserva')
+def liberar(processo_id: int, usuario) -> bool:
+    """Devolve o processo à fila (só quem reservou)"""
+    return ProcessoInstancia.objects.filter(
+        pk=processo_id, reservado_por=usuario,
+    ).update(reservado_por=None, reservado_ate=None) > 0
+
+
+def resumo(etapas: list[int] | None = None) -> list[dict]:
+    """
+    Por etapa: ``disponiveis`` (na fila), ``reservadas``, ``espera_media`` e
+    ``espera_maxima`` (timedelta, dos processos na fila; ``desde_media`` e
+    ``desde_maxima`` são os mesmos valores como datetime, para o ``timesince``
+    dos templates). ``etapas=None``: todas.
+    """
+    agora = timezone.now()
+    livre = Q(reservado_ate__isnull=True) | Q(reservado_ate__lt=agora)
+    espera = ExpressionWrapper(Value(agora) - F('data_entrada_etapa'), output_field=DurationField())
+    processos = ProcessoInstancia.objects.filter(status='EM_ANDAMENTO', etapa_atual__isnull=False)
+    if etapas is not None:
+        processos = processos.filter(etapa_atual_id__in=etapas)
+
+    linhas = processos.order_by('etapa_atual__template__nome', 'etapa_atual__ordem').values(
+        'etapa_atual_id', 'etapa_atual__nome', 'etapa_atual__template__nome', 'etapa_atual__ordem',
+    ).annotate(
+        disponiveis=Count('id', filter=livre),
+        reservadas=Count('id', filter=Q(reservado_ate__gte=agora)),
+        espera_media=Avg(espera, filter=livre),
+        entrada_mais_antiga=Min('data_entrada_etapa', filter=livre),
+    )
+    resultado = []
+    for linha in linhas:
+        mais_antiga, media = linha['entrada_mais_antiga'], linha['espera_media']
+        resultado.append({
+            'etapa_id': linha['etapa_atual_id'],
+            'etapa': linha['etapa_atual__nome'],
+            'template': linha['etapa_atual__template__nome'],
+            'disponiveis': linha['disponiveis'],
+            'reservadas': linha['reservadas'],
+            'espera_media': media,
+            'espera_maxima': agora - mais_antiga if mais_antiga else None,
+            'desde_media': agora - media if media is not None else None,
+            'desde_maxima': mais_antiga,
+        })
+    return resultado
+
+
+class ColetorFila:
+    """Tamanho da fila e espera por etapa, lidos do banco a cada scrape de ``/metrics``"""
+
+    def describe(self):
+        # Sem describe() o registro chamaria collect() (e o banco) ao registrar
+        return []
+
+    def collect(self):
+        tarefas = GaugeMetricFamily(
+            'workflow_fila_tarefas', 'Processos na fila (disponiveis) e reservados por etapa',
+            labels=['etapa', 'nome', 'situacao'],
+        )
+        espera = GaugeMetricFamily(
+            'workflow_fila_espera_segundos', 'Espera dos processos na fila por etapa (média e máxima)',
+            labels=['etapa', 'nome', 'medida'],
+        )
+        try:
+            linhas = resumo()
+        except Exception:
+            logger.exception('Falha ao ler a fila de tarefas para as métricas')
+            return
+        for linha in linhas:
+            etapa, nome = str(linha['etapa_id']), linha['etapa']
+            tarefas.add_metric([etapa, nome, 'disponiveis'], linha['disponiveis'])
+            tarefas.add_metric([etapa, nome, 'reservadas'], linha['reservadas'])
+            for medida in ('media', 'maxima'):
+                valor = linha[f'espera_{medida}']
+                if valor is not None:
+                    espera.add_metric([etapa, nome, medida], valor.total_seconds())
+        yield tarefas
+        yield espera
@@ -0,0 +1,195 @@
+# processos/fluxo.py
+"""
+Motor de fluxo: para qual etapa um processo vai depois da etapa atual.
+
+Cada template é compilado numa tabela de transições
+``(etapa_id, condição) -> etapa de destino`` (``FIM``: o processo é concluído):
+
+- encaminhamentos ativos com condição em rótulo (``Aprovado``, ``Rejeitado``...):
+  a execução com esse resultado segue para o destino configurado;
+- encaminhamentos com condição em expressão (processos/condicoes.py), na ordem
+  em que foram criados: o primeiro que vale para a execução decide;
+- encaminhamento ativo sem condição: o destino padrão da etapa;
+- sem encaminhamento padrão: a etapa seguinte na ordem (``ordem + 1``), ou o fim.
+
+A execução de etapas (individual e em lote), o encaminhamento e as ações do
+admin consultam a mesma tabela. Ela fica compilada na memória de cada worker
+(``CacheLocal``) e é descartada pelo barramento de invalidação quando etapas ou
+encaminhamentos mudam; depois disso, cada decisão é uma busca num dicionário.
+O contador ``workflow_transicoes_total`` mostra os caminhos mais percorridos.
+"""
+import logging
+import time
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+
+from django.db.models import F, Window
+from django.db.models.functions import Lead
+
+from workflow import metricas
+from workflow.invalidacao import CacheLocal, ao_invalidar
+from . import condicoes
+from .models import Encaminhamento, Etapa, EtapaExecutada
+
+logger = logging.getLogger(__name__)
+
+# Destino que conclui o processo
+FIM = None
+
+def normalizar_condicao(condicao: str | None) -> str:
+    """``'Precisa Revisão'`` -> ``'PRECISA_REVISAO'``; resultados como ``APROVADO`` não mudam"""
+    if not condicao:
+        return ''
+    sem_acentos = unicodedata.normalize('NFKD', condicao).encode('ascii', 'ignore').decode()
+    return '_'.join(sem_acentos.upper().split())
+
+
+@dataclass(frozen=True)
+class Fluxo:
+    """Tabela de transições compilada de um template"""
+    template_id: int
+    nomes: dict[int, str]
+    # (etapa, condição normalizada) -> destino, dos encaminhamentos com condição em rótulo
+    condicionais: dict[tuple[int, str], int | None] = field(default_factory=dict)
+    # etapa -> [(expressão compilada, destino, id do encaminhamento)], na ordem de criação
+    expressoes: dict[int, list[tuple[condicoes.Condicao, int, int]]] = field(default_factory=dict)
+    # etapa -> destino sem condição (encaminhamento padrão ou próxima na ordem)
+    padrao: dict[int, int | None] = field(default_factory=dict)
+    # etapa -> {destino: condição} que o encaminhamento manual pode escolher
+    destinos: dict[int, dict[int, str]] = field(default_factory=dict)
+
+    def proxima(self, etapa_id: int, condicao: str | None = None, contexto: dict | None = None) -> int | None:
+        """
+        Destino depois de ``etapa_id`` com o resultado/condição (``FIM`` conclui).
+        ``contexto`` (``condicoes.contexto``) é usado pelas expressões.
+        """
+        chave = (etapa_id, normalizar_condicao(condicao))
+        if chave in self.condicionais:
+            return self.condicionais[chave]
+        if etapa_id in self.expressoes:
+            contexto = contexto if contexto is not None else condicoes.contexto(condicao)
+            for expressao, alvo, _ in self.expressoes[etapa_id]:
+                if expressao.avaliar(contexto):
+                    return alvo
+        return self.padrao.get(etapa_id, FIM)
+
+    def usa_processo(self, etapa_id: int) -> bool:
+        """Alguma expressão da etapa lê campos do processo (o contexto precisa deles)"""
+        return any(expressao.usa_processo for expressao, _, _ in self.expressoes.get(etapa_id, ()))
+
+    def registrar(self, origem: int, destino: int | None, condicao: str | None = None, quantidade: int = 1):
+        """Conta a transição percorrida (métrica por template, origem, destino e condição)"""
+        metricas.TRANSICOES.labels(
+            str(self.template_id), str(origem), 'fim' if destino is FIM else str(destino),
+            normalizar_condicao(condicao) or '-',
+        ).inc(quantidade)
+
+
+def compilar(template_id: int) -> Fluxo:
+    """Monta a tabela de transições do template (duas consultas)"""
+    etapas = list(Etapa.objects.filter(template_id=template_id).order_by().values_list('id', 'nome', 'ordem'))
+    encaminhamentos = Encaminhamento.objects.filter(
+        etapa_origem__template_id=template_id, ativo=True,
+    ).order_by('id').values_list('id', 'etapa_origem_id', 'etapa_destino_id', 'condicao')
+
+    por_ordem = {ordem: etapa_id for etapa_id, _, ordem in etapas}
+    fluxo = Fluxo(template_id=template_id, nomes={etapa_id: nome for etapa_id, nome, _ in etapas})
+    for etapa_id, _, ordem in etapas:
+        fluxo.padrao[etapa_id] = por_ordem.get(ordem + 1, FIM)
+
+    for encaminhamento_id, origem, destino, condicao in encaminhamentos:
+        fluxo.destinos.setdefault(origem, {})[destino] = condicao
+        if not condicao.strip():
+            fluxo.padrao[origem] = destino
+        elif condicoes.eh_rotulo(condicao):
+            fluxo.condicionais.setdefault((origem, normalizar_condicao(condicao)), destino)
+        else:
+            try:
+                expressao = condicoes.compilar(condicao)
+            except condicoes.ErroCondicao as e:
+                # Gravada por fora do admin (que valida): o encaminhamento é ignorado
+                logger.warning('Encaminhamento %s ignorado: %s', encaminhamento_id, e)
+                continue
+            fluxo.expressoes.setdefault(origem, []).append((expressao, destino, encaminhamento_id))
+
+    # Sem encaminhamentos configurados, o manual só pode ir para a etapa padrão
+    for etapa_id, destino in fluxo.padrao.items():
+        if etapa_id not in fluxo.destinos and destino is not None:  # FIM
+            fluxo.destinos[etapa_id] = {destino: ''}
+    return fluxo
+
+
+# ==================== CACHE ====================
+
+_fluxos = CacheLocal('template')
+_templates_das_etapas = CacheLocal('etapa')
+
+
+@ao_invalidar('etapa')
+@ao_invalidar('encaminhamento')
+def _descartar_fluxos(ident):
+    # Uma etapa ou encaminhamento muda a tabela do template inteiro
+    _fluxos.invalidar()
+
+
+def do_template(template_id: int) -> Fluxo:
+    return _fluxos.obter(template_id, lambda: compilar(template_id))
+
+
+def da_etapa(etapa_id: int) -> Fluxo | None:
+    """Fluxo do template da etapa (``None`` se a etapa não existe)"""
+    template_id = _templates_das_etapas.obter(
+        etapa_id, lambda: Etapa.objects.filter(pk=etapa_id).values_list('template_id', flat=True).order_by().first(),
+    )
+    return None if template_id is None else do_template(template_id)
+
+
+# ==================== SIMULAÇÃO ====================
+
+def historico(template_id: int, limite: int = 5000) -> list[tuple[int, int | None, dict]]:
+    """
+    As últimas ``limite`` execuções do template como ``(etapa, etapa executada
+    em seguida no processo, contexto)``; a seguinte é ``FIM`` se o processo
+    terminou ali e ``'aberto'`` se ele ainda está nessa etapa.
+    O contexto usa os campos atuais do processo (não há histórico deles).
+    """
+    campos = {f'processo__{campo}': campo for campo in condicoes.CAMPOS_PROCESSO}
+    linhas = EtapaExecutada.objects.filter(etapa__template_id=template_id).annotate(
+        seguinte=Window(Lead('etapa_id'), partition_by=[F('processo_id')], order_by=[F('data_inicio'), F('id')]),
+    ).order_by('-id').values('etapa_id', 'resultado', 'observacoes', 'data_inicio', 'seguinte', *campos)[:limite]
+
+    execucoes = []
+    for linha in linhas:
+        processo = {campo: linha[lookup] for lookup, campo in campos.items()}
+        seguinte = linha['seguinte']
+        if seguinte is None:
+            seguinte = FIM if processo['status'] == 'CONCLUIDO' else 'aberto'
+        contexto = condicoes.contexto(linha['resultado'], linha['observacoes'], processo, em=linha['data_inicio'])
+        execucoes.append((linha['etapa_id'], seguinte, contexto))
+    return execucoes
+
+
+def simular(tabela: Fluxo, execucoes) -> dict:
+    """
+    Roteia as ``execucoes`` (``historico()``) pela ``tabela``, sem gravar nada.
+
+    Retorna quantas vezes cada transição ``(origem, destino)`` seria usada,
+    as ``divergencias`` ``(origem, destino real, destino simulado)`` e o tempo
+    médio de decisão em microssegundos.
+    """
+    transicoes, divergencias = Counter(), Counter()
+    inicio = time.perf_counter()
+    destinos = [tabela.proxima(etapa_id, contexto['resultado'], contexto) for etapa_id, _, contexto in execucoes]
+    segundos = time.perf_counter() - inicio
+
+    for (etapa_id, seguinte, _), destino in zip(execucoes, destinos):
+        transicoes[(etapa_id, destino)] += 1
+        if seguinte != 'aberto' and seguinte != destino:
+            divergencias[(etapa_id, seguinte, destino)] += 1
+    return {
+        'execucoes': len(execucoes),
+        'transicoes': transicoes,
+        'divergencias': divergencias,
+        'microssegundos': segundos / len(execucoes) * 1e6 if execucoes else 0.0,
+    }
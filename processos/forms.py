@@ -1,10 +1,12 @@
 from django import forms
+from django.db.models import Q
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from .models import (
     TemplateProcesso, Etapa, Encaminhamento, 
     ProcessoInstancia, EtapaExecutada, Documento
 )
 from usuarios.models import Usuario
+from . import cache, fluxo
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Submit, Row, Column, Div, Field
 
@@ -33,7 +35,7 @@ class EtapaForm(forms.ModelForm):
         model = Etapa
         fields = [
             'nome', 'descricao', 'tipo', 'ordem', 'prazo_dias',
-            'permite_anexos', 'requer_aprovacao', 'usuarios_permitidos'
+            'permite_anexos', 'requer_aprovacao', 'usuarios_permitidos', 'atribuicao'
         ]
         widgets = {
             'descricao': forms.Textarea(attrs={'rows': 3}),
@@ -49,8 +51,7 @@ class EtapaForm(forms.ModelForm):
             
             # Sugere automaticamente a próxima ordem
             if not self.instance.pk:  # Apenas para novas etapas
-                ultima_etapa = Etapa.objects.filter(template=template).order_by('-ordem').first()
-                proxima_ordem = (ultima_etapa.ordem + 1) if ultima_etapa else 1
+                proxima_ordem = cache.proxima_ordem(template.pk)
                 self.fields['ordem'].initial = proxima_ordem
                 self.fields['ordem'].help_text = f'Deixe como {proxima_ordem} para adicionar ao final, ou escolha outra ordem'
         
@@ -84,6 +85,7 @@ class EtapaForm(forms.ModelForm):
                 ),
             ),
             'usuarios_permitidos',
+            'atribuicao',
         )
         self.helper.add_input(Submit('submit', 'Salvar Etapa', css_class='btn btn-primary'))
 
@@ -134,6 +136,10 @@ class ProcessoInstanciaForm(forms.ModelForm):
 
 class EtapaExecutadaForm(forms.ModelForm):
     """Form para execução de etapa"""
+    # Etapa que o usuário está executando: o destino é decidido para ela
+    etapa_id = forms.IntegerField(widget=forms.HiddenInput, required=False)
+    # Versão do processo lida ao abrir o formulário (concorrência otimista)
+    versao = forms.IntegerField(widget=forms.HiddenInput, required=False)
     
     class Meta:
         model = EtapaExecutada
@@ -149,6 +155,34 @@ class EtapaExecutadaForm(forms.ModelForm):
         self.helper.add_input(Submit('submit', 'Concluir Etapa', css_class='btn btn-success'))
 
 
+class IdsProcessosField(forms.Field):
+    """Lista de ids de processos (checkboxes ``processos`` da listagem)"""
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        try:
+            return list(dict.fromkeys(int(pk) for pk in value or []))
+        except (TypeError, ValueError):
+            raise forms.ValidationError('Ids de processos inválidos.')
+
+
+class ExecucaoLoteForm(forms.Form):
+    """Form para executar a etapa atual de vários processos de uma vez"""
+    processos = IdsProcessosField(label='Processos', error_messages={'required': 'Selecione ao menos um processo.'})
+    resultado = forms.ChoiceField(label='Resultado', choices=EtapaExecutada.RESULTADO_CHOICES, initial='APROVADO')
+    observacoes = forms.CharField(label='Observações', required=False)
+
+    def __init__(self, *args, maximo=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.maximo = maximo
+
+    def clean_processos(self):
+        processos = self.cleaned_data['processos']
+        if self.maximo and len(processos) > self.maximo:
+            raise forms.ValidationError(f'Selecione no máximo {self.maximo} processos por vez.')
+        return processos
+
+
 class DocumentoForm(forms.ModelForm):
     """Form para upload de documentos"""
     
@@ -211,9 +245,17 @@ class ProcessoFiltroForm(forms.Form):
         required=False,
         widget=forms.DateInput(attrs={'type': 'date'})
     )
+    conteudo = forms.CharField(
+        label='Conteúdo dos Anexos',
+        max_length=200,
+        required=False,
+        widget=forms.TextInput(attrs={'placeholder': 'Texto dentro dos documentos'})
+    )
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # Opções do cache; a validação ainda usa o queryset do campo
+        self.fields['template'].choices = [('', 'Todos')] + cache.opcoes_templates()
         self.helper = FormHelper()
         self.helper.form_method = 'get'
         self.helper.layout = Layout(
@@ -225,6 +267,7 @@ class ProcessoFiltroForm(forms.Form):
             Row(
                 Column('criado_por', css_class='col-md-4'),
                 Column('usuario_atual', css_class='col-md-4'),
+                Column('conteudo', css_class='col-md-4'),
             ),
             Row(
                 Column('data_inicio', css_class='col-md-6'),
@@ -245,32 +288,39 @@ class EncaminharProcessoForm(forms.Form):
     )
     usuario_destino = forms.ModelChoiceField(
         label='Usuário Responsável',
-        queryset=Usuario.objects.filter(is_active=True),
-        required=True
+        queryset=Usuario.objects.none(),
+        required=False,
+        empty_label='Automático (atribuição da etapa)'
     )
     observacoes = forms.CharField(
         label='Observações',
         widget=forms.Textarea(attrs={'rows': 3}),
         required=False
     )
+    versao = forms.IntegerField(widget=forms.HiddenInput, required=False)
     
     def __init__(self, *args, **kwargs):
         etapa_atual = kwargs.pop('etapa_atual', None)
         super().__init__(*args, **kwargs)
+        self.destinos = {}
         
         if etapa_atual:
-            # Busca encaminhamentos possíveis
-            encaminhamentos = etapa_atual.get_encaminhamentos_possiveis()
-            etapas_destino = [enc.etapa_destino.id for enc in encaminhamentos]
-            
-            if etapas_destino:
-                self.fields['proxima_etapa'].queryset = Etapa.objects.filter(id__in=etapas_destino)
-            else:
-                # Se não há encaminhamentos definidos, permite ir para próxima etapa sequencial
-                proxima = etapa_atual.get_proxima_etapa()
-                if proxima:
-                    self.fields['proxima_etapa'].queryset = Etapa.objects.filter(id=proxima.id)
+            # Destinos da tabela de transições: os encaminhamentos ativos ou,
+            # sem nenhum definido, a próxima etapa sequencial
+            self.destinos = fluxo.do_template(etapa_atual.template_id).destinos.get(etapa_atual.pk, {})
+            self.fields['proxima_etapa'].queryset = Etapa.objects.filter(id__in=list(self.destinos))
+            self.fields['usuario_destino'].queryset = Usuario.objects.filter(
+                Q(etapas_permitidas__in=list(self.destinos)) | Q(perfil='ADMIN'), is_active=True,
+            ).distinct()
         
         self.helper = FormHelper()
         self.helper.form_method = 'post'
         self.helper.add_input(Submit('submit', 'Encaminhar', css_class='btn btn-success'))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        proxima_etapa = cleaned_data.get('proxima_etapa')
+        usuario_destino = cleaned_data.get('usuario_destino')
+        if proxima_etapa and usuario_destino and not usuario_destino.pode_executar_etapa(proxima_etapa):
+            self.add_error('usuario_destino', 'Este usuário não pode executar a etapa escolhida.')
+        return cleaned_data
@@ -0,0 +1,218 @@
+"""
+Comando de benchmarks de desempenho
+"""
+import http.client
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def _rss_mb(pid):
+    """Memória residente do processo e dos filhos (ex: master + workers do gunicorn)"""
+    total_kb = 0
+    pendentes = [pid]
+    while pendentes:
+        atual = pendentes.pop()
+        for linha in Path(f'/proc/{atual}/status').read_text().splitlines():
+            if linha.startswith('VmRSS:'):
+                total_kb += int(linha.split()[1])
+        for filhos in Path(f'/proc/{atual}/task').glob('*/children'):
+            pendentes.extend(int(filho) for filho in filhos.read_text().split())
+    return total_kb / 1024
+
+
+def _cliente_http(url, cabecalhos, fim, tempos, erros):
+    """Faz GETs numa conexão keep-alive até ``fim``"""
+    partes = urlsplit(url)
+    caminho = partes.path + (f'?{partes.query}' if partes.query else '')
+    conexao = http.client.HTTPConnection(partes.hostname, partes.port or 80, timeout=30)
+    while time.perf_counter() < fim:
+        inicio = time.perf_counter()
+        try:
+            conexao.request('GET', caminho, headers=cabecalhos)
+            resposta = conexao.getresponse()
+            resposta.read()
+            if resposta.status != 200:
+                erros.append(resposta.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            erros.append(type(e).__name__)
+            conexao.close()
+            conexao = http.client.HTTPConnection(partes.hostname, partes.port or 80, timeout=30)
+            continue
+        tempos.append(time.perf_counter() - inicio)
+    conexao.close()
+
+
+class Command(BaseCommand):
+    help = 'Executa benchmarks de desempenho (ex: conexoes, http)'
+
+    CENARIOS = ['conexoes', 'http', 'execucao']
+
+    def add_arguments(self, parser):
+        parser.add_argument('cenario', choices=self.CENARIOS)
+        parser.add_argument('--iteracoes', type=int, default=300)
+        # Cenário http: carga contra um servidor já rodando (gunicorn WSGI ou ASGI)
+        parser.add_argument('--url', default='http://127.0.0.1:8000/processos/processos/')
+        parser.add_argument('--concorrencia', type=int, default=20)
+        parser.add_argument('--duracao', type=float, default=10.0, help='Segundos de carga')
+        parser.add_argument('--usuario', help='Username usado para criar a sessão das requisições')
+        parser.add_argument('--pid', type=int, help='PID do master do gunicorn, para medir a memória')
+
+    def _resumo(self, titulo, tempos):
+        ms = [t * 1000 for t in tempos]
+        self.stdout.write(
+            f'{titulo:<32} p50={_percentil(ms, 50):7.2f}ms  p95={_percentil(ms, 95):7.2f}ms  '
+            f'média={statistics.mean(ms):7.2f}ms  ({len(ms) / (sum(tempos) or 1):.0f}/s)'
+        )
+        return _percentil(ms, 50)
+
+    def _simular_requisicoes(self, iteracoes, max_age):
+        """Ciclo de requisição: sinais request_started/finished + consultas típicas"""
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        tempos = []
+        for _ in range(iteracoes):
+            inicio = time.perf_counter()
+            close_old_connections()
+            with connection.cursor() as cursor:
+                # Duas consultas leves, como sessão + usuário em toda requisição autenticada
+                cursor.execute('SELECT 1')
+                cursor.execute('SELECT count(*) FROM processos_processoinstancia')
+            close_old_connections()
+            tempos.append(time.perf_counter() - inicio)
+        connection.close()
+        return tempos
+
+    def cenario_conexoes(self, options):
+        iteracoes = options['iteracoes']
+        max_age_original = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            sem_pool = self._simular_requisicoes(iteracoes, 0)
+            com_pool = self._simular_requisicoes(iteracoes, 600)
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = max_age_original
+
+        p50_sem = self._resumo('CONN_MAX_AGE=0 (sem reuso)', sem_pool)
+        p50_com = self._resumo('CONN_MAX_AGE=600 (persistente)', com_pool)
+        self.stdout.write(self.style.SUCCESS(
+            f'\nOverhead de conexão removido do p50: {p50_sem - p50_com:.2f}ms por requisição'
+        ))
+
+    def _cookie_sessao(self, username):
+        """Cria uma sessão autenticada como o login faria"""
+        try:
+            usuario = get_user_model().objects.get(username=username)
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'Usuário "{username}" não encontrado')
+        sessao = import_module(settings.SESSION_ENGINE).SessionStore()
+        sessao[SESSION_KEY] = str(usuario.pk)
+        sessao[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        sessao[HASH_SESSION_KEY] = usuario.get_session_auth_hash()
+        sessao.save()
+        return f'{settings.SESSION_COOKIE_NAME}={sessao.session_key}'
+
+    def cenario_http(self, options):
+        """Requisições/s e latência de uma URL sob carga concorrente, com a memória do servidor"""
+        cabecalhos = {}
+        if options['usuario']:
+            cabecalhos['Cookie'] = self._cookie_sessao(options['usuario'])
+
+        tempos, erros = [], []
+        fim = time.perf_counter() + options['duracao']
+        with ThreadPoolExecutor(options['concorrencia']) as executor:
+            for _ in range(options['concorrencia']):
+                executor.submit(_cliente_http, options['url'], cabecalhos, fim, tempos, erros)
+
+        if not tempos:
+            raise CommandError(f'Nenhuma requisição bem sucedida (erros: {erros[:5]})')
+        self._resumo(f'{options["concorrencia"]} clientes', tempos)
+        self.stdout.write(f'Requisições/s: {len(tempos) / options["duracao"]:.1f}  erros: {len(erros)}')
+        if options['pid']:
+            self.stdout.write(f'Memória do servidor (RSS master + workers): {_rss_mb(options["pid"]):.0f} MB')
+
+    def _execucao_orm(self, processo_id, usuario):
+        """Execução de etapa como a view fazia antes do sp_executar_etapa"""
+        from processos.models import EtapaExecutada, LogAuditoria, ProcessoInstancia
+        from processos.services import notificar_processo
+
+        processo = ProcessoInstancia.objects.get(pk=processo_id)
+        if not processo.pode_ser_executado_por(usuario):
+            raise CommandError('Usuário sem permissão na etapa do benchmark')
+        execucao = EtapaExecutada(processo=processo, etapa=processo.etapa_atual, executado_por=usuario)
+        execucao.save()
+        execucao.concluir(resultado='APROVADO', observacoes='')
+        proxima_etapa = processo.etapa_atual.get_proxima_etapa()
+        processo.etapa_atual = proxima_etapa
+        processo.usuario_atual = usuario
+        processo.save()
+        notificar_processo(processo.id, usuario.pk, 'avancou')
+        LogAuditoria.objects.create(
+            processo=processo, usuario=usuario, acao='ENCAMINHAMENTO',
+            descricao=f'Processo avançou automaticamente para: {proxima_etapa.nome}',
+        )
+
+    def cenario_execucao(self, options):
+        """Execuções de etapa/s: ORM (antes) x sp_executar_etapa, com dados descartados no fim"""
+        from processos.models import Etapa, ProcessoInstancia, TemplateProcesso
+        from processos.services import executar_etapa
+
+        iteracoes = options['iteracoes']
+        with transaction.atomic():
+            usuario = get_user_model().objects.create(username='benchmark-execucao', perfil='OPERADOR')
+            template = TemplateProcesso.objects.create(nome='Benchmark execução', criado_por=usuario)
+            etapa = Etapa.objects.create(template=template, nome='Etapa 1', ordem=1)
+            Etapa.objects.create(template=template, nome='Etapa 2', ordem=2)
+            etapa.usuarios_permitidos.add(usuario)
+            processos = ProcessoInstancia.objects.bulk_create([
+                ProcessoInstancia(
+                    template=template, numero_processo=f'BENCH-{i}', titulo=f'Benchmark {i}',
+                    status='EM_ANDAMENTO', etapa_atual=etapa, usuario_atual=usuario, criado_por=usuario,
+                )
+                for i in range(2 * iteracoes)
+            ])
+            usuario = get_user_model().objects.get(pk=usuario.pk)
+
+            resultados = []
+            for titulo, executar, lote in (
+                ('ORM (view anterior)', lambda pk: self._execucao_orm(pk, usuario), processos[:iteracoes]),
+                (
+                    'sp_executar_etapa',
+                    lambda pk: executar_etapa(pk, usuario.pk, 'APROVADO', etapa_id=etapa.pk),
+                    processos[iteracoes:],
+                ),
+            ):
+                tempos = []
+                with CaptureQueriesContext(connection) as consultas:
+                    for processo in lote:
+                        inicio = time.perf_counter()
+                        executar(processo.pk)
+                        tempos.append(time.perf_counter() - inicio)
+                self._resumo(titulo, tempos)
+                self.stdout.write(f'{"":<32} consultas por execução: {len(consultas) / iteracoes:.1f}')
+                resultados.append(len(tempos) / sum(tempos))
+
+            # Nada do benchmark fica no banco (nem as notificações, que só saem no commit)
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nExecuções/s: {resultados[0]:.0f} -> {resultados[1]:.0f} ({resultados[1] / resultados[0]:.1f}x)'
+        ))
+
+    def handle(self, *args, **options):
+        getattr(self, f'cenario_{options["cenario"]}')(options)
@@ -0,0 +1,58 @@
+"""
+Comando para rodar o collectstatic só quando os arquivos estáticos mudaram
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+# Fica em STATIC_ROOT, ao lado do staticfiles.json gerado pelo collectstatic
+ARQUIVO_IMPRESSAO = '.origem.sha256'
+
+
+def impressao_digital() -> str:
+    """Hash dos caminhos e conteúdos de todos os estáticos de origem e do storage configurado"""
+    digest = hashlib.sha256(settings.STORAGES['staticfiles']['BACKEND'].encode())
+    arquivos = {}
+    for finder in get_finders():
+        for caminho, storage in finder.list(['CVS', '.*', '*~']):
+            # Como no collectstatic, o primeiro finder que tem o arquivo vence
+            arquivos.setdefault(caminho, storage)
+    for caminho in sorted(arquivos):
+        digest.update(caminho.encode())
+        with arquivos[caminho].open(caminho) as arquivo:
+            for bloco in iter(lambda: arquivo.read(1024 * 1024), b''):
+                digest.update(bloco)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = 'Roda o collectstatic se os estáticos de origem mudaram desde a última coleta'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--forcar',
+            action='store_true',
+            help='Coleta mesmo que nada tenha mudado',
+        )
+
+    def handle(self, *args, **options):
+        atual = impressao_digital()
+        caminho_impressao = os.path.join(settings.STATIC_ROOT, ARQUIVO_IMPRESSAO)
+        try:
+            with open(caminho_impressao) as arquivo:
+                anterior = arquivo.read().strip()
+        except FileNotFoundError:
+            anterior = None
+
+        if atual == anterior and not options['forcar']:
+            self.stdout.write(self.style.SUCCESS('Estáticos inalterados, collectstatic ignorado'))
+            return
+
+        call_command('collectstatic', interactive=False, verbosity=options['verbosity'])
+        with open(caminho_impressao, 'w') as arquivo:
+            arquivo.write(atual)
+        self.stdout.write(self.style.SUCCESS('✅ Estáticos coletados'))
@@ -2,49 +2,64 @@
 Comando para corrigir ordens duplicadas de etapas
 """
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from processos.models import Etapa, TemplateProcesso
+from django.db import connection, transaction
+
+
+# Ordem correta: 1, 2, 3... por template, mantendo a sequência atual (empates pelo id)
+SQL_NOVAS_ORDENS = """
+    WITH novas AS (
+        SELECT id, ordem AS antiga, ROW_NUMBER() OVER (PARTITION BY template_id ORDER BY ordem, id) AS nova
+        FROM processos_etapa
+    )
+"""
+
+SQL_DIFERENCAS = SQL_NOVAS_ORDENS + """
+    SELECT t.nome, e.nome, n.antiga, n.nova
+    FROM novas n
+    JOIN processos_etapa e ON e.id = n.id
+    JOIN processos_templateprocesso t ON t.id = e.template_id
+    WHERE n.antiga <> n.nova
+    ORDER BY t.nome, t.id, n.nova
+"""
+
+# Um único UPDATE para todos os templates: a unicidade de (template, ordem)
+# só é conferida no commit, então as trocas no meio do comando não colidem
+SQL_CORRIGIR = SQL_NOVAS_ORDENS + """
+    UPDATE processos_etapa e SET ordem = n.nova
+    FROM novas n
+    WHERE e.id = n.id AND n.antiga <> n.nova
+    RETURNING (SELECT nome FROM processos_templateprocesso WHERE id = e.template_id), e.nome, n.antiga, n.nova
+"""
 
 
 class Command(BaseCommand):
     help = 'Corrige ordens duplicadas de etapas em templates'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Mostra as mudanças sem gravar')
+
     def handle(self, *args, **options):
         self.stdout.write(self.style.WARNING('Verificando etapas duplicadas...'))
-        
-        # Busca todos os templates
-        templates = TemplateProcesso.objects.all()
-        
-        total_corrigidos = 0
-        
-        for template in templates:
-            self.stdout.write(f'\nProcessando template: {template.nome}')
-            
-            # Busca todas as etapas do template ordenadas
-            etapas = Etapa.objects.filter(template=template).order_by('ordem', 'id')
-            
-            if not etapas.exists():
-                self.stdout.write(self.style.WARNING('  Sem etapas'))
-                continue
-            
-            with transaction.atomic():
-                # Renumera todas as etapas sequencialmente
-                for idx, etapa in enumerate(etapas, start=1):
-                    if etapa.ordem != idx:
-                        self.stdout.write(
-                            self.style.WARNING(
-                                f'  Corrigindo: Etapa "{etapa.nome}" - Ordem {etapa.ordem} → {idx}'
-                            )
-                        )
-                        etapa.ordem = idx
-                        etapa.save(update_fields=['ordem'])
-                        total_corrigidos += 1
-                    else:
-                        self.stdout.write(
-                            self.style.SUCCESS(f'  OK: Etapa "{etapa.nome}" - Ordem {etapa.ordem}')
-                        )
-        
-        if total_corrigidos > 0:
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(SQL_DIFERENCAS if options['dry_run'] else SQL_CORRIGIR)
+            corrigidas = sorted(cursor.fetchall(), key=lambda linha: (linha[0], linha[3]))
+
+        template_atual = None
+        for template, etapa, antiga, nova in corrigidas:
+            if template != template_atual:
+                self.stdout.write(f'\nProcessando template: {template}')
+                template_atual = template
+            self.stdout.write(
+                self.style.WARNING(f'  Corrigindo: Etapa "{etapa}" - Ordem {antiga} → {nova}')
+            )
+
+        total_corrigidos = len(corrigidas)
+        if options['dry_run']:
+            self.stdout.write(
+                self.style.SUCCESS(f'\n{total_corrigidos} etapa(s) seriam corrigidas (nada foi gravado).')
+            )
+        elif total_corrigidos > 0:
             self.stdout.write(
                 self.style.SUCCESS(
                     f'\n✅ {total_corrigidos} etapa(s) corrigida(s) com sucesso!'
@@ -1,59 +1,131 @@
 """
 Comando para corrigir números de processo duplicados
 """
-from django.core.management.base import BaseCommand
-from django.db import transaction
-from processos.models import ProcessoInstancia
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+
+# Numeração correta de cada processo: sequencial por ano de criação (UTC, como
+# o ``save`` do modelo). Só entram os que mudam, já divididos em lotes por id.
+SQL_MAPEAMENTO = """
+    CREATE TEMP TABLE numeracao_nova AS
+    SELECT id, numero_processo AS atual, novo, ano,
+           ((ROW_NUMBER() OVER (ORDER BY id) - 1) / %(lote)s)::INT AS lote
+    FROM (
+        SELECT id, numero_processo, ano, LPAD(n::TEXT, GREATEST(6, LENGTH(n::TEXT)), '0') || '/' || ano AS novo
+        FROM (
+            SELECT id, numero_processo,
+                   EXTRACT(YEAR FROM data_criacao AT TIME ZONE 'UTC')::INT AS ano,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY EXTRACT(YEAR FROM data_criacao AT TIME ZONE 'UTC')
+                       ORDER BY data_criacao, id
+                   ) AS n
+            FROM processos_processoinstancia
+        ) numerados
+    ) calculados
+    WHERE numero_processo IS DISTINCT FROM novo
+"""
+
+# Algum número novo ainda está com outro processo (que também vai mudar)
+SQL_CONFLITOS = """
+    SELECT EXISTS (
+        SELECT 1 FROM numeracao_nova m JOIN processos_processoinstancia p ON p.numero_processo = m.novo
+    )
+"""
+
+# Número provisório, único por id, para liberar os números que trocam de dono
+PROVISORIO = "'renumerando-' || p.id"
+
+SQL_PROVISORIO = f"""
+    UPDATE processos_processoinstancia p SET numero_processo = {PROVISORIO}
+    FROM numeracao_nova m
+    WHERE m.lote = %s AND p.id = m.id AND p.numero_processo = m.atual
+"""
+
+SQL_APLICAR = """
+    UPDATE processos_processoinstancia p SET numero_processo = m.novo
+    FROM numeracao_nova m
+    WHERE m.lote = %s AND p.id = m.id AND p.numero_processo = {esperado}
+"""
 
 
 class Command(BaseCommand):
-    help = 'Corrige números de processo duplicados no banco de dados'
+    help = (
+        'Corrige números de processo duplicados no banco de dados, renumerando por ano de criação '
+        'em lotes (cada lote na sua transação)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Mostra as mudanças sem gravar')
+        parser.add_argument('--lote', type=int, default=5000, help='Processos por transação')
 
     def handle(self, *args, **options):
+        if options['lote'] < 1:
+            raise CommandError('--lote deve ser pelo menos 1.')
         self.stdout.write(self.style.WARNING('Verificando processos duplicados...'))
-        
-        # Busca todos os processos ordenados por data
-        processos = ProcessoInstancia.objects.all().order_by('data_criacao')
-        
-        # Agrupa por ano
-        processos_por_ano = {}
-        for processo in processos:
-            ano = processo.data_criacao.year
-            if ano not in processos_por_ano:
-                processos_por_ano[ano] = []
-            processos_por_ano[ano].append(processo)
-        
-        total_corrigidos = 0
-        
-        with transaction.atomic():
-            for ano, lista_processos in processos_por_ano.items():
-                self.stdout.write(f'\nProcessando ano {ano}...')
-                
-                # Renumera todos os processos do ano
-                for idx, processo in enumerate(lista_processos, start=1):
-                    novo_numero = f"{idx:06d}/{ano}"
-                    
-                    if processo.numero_processo != novo_numero:
-                        self.stdout.write(
-                            self.style.WARNING(
-                                f'  Corrigindo: {processo.numero_processo} → {novo_numero}'
-                            )
-                        )
-                        processo.numero_processo = novo_numero
-                        processo.save(update_fields=['numero_processo'])
-                        total_corrigidos += 1
-                    else:
-                        self.stdout.write(
-                            self.style.SUCCESS(f'  OK: {processo.numero_processo}')
-                        )
-        
-        if total_corrigidos > 0:
+
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS numeracao_nova')
+            cursor.execute(SQL_MAPEAMENTO, {'lote': options['lote']})
+            cursor.execute('CREATE INDEX ON numeracao_nova (lote)')
+            cursor.execute('ANALYZE numeracao_nova')
+            try:
+                cursor.execute('SELECT ano, COUNT(*) FROM numeracao_nova GROUP BY ano ORDER BY ano')
+                por_ano = cursor.fetchall()
+                total = sum(quantidade for _, quantidade in por_ano)
+                for ano, quantidade in por_ano:
+                    self.stdout.write(f'Ano {ano}: {quantidade} processo(s) a corrigir')
+
+                if options['dry_run'] or options['verbosity'] >= 2:
+                    self._mostrar_diferencas()
+                if options['dry_run']:
+                    self.stdout.write(self.style.SUCCESS(f'\n{total} processo(s) seriam corrigidos (nada foi gravado).'))
+                    return
+                corrigidos = self._aplicar(cursor, total)
+            finally:
+                cursor.execute('DROP TABLE IF EXISTS numeracao_nova')
+
+        if corrigidos > 0:
             self.stdout.write(
                 self.style.SUCCESS(
-                    f'\n✅ {total_corrigidos} processo(s) corrigido(s) com sucesso!'
+                    f'\n✅ {corrigidos} processo(s) corrigido(s) com sucesso!'
                 )
             )
         else:
             self.stdout.write(
                 self.style.SUCCESS('\n✅ Nenhum processo precisou ser corrigido!')
             )
+
+    def _mostrar_diferencas(self):
+        # Cursor no servidor: as diferenças vêm aos poucos, sem carregar a tabela
+        with transaction.atomic(), connection.chunked_cursor() as cursor:
+            cursor.execute('SELECT atual, novo FROM numeracao_nova ORDER BY ano, novo')
+            for atual, novo in cursor:
+                self.stdout.write(self.style.WARNING(f'  Corrigindo: {atual} → {novo}'))
+
+    def _aplicar(self, cursor, total):
+        if not total:
+            return 0
+        cursor.execute('SELECT MAX(lote) + 1 FROM numeracao_nova')
+        lotes = cursor.fetchone()[0]
+        cursor.execute(SQL_CONFLITOS)
+        # Só passa pelo número provisório se algum número muda de dono
+        provisorio = cursor.fetchone()[0]
+        if provisorio:
+            for lote in range(lotes):
+                with transaction.atomic():
+                    cursor.execute(SQL_PROVISORIO, [lote])
+                self.stdout.write(f'Liberando números: lote {lote + 1}/{lotes}')
+
+        esperado = PROVISORIO if provisorio else 'm.atual'
+        corrigidos = 0
+        for lote in range(lotes):
+            with transaction.atomic():
+                cursor.execute(SQL_APLICAR.format(esperado=esperado), [lote])
+                corrigidos += cursor.rowcount
+            self.stdout.write(f'Lote {lote + 1}/{lotes}: {corrigidos}/{total} processo(s) corrigido(s)')
+        if corrigidos < total:
+            self.stdout.write(self.style.WARNING(
+                f'{total - corrigidos} processo(s) mudaram durante a correção e ficaram como estavam; rode de novo.'
+            ))
+        return corrigidos
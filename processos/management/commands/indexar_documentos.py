@@ -0,0 +1,32 @@
+"""
+Comando para (re)indexar o texto dos documentos anexados
+"""
+from django.core.management.base import BaseCommand
+from processos.extracao import indexar_documento
+from processos.models import Documento
+
+
+class Command(BaseCommand):
+    help = 'Extrai o texto dos documentos pendentes e atualiza o índice de busca'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todos',
+            action='store_true',
+            help='Reindexa todos os documentos, não apenas os pendentes',
+        )
+
+    def handle(self, *args, **options):
+        documentos = Documento.objects.all()
+        if not options['todos']:
+            documentos = documentos.filter(indexado_em__isnull=True)
+
+        ids = list(documentos.order_by('id').values_list('id', flat=True))
+        self.stdout.write(self.style.WARNING(f'Indexando {len(ids)} documento(s)...'))
+
+        for idx, documento_id in enumerate(ids, start=1):
+            indexar_documento(documento_id)
+            if idx % 100 == 0:
+                self.stdout.write(f'  {idx}/{len(ids)}')
+
+        self.stdout.write(self.style.SUCCESS(f'\n✅ {len(ids)} documento(s) indexado(s)!'))
@@ -0,0 +1,125 @@
+"""
+Comando para gerar o relatório das consultas mais caras (pg_stat_statements)
+"""
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError
+
+RE_ORIGEM = re.compile(r"/\*\s*origem='([^']*)'.*?\*/")
+RE_COMENTARIO = re.compile(r'/\*.*?\*/', re.S)
+RE_LISTA = re.compile(r'\(\s*(?:\?|\$\d+)(?:\s*,\s*(?:\?|\$\d+))*\s*\)')
+RE_PARAMETRO = re.compile(r'\$\d+')
+RE_NUMERO = re.compile(r'\b\d+(?:\.\d+)?\b')
+RE_STRING = re.compile(r"'(?:[^']|'')*'")
+RE_ESPACOS = re.compile(r'\s+')
+
+SQL_ESTATISTICAS = """
+    SELECT s.queryid, s.query, s.calls, s.total_exec_time, s.mean_exec_time, s.rows
+    FROM pg_stat_statements s
+    JOIN pg_database d ON d.oid = s.dbid
+    WHERE d.datname = current_database()
+    ORDER BY {ordem} DESC
+    LIMIT %s
+"""
+
+
+def extrair_origem(sql: str) -> str:
+    """Retorna a origem marcada no comentário da consulta (workflow.marcacao_sql)"""
+    match = RE_ORIGEM.search(sql)
+    return match.group(1) if match else 'desconhecida'
+
+
+def normalizar_sql(sql: str) -> str:
+    """Remove comentários e literais para comparar consultas entre versões"""
+    sql = RE_COMENTARIO.sub(' ', sql)
+    sql = RE_STRING.sub('?', sql)
+    sql = RE_PARAMETRO.sub('?', sql)
+    sql = RE_NUMERO.sub('?', sql)
+    sql = RE_LISTA.sub('(...)', sql)
+    return RE_ESPACOS.sub(' ', sql).strip().rstrip(';')
+
+
+class Command(BaseCommand):
+    help = 'Lista as consultas mais caras do pg_stat_statements atribuídas à view/serviço de origem'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=20, help='Quantidade de consultas por ranking')
+        parser.add_argument('--formato', choices=['tabela', 'json'], default='tabela')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            '--zerar',
+            action='store_true',
+            help='Zera as estatísticas após gerar o relatório (pg_stat_statements_reset)',
+        )
+
+    def _buscar(self, cursor, ordem, limite):
+        cursor.execute(SQL_ESTATISTICAS.format(ordem=ordem), [limite])
+        consultas = {}
+        for queryid, query, calls, total, media, linhas in cursor.fetchall():
+            origem = extrair_origem(query)
+            sql = normalizar_sql(query)
+            chave = (origem, sql)
+            # queryids diferentes podem virar a mesma consulta normalizada
+            atual = consultas.setdefault(chave, {
+                'origem': origem,
+                'sql': sql,
+                'chamadas': 0,
+                'tempo_total_ms': 0.0,
+                'linhas': 0,
+            })
+            atual['chamadas'] += calls
+            atual['tempo_total_ms'] += total
+            atual['linhas'] += linhas
+
+        resultado = []
+        for item in consultas.values():
+            item['tempo_medio_ms'] = round(item['tempo_total_ms'] / item['chamadas'], 3) if item['chamadas'] else 0.0
+            item['tempo_total_ms'] = round(item['tempo_total_ms'], 3)
+            resultado.append(item)
+        campo = 'tempo_total_ms' if ordem == 'total_exec_time' else 'tempo_medio_ms'
+        resultado.sort(key=lambda item: (-item[campo], item['origem'], item['sql']))
+        for posicao, item in enumerate(resultado, start=1):
+            item['posicao'] = posicao
+        return resultado
+
+    def _imprimir_tabela(self, titulo, consultas):
+        self.stdout.write(self.style.WARNING(f'\n{titulo}'))
+        self.stdout.write(f'{"#":>3} {"total (ms)":>12} {"média (ms)":>11} {"chamadas":>9}  origem / sql')
+        for item in consultas:
+            self.stdout.write(
+                f'{item["posicao"]:>3} {item["tempo_total_ms"]:>12.1f} {item["tempo_medio_ms"]:>11.2f} '
+                f'{item["chamadas"]:>9}  {item["origem"]}'
+            )
+            self.stdout.write(f'{"":>39}{item["sql"][:160]}')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        try:
+            with connection.cursor() as cursor:
+                por_total = self._buscar(cursor, 'total_exec_time', options['limite'])
+                por_media = self._buscar(cursor, 'mean_exec_time', options['limite'])
+                if options['zerar']:
+                    cursor.execute('SELECT pg_stat_statements_reset()')
+        except DatabaseError as e:
+            raise CommandError(
+                'Não foi possível ler o pg_stat_statements. Verifique se a extensão está carregada '
+                '(shared_preload_libraries) e criada: CREATE EXTENSION IF NOT EXISTS pg_stat_statements; '
+                f'({e})'
+            )
+
+        if options['formato'] == 'json':
+            self.stdout.write(json.dumps(
+                {'por_tempo_total': por_total, 'por_tempo_medio': por_media},
+                ensure_ascii=False, indent=2, sort_keys=True,
+            ))
+            return
+
+        self._imprimir_tabela('Top consultas por tempo total', por_total)
+        self._imprimir_tabela('Top consultas por tempo médio', por_media)
+        self.stdout.write(
+            '\nObs: o pg_stat_statements guarda o texto da primeira execução de cada consulta, '
+            'então consultas idênticas vindas de origens diferentes aparecem com a primeira origem.'
+        )
@@ -0,0 +1,67 @@
+"""
+Comando para simular as condições de encaminhamento de um template contra o histórico
+"""
+import dataclasses
+
+from django.core.management.base import BaseCommand, CommandError
+
+from processos import condicoes, fluxo
+from processos.models import TemplateProcesso
+
+
+class Command(BaseCommand):
+    help = (
+        'Roteia as últimas execuções do template pela tabela de transições atual '
+        '(opcionalmente com uma condição nova) e mostra para onde cada uma iria, sem gravar nada'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('template_id', type=int)
+        parser.add_argument('--limite', type=int, default=5000, help='Quantidade de execuções (mais recentes)')
+        parser.add_argument('--condicao', help='Expressão de um encaminhamento novo a testar')
+        parser.add_argument('--origem', type=int, help='Etapa de origem do encaminhamento novo')
+        parser.add_argument('--destino', type=int, help='Etapa de destino do encaminhamento novo (omitido: fim)')
+
+    def handle(self, *args, **options):
+        template_id = options['template_id']
+        if not TemplateProcesso.objects.filter(pk=template_id).exists():
+            raise CommandError(f'Template {template_id} não encontrado')
+
+        tabela = fluxo.compilar(template_id)
+        if options['condicao']:
+            tabela = self._com_condicao(tabela, options)
+
+        execucoes = fluxo.historico(template_id, options['limite'])
+        resultado = fluxo.simular(tabela, execucoes)
+
+        def nome(etapa_id):
+            return 'fim' if etapa_id is fluxo.FIM else tabela.nomes.get(etapa_id, f'#{etapa_id}')
+
+        self.stdout.write(
+            f'{resultado["execucoes"]} execuções, {resultado["microssegundos"]:.2f} µs por decisão'
+        )
+        self.stdout.write(self.style.MIGRATE_HEADING('\nTransições simuladas'))
+        for (origem, destino), quantidade in resultado['transicoes'].most_common():
+            self.stdout.write(f'  {quantidade:>7}  {nome(origem)} → {nome(destino)}')
+
+        if resultado['divergencias']:
+            self.stdout.write(self.style.WARNING('\nDivergências (real → simulado)'))
+            for (origem, real, simulado), quantidade in resultado['divergencias'].most_common():
+                self.stdout.write(f'  {quantidade:>7}  {nome(origem)}: {nome(real)} → {nome(simulado)}')
+        else:
+            self.stdout.write(self.style.SUCCESS('\nNenhuma divergência do caminho real'))
+
+    def _com_condicao(self, tabela, options):
+        if options['origem'] not in tabela.nomes:
+            raise CommandError('--origem deve ser uma etapa do template')
+        if options['destino'] is not None and options['destino'] not in tabela.nomes:
+            raise CommandError('--destino deve ser uma etapa do template')
+        try:
+            expressao = condicoes.compilar(options['condicao'])
+        except condicoes.ErroCondicao as e:
+            raise CommandError(str(e))
+
+        # Como um encaminhamento recém-criado: testado depois das expressões existentes
+        expressoes = {etapa_id: list(lista) for etapa_id, lista in tabela.expressoes.items()}
+        expressoes.setdefault(options['origem'], []).append((expressao, options['destino'], None))
+        return dataclasses.replace(tabela, expressoes=expressoes)
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:30
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processos', '0006_create_mais_functions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documento',
+            name='conteudo_busca',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Conteúdo para busca'),
+        ),
+        migrations.AddField(
+            model_name='documento',
+            name='indexado_em',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Indexado em'),
+        ),
+        migrations.AddIndex(
+            model_name='documento',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['conteudo_busca'], name='documento_conteudo_gin'),
+        ),
+    ]
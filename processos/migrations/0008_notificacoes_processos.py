@@ -0,0 +1,119 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# Definições anteriores, usadas para desfazer a migração
+_procedures_0004 = dict(import_module('processos.migrations.0004_create_procedures').SQL_PROCEDURES)
+_funcao_0005 = import_module('processos.migrations.0005_create_functions').Migration.operations[0].sql
+
+# Eventos para o SSE de "Meus Processos" (processos/notificacoes.py).
+# pg_notify é transacional: o evento só sai no commit.
+SQL_NOTIFICAR = """
+CREATE OR REPLACE FUNCTION fn_notificar_processo(
+    p_processo_id BIGINT,
+    p_usuario_id BIGINT,
+    p_tipo TEXT
+)
+RETURNS VOID AS $$
+BEGIN
+    IF p_usuario_id IS NULL THEN
+        RETURN;
+    END IF;
+
+    PERFORM pg_notify('processos_eventos', json_build_object(
+        'tipo', p_tipo,
+        'processo_id', p.id,
+        'numero_processo', p.numero_processo,
+        'titulo', LEFT(p.titulo, 200),
+        'etapa', e.nome,
+        'usuario_id', p_usuario_id
+    )::text)
+    FROM processos_processoinstancia p
+    LEFT JOIN processos_etapa e ON e.id = p.etapa_atual_id
+    WHERE p.id = p_processo_id;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# Versão chamada pelo services.encaminhar_processo (callproc).
+# O INSERT em processos_encaminhamento foi removido: a tabela é a configuração
+# de fluxo (etapa_origem/etapa_destino/condicao), não um histórico, e o
+# registro já fica no log de auditoria.
+SQL_ENCAMINHAR_FUNCAO = """
+CREATE OR REPLACE FUNCTION sp_encaminhar_processo(
+    p_processo_id INT,
+    p_proxima_etapa_id INT,
+    p_usuario_id INT,
+    p_observacao TEXT DEFAULT NULL
+)
+RETURNS VOID AS $$
+BEGIN
+    UPDATE processos_processoinstancia
+    SET
+        etapa_atual_id = p_proxima_etapa_id,
+        usuario_atual_id = p_usuario_id,
+        data_atualizacao = NOW()
+    WHERE id = p_processo_id;
+
+    INSERT INTO processos_logauditoria (
+        processo_id,
+        usuario_id,
+        acao,
+        descricao,
+        data_hora
+    )
+    VALUES (
+        p_processo_id,
+        p_usuario_id,
+        'ENCAMINHAMENTO',
+        CONCAT('Encaminhado para etapa ID: ', p_proxima_etapa_id, ' - ', COALESCE(p_observacao, 'Encaminhado')),
+        NOW()
+    );
+
+    PERFORM fn_notificar_processo(p_processo_id, p_usuario_id, 'atribuido');
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+SQL_ENCAMINHAR_PROCEDURE = """
+CREATE OR REPLACE PROCEDURE sp_encaminhar_processo(
+    p_processo_id BIGINT,
+    p_proxima_etapa_id BIGINT,
+    p_usuario_id BIGINT,
+    p_condicao TEXT
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE processos_processoinstancia
+    SET etapa_atual_id = p_proxima_etapa_id,
+        status = 'EM_ANDAMENTO',
+        data_atualizacao = NOW(),
+        usuario_atual_id = p_usuario_id
+    WHERE id = p_processo_id;
+
+    INSERT INTO processos_logauditoria (processo_id, usuario_id, acao, descricao, data_hora)
+    VALUES (p_processo_id, p_usuario_id, 'ENCAMINHAMENTO',
+            CONCAT('Processo encaminhado para etapa ', p_proxima_etapa_id, ' via condição ', p_condicao),
+            NOW());
+
+    PERFORM fn_notificar_processo(p_processo_id, p_usuario_id, 'atribuido');
+END;
+$$;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processos', '0007_documento_conteudo_busca'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            SQL_NOTIFICAR,
+            reverse_sql="DROP FUNCTION IF EXISTS fn_notificar_processo(BIGINT, BIGINT, TEXT);",
+        ),
+        migrations.RunSQL(SQL_ENCAMINHAR_FUNCAO, reverse_sql=_funcao_0005),
+        migrations.RunSQL(SQL_ENCAMINHAR_PROCEDURE, reverse_sql=_procedures_0004['sp_encaminhar_processo']),
+    ]
@@ -0,0 +1,74 @@
+from django.db import migrations
+
+# Barramento de invalidação de cache entre nós (workflow/invalidacao.py).
+# Cada escrita nas tabelas de configuração incrementa a versão do grupo e
+# publica "grupo:id:versao" no canal cache_invalidacao (entregue no commit).
+# Triggers em vez de sinais do Django para pegar também as escritas feitas
+# pelas procedures (sp_criar_etapa, sp_atualizar_etapa).
+
+SQL_INVALIDACAO = """
+CREATE TABLE IF NOT EXISTS cache_versao (
+    grupo TEXT PRIMARY KEY,
+    versao BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION fn_publicar_invalidacao()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_grupo TEXT := TG_ARGV[0];
+    v_coluna TEXT := COALESCE(TG_ARGV[1], 'id');
+    v_linha JSONB;
+    v_versao BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        v_linha := to_jsonb(OLD);
+    ELSE
+        v_linha := to_jsonb(NEW);
+    END IF;
+
+    INSERT INTO cache_versao (grupo, versao) VALUES (v_grupo, 1)
+    ON CONFLICT (grupo) DO UPDATE SET versao = cache_versao.versao + 1
+    RETURNING versao INTO v_versao;
+
+    PERFORM pg_notify('cache_invalidacao', CONCAT(v_grupo, ':', v_linha ->> v_coluna, ':', v_versao));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# (tabela, grupo, coluna com o id do objeto do grupo)
+TABELAS = [
+    ('processos_templateprocesso', 'template', 'id'),
+    ('processos_etapa', 'etapa', 'id'),
+    ('processos_etapa_usuarios_permitidos', 'etapa', 'etapa_id'),
+    ('processos_encaminhamento', 'encaminhamento', 'id'),
+    ('usuarios_usuario', 'usuario', 'id'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processos', '0008_notificacoes_processos'),
+        ('usuarios', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            SQL_INVALIDACAO,
+            reverse_sql="""
+                DROP FUNCTION IF EXISTS fn_publicar_invalidacao();
+                DROP TABLE IF EXISTS cache_versao;
+            """,
+        ),
+    ] + [
+        migrations.RunSQL(
+            f"""
+            CREATE TRIGGER trg_invalidacao_{tabela}
+            AFTER INSERT OR UPDATE OR DELETE ON {tabela}
+            FOR EACH ROW EXECUTE FUNCTION fn_publicar_invalidacao('{grupo}', '{coluna}');
+            """,
+            reverse_sql=f"DROP TRIGGER IF EXISTS trg_invalidacao_{tabela} ON {tabela};",
+        )
+        for tabela, grupo, coluna in TABELAS
+    ]
@@ -0,0 +1,129 @@
+from django.db import migrations
+
+# Versões em lote de sp_encaminhar_processo, sp_cancelar_processo e
+# sp_finalizar_processo: recebem arrays de ids (e, no encaminhamento, arrays
+# paralelos de etapas e usuários) e fazem cada UPDATE/INSERT uma vez para o
+# lote inteiro, em vez de uma chamada por processo.
+# Retornam os ids efetivamente alterados (processos inexistentes, ou já
+# concluídos/cancelados no caso do cancelamento e da finalização, ficam de fora).
+# Como na versão individual corrigida (0008), não há INSERT em
+# processos_encaminhamento: o registro do encaminhamento é o log de auditoria.
+
+SQL_ENCAMINHAR_LOTE = """
+CREATE OR REPLACE FUNCTION sp_encaminhar_processos(
+    p_processo_ids BIGINT[],
+    p_proxima_etapa_ids BIGINT[],
+    p_usuario_ids BIGINT[],
+    p_observacao TEXT DEFAULT NULL
+)
+RETURNS SETOF BIGINT AS $$
+DECLARE
+    v_ids BIGINT[];
+BEGIN
+    IF cardinality(p_processo_ids) <> cardinality(p_proxima_etapa_ids)
+       OR cardinality(p_processo_ids) <> cardinality(p_usuario_ids) THEN
+        RAISE EXCEPTION 'sp_encaminhar_processos: arrays de tamanhos diferentes';
+    END IF;
+
+    WITH alvo AS (
+        SELECT *
+        FROM unnest(p_processo_ids, p_proxima_etapa_ids, p_usuario_ids) AS a(processo_id, etapa_id, usuario_id)
+    ), atualizados AS (
+        UPDATE processos_processoinstancia p
+        SET etapa_atual_id = a.etapa_id,
+            usuario_atual_id = a.usuario_id,
+            data_atualizacao = NOW()
+        FROM alvo a
+        WHERE p.id = a.processo_id
+        RETURNING p.id, a.etapa_id, a.usuario_id
+    ), logs AS (
+        INSERT INTO processos_logauditoria (processo_id, usuario_id, acao, descricao, data_hora)
+        SELECT id, usuario_id, 'ENCAMINHAMENTO',
+               CONCAT('Encaminhado para etapa ID: ', etapa_id, ' - ', COALESCE(p_observacao, 'Encaminhado')),
+               NOW()
+        FROM atualizados
+    )
+    SELECT COALESCE(array_agg(id), '{}') INTO v_ids FROM atualizados;
+
+    -- Comando separado: enxerga a etapa nova de cada processo
+    PERFORM fn_notificar_processo(p.id, p.usuario_atual_id, 'atribuido')
+    FROM processos_processoinstancia p
+    WHERE p.id = ANY(v_ids);
+
+    RETURN QUERY SELECT unnest(v_ids);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+SQL_CANCELAR_LOTE = """
+CREATE OR REPLACE FUNCTION sp_cancelar_processos(p_processo_ids BIGINT[], p_usuario_id BIGINT)
+RETURNS SETOF BIGINT AS $$
+DECLARE
+    v_ids BIGINT[];
+BEGIN
+    WITH atualizados AS (
+        UPDATE processos_processoinstancia
+        SET status = 'CANCELADO', data_atualizacao = NOW()
+        WHERE id = ANY(p_processo_ids)
+          AND status NOT IN ('CONCLUIDO', 'CANCELADO')
+        RETURNING id
+    ), logs AS (
+        INSERT INTO processos_logauditoria (processo_id, usuario_id, acao, descricao, data_hora)
+        SELECT id, p_usuario_id, 'CANCELAMENTO', 'Processo cancelado pelo usuário', NOW()
+        FROM atualizados
+    )
+    SELECT COALESCE(array_agg(id), '{}') INTO v_ids FROM atualizados;
+
+    UPDATE processos_etapaexecutada
+    SET resultado = 'CANCELADO'
+    WHERE processo_id = ANY(v_ids);
+
+    RETURN QUERY SELECT unnest(v_ids);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+SQL_FINALIZAR_LOTE = """
+CREATE OR REPLACE FUNCTION sp_finalizar_processos(p_processo_ids BIGINT[])
+RETURNS SETOF BIGINT AS $$
+BEGIN
+    RETURN QUERY
+    WITH atualizados AS (
+        UPDATE processos_processoinstancia
+        SET status = 'CONCLUIDO',
+            data_conclusao = NOW(),
+            data_atualizacao = NOW()
+        WHERE id = ANY(p_processo_ids)
+          AND status NOT IN ('CONCLUIDO', 'CANCELADO')
+        RETURNING id
+    ), logs AS (
+        INSERT INTO processos_logauditoria (processo_id, acao, descricao, data_hora)
+        SELECT id, 'CONCLUSAO', 'Processo concluído automaticamente', NOW()
+        FROM atualizados
+    )
+    SELECT id FROM atualizados;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processos', '0009_invalidacao_cache'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            SQL_ENCAMINHAR_LOTE,
+            reverse_sql="DROP FUNCTION IF EXISTS sp_encaminhar_processos(BIGINT[], BIGINT[], BIGINT[], TEXT);",
+        ),
+        migrations.RunSQL(
+            SQL_CANCELAR_LOTE,
+            reverse_sql="DROP FUNCTION IF EXISTS sp_cancelar_processos(BIGINT[], BIGINT);",
+        ),
+        migrations.RunSQL(
+            SQL_FINALIZAR_LOTE,
+            reverse_sql="DROP FUNCTION IF EXISTS sp_finalizar_processos(BIGINT[]);",
+        ),
+    ]
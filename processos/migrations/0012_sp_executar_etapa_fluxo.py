@@ -0,0 +1,152 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# Definição anterior, usada para desfazer a migração
+_sql_0011 = import_module('processos.migrations.0011_sp_executar_etapa').SQL_EXECUTAR_ETAPA
+
+# sp_executar_etapa passa a receber o destino decidido pelo motor de fluxo
+# (processos/fluxo.py) em vez de calcular ``ordem + 1``: p_etapa_id é a etapa
+# para a qual o destino foi decidido e p_proxima_etapa_id o destino (NULL conclui).
+# Se o processo não está mais em p_etapa_id (outra pessoa executou antes),
+# retorna ETAPA_MUDOU sem gravar nada.
+
+SQL_EXECUTAR_ETAPA = """
+CREATE OR REPLACE FUNCTION sp_executar_etapa(
+    p_processo_id BIGINT,
+    p_usuario_id BIGINT,
+    p_etapa_id BIGINT,
+    p_proxima_etapa_id BIGINT,
+    p_resultado TEXT,
+    p_observacoes TEXT DEFAULT ''
+)
+RETURNS TABLE (
+    situacao TEXT,
+    status TEXT,
+    etapa_atual_id BIGINT,
+    etapa_atual_nome TEXT,
+    etapa_executada_id BIGINT
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_processo RECORD;
+    v_proxima RECORD;
+    v_execucao_id BIGINT;
+BEGIN
+    SELECT p.id, p.status, p.template_id, p.usuario_atual_id, p.etapa_atual_id, e.nome AS etapa_nome
+    INTO v_processo
+    FROM processos_processoinstancia p
+    LEFT JOIN processos_etapa e ON e.id = p.etapa_atual_id
+    WHERE p.id = p_processo_id
+    FOR UPDATE OF p;
+
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'NAO_ENCONTRADO'::TEXT, NULL::TEXT, NULL::BIGINT, NULL::TEXT, NULL::BIGINT;
+        RETURN;
+    END IF;
+
+    IF v_processo.etapa_atual_id IS NULL OR v_processo.status IN ('CONCLUIDO', 'CANCELADO') THEN
+        RETURN QUERY SELECT 'SEM_ETAPA'::TEXT, v_processo.status::TEXT, v_processo.etapa_atual_id::BIGINT,
+                            v_processo.etapa_nome::TEXT, NULL::BIGINT;
+        RETURN;
+    END IF;
+
+    -- O destino foi decidido para p_etapa_id: se o processo já saiu dela, nada é gravado
+    IF v_processo.etapa_atual_id IS DISTINCT FROM p_etapa_id THEN
+        RETURN QUERY SELECT 'ETAPA_MUDOU'::TEXT, v_processo.status::TEXT, v_processo.etapa_atual_id::BIGINT,
+                            v_processo.etapa_nome::TEXT, NULL::BIGINT;
+        RETURN;
+    END IF;
+
+    -- Mesma regra de Usuario.pode_executar_etapa
+    IF NOT EXISTS (SELECT 1 FROM usuarios_usuario WHERE id = p_usuario_id AND perfil = 'ADMIN')
+       AND NOT EXISTS (
+           SELECT 1 FROM processos_etapa_usuarios_permitidos
+           WHERE etapa_id = v_processo.etapa_atual_id AND usuario_id = p_usuario_id
+       ) THEN
+        RETURN QUERY SELECT 'SEM_PERMISSAO'::TEXT, v_processo.status::TEXT, v_processo.etapa_atual_id::BIGINT,
+                            v_processo.etapa_nome::TEXT, NULL::BIGINT;
+        RETURN;
+    END IF;
+
+    INSERT INTO processos_etapaexecutada (
+        processo_id, etapa_id, executado_por_id, observacoes, resultado,
+        data_inicio, data_conclusao, tempo_execucao
+    )
+    VALUES (
+        p_processo_id, v_processo.etapa_atual_id, p_usuario_id, COALESCE(p_observacoes, ''), p_resultado,
+        NOW(), NOW(), INTERVAL '0'
+    )
+    RETURNING id INTO v_execucao_id;
+
+    INSERT INTO processos_logauditoria (processo_id, etapa_executada_id, usuario_id, acao, descricao, data_hora)
+    VALUES (
+        p_processo_id, v_execucao_id, p_usuario_id, 'EXECUCAO_ETAPA',
+        CONCAT('Etapa "', v_processo.etapa_nome, '" concluída com resultado: ',
+               CASE p_resultado
+                   WHEN 'APROVADO' THEN 'Aprovado'
+                   WHEN 'REJEITADO' THEN 'Rejeitado'
+                   WHEN 'PENDENTE' THEN 'Pendente'
+                   WHEN 'CONCLUIDO' THEN 'Concluído'
+                   ELSE p_resultado
+               END),
+        NOW()
+    );
+
+    SELECT id, nome INTO v_proxima
+    FROM processos_etapa
+    WHERE id = p_proxima_etapa_id AND template_id = v_processo.template_id;
+
+    IF p_proxima_etapa_id IS NOT NULL AND NOT FOUND THEN
+        RAISE EXCEPTION 'sp_executar_etapa: etapa de destino % não pertence ao template do processo', p_proxima_etapa_id;
+    END IF;
+
+    IF FOUND THEN
+        UPDATE processos_processoinstancia
+        SET etapa_atual_id = v_proxima.id,
+            usuario_atual_id = p_usuario_id,
+            data_atualizacao = NOW()
+        WHERE id = p_processo_id;
+
+        INSERT INTO processos_logauditoria (processo_id, usuario_id, acao, descricao, data_hora)
+        VALUES (p_processo_id, p_usuario_id, 'ENCAMINHAMENTO',
+                CONCAT('Processo avançou automaticamente para: ', v_proxima.nome), NOW());
+
+        PERFORM fn_notificar_processo(p_processo_id, p_usuario_id, 'avancou');
+
+        RETURN QUERY SELECT 'AVANCOU'::TEXT, v_processo.status::TEXT, v_proxima.id::BIGINT,
+                            v_proxima.nome::TEXT, v_execucao_id;
+    ELSE
+        UPDATE processos_processoinstancia
+        SET status = 'CONCLUIDO',
+            data_conclusao = NOW(),
+            etapa_atual_id = NULL,
+            usuario_atual_id = NULL,
+            data_atualizacao = NOW()
+        WHERE id = p_processo_id;
+
+        PERFORM fn_notificar_processo(p_processo_id, v_processo.usuario_atual_id, 'concluido');
+
+        RETURN QUERY SELECT 'CONCLUIDO'::TEXT, 'CONCLUIDO'::TEXT, NULL::BIGINT, NULL::TEXT, v_execucao_id;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processos', '0011_sp_executar_etapa'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "DROP FUNCTION IF EXISTS sp_executar_etapa(BIGINT, BIGINT, TEXT, TEXT);",
+            reverse_sql=_sql_0011,
+        ),
+        migrations.RunSQL(
+            SQL_EXECUTAR_ETAPA,
+            reverse_sql="DROP FUNCTION IF EXISTS sp_executar_etapa(BIGINT, BIGINT, BIGINT, BIGINT, TEXT, TEXT);",
+        ),
+    ]
@@ -0,0 +1,253 @@
+from importlib import import_module
+
+from django.db import migrations, models
+
+# Definições anteriores, usadas para desfazer a migração
+_sql_0012 = import_module('processos.migrations.0012_sp_executar_etapa_fluxo').SQL_EXECUTAR_ETAPA
+_encaminhar_0008 = import_module('processos.migrations.0008_notificacoes_processos').SQL_ENCAMINHAR_FUNCAO
+
+# Controle de concorrência otimista em processos_processoinstancia.
+# Todo UPDATE incrementa ``versao`` (trigger, para pegar também as procedures e
+# os UPDATEs em lote); quem leu o processo para montar um formulário manda a
+# versão lida e a escrita só acontece se ela ainda é a atual. Assim nenhuma
+# linha fica travada enquanto o usuário preenche o formulário.
+
+SQL_VERSAO = """
+CREATE OR REPLACE FUNCTION fn_incrementar_versao()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.versao := OLD.versao + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_versao_processoinstancia
+BEFORE UPDATE ON processos_processoinstancia
+FOR EACH ROW EXECUTE FUNCTION fn_incrementar_versao();
+"""
+
+# p_versao: versão lida pelo formulário. Se o processo mudou desde então,
+# retorna CONFLITO sem gravar nada (ETAPA_MUDOU continua tendo prioridade).
+# A coluna ``versao`` do retorno é a versão atual do processo.
+SQL_EXECUTAR_ETAPA = """
+CREATE OR REPLACE FUNCTION sp_executar_etapa(
+    p_processo_id BIGINT,
+    p_usuario_id BIGINT,
+    p_etapa_id BIGINT,
+    p_proxima_etapa_id BIGINT,
+    p_resultado TEXT,
+    p_observacoes TEXT DEFAULT '',
+    p_versao INT DEFAULT NULL
+)
+RETURNS TABLE (
+    situacao TEXT,
+    status TEXT,
+    etapa_atual_id BIGINT,
+    etapa_atual_nome TEXT,
+    etapa_executada_id BIGINT,
+    versao INT
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_processo RECORD;
+    v_proxima RECORD;
+    v_execucao_id BIGINT;
+BEGIN
+    SELECT p.id, p.status, p.template_id, p.usuario_atual_id, p.etapa_atual_id, p.versao, e.nome AS etapa_nome
+    INTO v_processo
+    FROM processos_processoinstancia p
+    LEFT JOIN processos_etapa e ON e.id = p.etapa_atual_id
+    WHERE p.id = p_processo_id
+    FOR UPDATE OF p;
+
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'NAO_ENCONTRADO'::TEXT, NULL::TEXT, NULL::BIGINT, NULL::TEXT, NULL::BIGINT, NULL::INT;
+        RETURN;
+    END IF;
+
+    IF v_processo.etapa_atual_id IS NULL OR v_processo.status IN ('CONCLUIDO', 'CANCELADO') THEN
+        RETURN QUERY SELECT 'SEM_ETAPA'::TEXT, v_processo.status::TEXT, v_processo.etapa_atual_id::BIGINT,
+                            v_processo.etapa_nome::TEXT, NULL::BIGINT, v_processo.versao;
+        RETURN;
+    END IF;
+
+    -- O destino foi decidido para p_etapa_id: se o processo já saiu dela, nada é gravado
+    IF v_processo.etapa_atual_id IS DISTINCT FROM p_etapa_id THEN
+        RETURN QUERY SELECT 'ETAPA_MUDOU'::TEXT, v_processo.status::TEXT, v_processo.etapa_atual_id::BIGINT,
+                            v_processo.etapa_nome::TEXT, NULL::BIGINT, v_processo.versao;
+        RETURN;
+    END IF;
+
+    -- O formulário foi preenchido sobre outra versão (reatribuído, cancelado...): repetir
+    IF p_versao IS NOT NULL AND v_processo.versao <> p_versao THEN
+        RETURN QUERY SELECT 'CONFLITO'::TEXT, v_processo.status::TEXT, v_processo.etapa_atual_id::BIGINT,
+                            v_processo.etapa_nome::TEXT, NULL::BIGINT, v_processo.versao;
+        RETURN;
+    END IF;
+
+    -- Mesma regra de Usuario.pode_executar_etapa
+    IF NOT EXISTS (SELECT 1 FROM usuarios_usuario WHERE id = p_usuario_id AND perfil = 'ADMIN')
+       AND NOT EXISTS (
+           SELECT 1 FROM processos_etapa_usuarios_permitidos
+           WHERE etapa_id = v_processo.etapa_atual_id AND usuario_id = p_usuario_id
+       ) THEN
+        RETURN QUERY SELECT 'SEM_PERMISSAO'::TEXT, v_processo.status::TEXT, v_processo.etapa_atual_id::BIGINT,
+                            v_processo.etapa_nome::TEXT, NULL::BIGINT, v_processo.versao;
+        RETURN;
+    END IF;
+
+    INSERT INTO processos_etapaexecutada (
+        processo_id, etapa_id, executado_por_id, observacoes, resultado,
+        data_inicio, data_conclusao, tempo_execucao
+    )
+    VALUES (
+        p_processo_id, v_processo.etapa_atual_id, p_usuario_id, COALESCE(p_observacoes, ''), p_resultado,
+        NOW(), NOW(), INTERVAL '0'
+    )
+    RETURNING id INTO v_execucao_id;
+
+    INSERT INTO processos_logauditoria (processo_id, etapa_executada_id, usuario_id, acao, descricao, data_hora)
+    VALUES (
+        p_processo_id, v_execucao_id, p_usuario_id, 'EXECUCAO_ETAPA',
+        CONCAT('Etapa "', v_processo.etapa_nome, '" concluída com resultado: ',
+               CASE p_resultado
+                   WHEN 'APROVADO' THEN 'Aprovado'
+                   WHEN 'REJEITADO' THEN 'Rejeitado'
+                   WHEN 'PENDENTE' THEN 'Pendente'
+                   WHEN 'CONCLUIDO' THEN 'Concluído'
+                   ELSE p_resultado
+               END),
+        NOW()
+    );
+
+    SELECT id, nome INTO v_proxima
+    FROM processos_etapa
+    WHERE id = p_proxima_etapa_id AND template_id = v_processo.template_id;
+
+    IF p_proxima_etapa_id IS NOT NULL AND NOT FOUND THEN
+        RAISE EXCEPTION 'sp_executar_etapa: etapa de destino % não pertence ao template do processo', p_proxima_etapa_id;
+    END IF;
+
+    IF FOUND THEN
+        UPDATE processos_processoinstancia
+        SET etapa_atual_id = v_proxima.id,
+            usuario_atual_id = p_usuario_id,
+            data_atualizacao = NOW()
+        WHERE id = p_processo_id;
+
+        INSERT INTO processos_logauditoria (processo_id, usuario_id, acao, descricao, data_hora)
+        VALUES (p_processo_id, p_usuario_id, 'ENCAMINHAMENTO',
+                CONCAT('Processo avançou automaticamente para: ', v_proxima.nome), NOW());
+
+        PERFORM fn_notificar_processo(p_processo_id, p_usuario_id, 'avancou');
+
+        RETURN QUERY SELECT 'AVANCOU'::TEXT, v_processo.status::TEXT, v_proxima.id::BIGINT,
+                            v_proxima.nome::TEXT, v_execucao_id, v_processo.versao + 1;
+    ELSE
+        UPDATE processos_processoinstancia
+        SET status = 'CONCLUIDO',
+            data_conclusao = NOW(),
+            etapa_atual_id = NULL,
+            usuario_atual_id = NULL,
+            data_atualizacao = NOW()
+        WHERE id = p_processo_id;
+
+        PERFORM fn_notificar_processo(p_processo_id, v_processo.usuario_atual_id, 'concluido');
+
+        RETURN QUERY SELECT 'CONCLUIDO'::TEXT, 'CONCLUIDO'::TEXT, NULL::BIGINT, NULL::TEXT, v_execucao_id,
+                            v_processo.versao + 1;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# p_versao: versão lida pelo formulário. Conflito vira serialization_failure
+# (SQLSTATE 40001), o erro que os clientes já tratam como "tente de novo".
+# Retorna a nova versão do processo.
+SQL_ENCAMINHAR_FUNCAO = """
+CREATE OR REPLACE FUNCTION sp_encaminhar_processo(
+    p_processo_id INT,
+    p_proxima_etapa_id INT,
+    p_usuario_id INT,
+    p_observacao TEXT DEFAULT NULL,
+    p_versao INT DEFAULT NULL
+)
+RETURNS INT AS $$
+DECLARE
+    v_versao INT;
+BEGIN
+    UPDATE processos_processoinstancia
+    SET
+        etapa_atual_id = p_proxima_etapa_id,
+        usuario_atual_id = p_usuario_id,
+        data_atualizacao = NOW()
+    WHERE id = p_processo_id
+      AND (p_versao IS NULL OR versao = p_versao)
+    RETURNING versao INTO v_versao;
+
+    IF NOT FOUND THEN
+        IF p_versao IS NOT NULL AND EXISTS (SELECT 1 FROM processos_processoinstancia WHERE id = p_processo_id) THEN
+            RAISE EXCEPTION 'Processo % foi alterado por outra pessoa (versão % desatualizada)', p_processo_id, p_versao
+                USING ERRCODE = 'serialization_failure';
+        END IF;
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO processos_logauditoria (
+        processo_id,
+        usuario_id,
+        acao,
+        descricao,
+        data_hora
+    )
+    VALUES (
+        p_processo_id,
+        p_usuario_id,
+        'ENCAMINHAMENTO',
+        CONCAT('Encaminhado para etapa ID: ', p_proxima_etapa_id, ' - ', COALESCE(p_observacao, 'Encaminhado')),
+        NOW()
+    );
+
+    PERFORM fn_notificar_processo(p_processo_id, p_usuario_id, 'atribuido');
+    RETURN v_versao;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processos', '0012_sp_executar_etapa_fluxo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processoinstancia',
+            name='versao',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='Versão'),
+        ),
+        migrations.RunSQL(
+            SQL_VERSAO,
+            reverse_sql="""
+                DROP TRIGGER IF EXISTS trg_versao_processoinstancia ON processos_processoinstancia;
+                DROP FUNCTION IF EXISTS fn_incrementar_versao();
+            """,
+        ),
+        migrations.RunSQL(
+            "DROP FUNCTION IF EXISTS sp_executar_etapa(BIGINT, BIGINT, BIGINT, BIGINT, TEXT, TEXT);",
+            reverse_sql=_sql_0012,
+        ),
+        migrations.RunSQL(
+            SQL_EXECUTAR_ETAPA,
+            reverse_sql="DROP FUNCTION IF EXISTS sp_executar_etapa(BIGINT, BIGINT, BIGINT, BIGINT, TEXT, TEXT, INT);",
+        ),
+        migrations.RunSQL(
+            "DROP FUNCTION IF EXISTS sp_encaminhar_processo(INT, INT, INT, TEXT);",
+            reverse_sql=_encaminhar_0008,
+        ),
+        migrations.RunSQL(
+            SQL_ENCAMINHAR_FUNCAO,
+            reverse_sql="DROP FUNCTION IF EXISTS sp_encaminhar_processo(INT, INT, INT, TEXT, INT);",
+        ),
+    ]
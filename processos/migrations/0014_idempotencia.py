@@ -0,0 +1,29 @@
+from django.db import migrations
+
+# Chaves de idempotência dos POSTs (workflow/idempotencia.py).
+# chave: 16 bytes do sha256 de usuário + view + argumentos + chave enviada;
+# status NULL enquanto a primeira requisição ainda roda. O índice em
+# criada_em serve à limpeza das chaves expiradas.
+
+SQL_IDEMPOTENCIA = """
+CREATE TABLE IF NOT EXISTS idempotencia_chave (
+    chave BYTEA PRIMARY KEY,
+    criada_em TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    status SMALLINT,
+    cabecalhos JSONB,
+    corpo BYTEA
+);
+
+CREATE INDEX IF NOT EXISTS idempotencia_chave_criada_em ON idempotencia_chave (criada_em);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processos', '0013_processo_versao'),
+    ]
+
+    operations = [
+        migrations.RunSQL(SQL_IDEMPOTENCIA, reverse_sql="DROP TABLE IF EXISTS idempotencia_chave;"),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+# Fila de tarefas (processos/fila.py). A trigger marca a entrada na etapa e
+# desfaz a reserva sempre que o processo muda de etapa ou termina, inclusive
+# pelas procedures e UPDATEs em lote.
+
+SQL_ENTRADA_ETAPA = """
+CREATE OR REPLACE FUNCTION fn_entrada_etapa()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.etapa_atual_id IS DISTINCT FROM OLD.etapa_atual_id OR NEW.status IS DISTINCT FROM OLD.status THEN
+        IF NEW.etapa_atual_id IS DISTINCT FROM OLD.etapa_atual_id THEN
+            NEW.data_entrada_etapa := NOW();
+        END IF;
+        NEW.reservado_por_id := NULL;
+        NEW.reservado_ate := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_entrada_etapa_processoinstancia
+BEFORE UPDATE ON processos_processoinstancia
+FOR EACH ROW EXECUTE FUNCTION fn_entrada_etapa();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('processos', '0014_idempotencia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processoinstancia',
+            name='data_entrada_etapa',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Na Etapa Desde'),
+        ),
+        migrations.AddField(
+            model_name='processoinstancia',
+            name='prioridade',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Normal'), (1, 'Alta'), (2, 'Urgente')], default=0, verbose_name='Prioridade'),
+        ),
+        migrations.AddField(
+            model_name='processoinstancia',
+            name='reservado_ate',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Reservado até'),
+        ),
+        migrations.AddField(
+            model_name='processoinstancia',
+            name='reservado_por',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tarefas_reservadas', to=settings.AUTH_USER_MODEL, verbose_name='Reservado por'),
+        ),
+        migrations.AddIndex(
+            model_name='processoinstancia',
+            index=models.Index(models.OrderBy(models.F('prioridade'), descending=True), models.F('data_entrada_etapa'), models.F('id'), condition=models.Q(('etapa_atual__isnull', False), ('status', 'EM_ANDAMENTO')), name='processo_fila_idx'),
+        ),
+        # Sem histórico da entrada na etapa: a última atualização é a melhor aproximação
+        migrations.RunSQL(
+            "UPDATE processos_processoinstancia SET data_entrada_etapa = data_atualizacao;",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            SQL_ENTRADA_ETAPA,
+            reverse_sql="""
+                DROP TRIGGER IF EXISTS trg_entrada_etapa_processoinstancia ON processos_processoinstancia;
+                DROP FUNCTION IF EXISTS fn_entrada_etapa();
+            """,
+        ),
+    ]
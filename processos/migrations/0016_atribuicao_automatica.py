@@ -0,0 +1,193 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:32
+
+from importlib import import_module
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Definição anterior, usada para desfazer a migração
+_encaminhar_0013 = import_module('processos.migrations.0013_processo_versao').SQL_ENCAMINHAR_FUNCAO
+
+# Atribuição automática (processos/atribuicao.py). A carga de cada usuário é
+# mantida por triggers de comando (FOR EACH STATEMENT com tabelas de transição):
+# um UPDATE em lote soma o saldo de cada usuário e atualiza uma linha por
+# usuário, na ordem do id, para que comandos concorrentes travem as linhas na
+# mesma ordem. O encaminhamento passa a receber o responsável separado de quem
+# encaminha (antes o processo ficava com quem encaminhou).
+
+SQL_CARGA = """
+CREATE OR REPLACE FUNCTION fn_carga_usuario()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_usuarios BIGINT[];
+    v_saldos INT[];
+    v_atribuidos BOOLEAN[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(usuario_atual_id), array_agg(1), array_agg(TRUE)
+        INTO v_usuarios, v_saldos, v_atribuidos
+        FROM novos
+        WHERE usuario_atual_id IS NOT NULL AND status NOT IN ('CONCLUIDO', 'CANCELADO');
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(usuario_atual_id), array_agg(-1), array_agg(FALSE)
+        INTO v_usuarios, v_saldos, v_atribuidos
+        FROM antigos
+        WHERE usuario_atual_id IS NOT NULL AND status NOT IN ('CONCLUIDO', 'CANCELADO');
+    ELSE
+        -- Só as linhas que mudaram de responsável ou abriram/fecharam
+        SELECT array_agg(m.usuario_id), array_agg(m.saldo), array_agg(m.atribuido)
+        INTO v_usuarios, v_saldos, v_atribuidos
+        FROM (
+            SELECT o.usuario_atual_id AS usuario_id, -1 AS saldo, FALSE AS atribuido
+            FROM antigos o JOIN novos n ON n.id = o.id
+            WHERE o.usuario_atual_id IS NOT NULL AND o.status NOT IN ('CONCLUIDO', 'CANCELADO')
+              AND (n.usuario_atual_id IS DISTINCT FROM o.usuario_atual_id OR n.status IN ('CONCLUIDO', 'CANCELADO'))
+            UNION ALL
+            SELECT n.usuario_atual_id, 1, n.usuario_atual_id IS DISTINCT FROM o.usuario_atual_id
+            FROM antigos o JOIN novos n ON n.id = o.id
+            WHERE n.usuario_atual_id IS NOT NULL AND n.status NOT IN ('CONCLUIDO', 'CANCELADO')
+              AND (n.usuario_atual_id IS DISTINCT FROM o.usuario_atual_id OR o.status IN ('CONCLUIDO', 'CANCELADO'))
+        ) m;
+    END IF;
+
+    IF v_usuarios IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO processos_cargausuario AS c (usuario_id, abertos, ultima_atribuicao)
+    SELECT usuario_id, SUM(saldo), CASE WHEN bool_or(atribuido) THEN NOW() END
+    FROM unnest(v_usuarios, v_saldos, v_atribuidos) AS m(usuario_id, saldo, atribuido)
+    GROUP BY usuario_id
+    ORDER BY usuario_id
+    ON CONFLICT (usuario_id) DO UPDATE
+        SET abertos = c.abertos + EXCLUDED.abertos,
+            ultima_atribuicao = COALESCE(EXCLUDED.ultima_atribuicao, c.ultima_atribuicao);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_carga_insert_processoinstancia
+AFTER INSERT ON processos_processoinstancia
+REFERENCING NEW TABLE AS novos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_carga_usuario();
+
+CREATE TRIGGER trg_carga_update_processoinstancia
+AFTER UPDATE ON processos_processoinstancia
+REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_carga_usuario();
+
+CREATE TRIGGER trg_carga_delete_processoinstancia
+AFTER DELETE ON processos_processoinstancia
+REFERENCING OLD TABLE AS antigos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_carga_usuario();
+"""
+
+SQL_CARGA_INICIAL = """
+INSERT INTO processos_cargausuario (usuario_id, abertos)
+SELECT usuario_atual_id, COUNT(*)
+FROM processos_processoinstancia
+WHERE usuario_atual_id IS NOT NULL AND status NOT IN ('CONCLUIDO', 'CANCELADO')
+GROUP BY usuario_atual_id;
+"""
+
+SQL_ENCAMINHAR_FUNCAO = """
+CREATE OR REPLACE FUNCTION sp_encaminhar_processo(
+    p_processo_id INT,
+    p_proxima_etapa_id INT,
+    p_usuario_id INT,
+    p_observacao TEXT DEFAULT NULL,
+    p_versao INT DEFAULT NULL,
+    p_responsavel_id INT DEFAULT NULL
+)
+RETURNS INT AS $$
+DECLARE
+    v_versao INT;
+    v_responsavel_id INT := COALESCE(p_responsavel_id, p_usuario_id);
+BEGIN
+    UPDATE processos_processoinstancia
+    SET
+        etapa_atual_id = p_proxima_etapa_id,
+        usuario_atual_id = v_responsavel_id,
+        data_atualizacao = NOW()
+    WHERE id = p_processo_id
+      AND (p_versao IS NULL OR versao = p_versao)
+    RETURNING versao INTO v_versao;
+
+    IF NOT FOUND THEN
+        IF p_versao IS NOT NULL AND EXISTS (SELECT 1 FROM processos_processoinstancia WHERE id = p_processo_id) THEN
+            RAISE EXCEPTION 'Processo % foi alterado por outra pessoa (versão % desatualizada)', p_processo_id, p_versao
+                USING ERRCODE = 'serialization_failure';
+        END IF;
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO processos_logauditoria (
+        processo_id,
+        usuario_id,
+        acao,
+        descricao,
+        data_hora
+    )
+    VALUES (
+        p_processo_id,
+        p_usuario_id,
+        'ENCAMINHAMENTO',
+        CONCAT(
+            'Encaminhado para etapa ID: ', p_proxima_etapa_id, ', responsável ID: ', v_responsavel_id,
+            ' - ', COALESCE(p_observacao, 'Encaminhado')
+        ),
+        NOW()
+    );
+
+    PERFORM fn_notificar_processo(p_processo_id, v_responsavel_id, 'atribuido');
+    RETURN v_versao;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0001_initial'),
+        ('processos', '0015_fila_tarefas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CargaUsuario',
+            fields=[
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='carga', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Usuário')),
+                ('abertos', models.IntegerField(default=0, verbose_name='Processos em Aberto')),
+                ('ultima_atribuicao', models.DateTimeField(blank=True, null=True, verbose_name='Última Atribuição')),
+            ],
+            options={
+                'verbose_name': 'Carga de Usuário',
+                'verbose_name_plural': 'Cargas de Usuários',
+            },
+        ),
+        migrations.AddField(
+            model_name='etapa',
+            name='atribuicao',
+            field=models.CharField(choices=[('MENOS_CARGA', 'Menos processos em aberto'), ('RODIZIO', 'Rodízio'), ('ULTIMO_EXECUTOR', 'Quem já executou a etapa no processo')], default='MENOS_CARGA', max_length=20, verbose_name='Atribuição Automática'),
+        ),
+        migrations.RunSQL(SQL_CARGA_INICIAL, reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(
+            SQL_CARGA,
+            reverse_sql="""
+                DROP TRIGGER IF EXISTS trg_carga_insert_processoinstancia ON processos_processoinstancia;
+                DROP TRIGGER IF EXISTS trg_carga_update_processoinstancia ON processos_processoinstancia;
+                DROP TRIGGER IF EXISTS trg_carga_delete_processoinstancia ON processos_processoinstancia;
+                DROP FUNCTION IF EXISTS fn_carga_usuario();
+            """,
+        ),
+        migrations.RunSQL(
+            "DROP FUNCTION IF EXISTS sp_encaminhar_processo(INT, INT, INT, TEXT, INT);",
+            reverse_sql=_encaminhar_0013,
+        ),
+        migrations.RunSQL(
+            SQL_ENCAMINHAR_FUNCAO,
+            reverse_sql="DROP FUNCTION IF EXISTS sp_encaminhar_processo(INT, INT, INT, TEXT, INT, INT);",
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:38
+
+from django.db import migrations, models
+import django.db.models.constraints
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processos', '0016_atribuicao_automatica'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='etapa',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='etapa',
+            constraint=models.UniqueConstraint(deferrable=django.db.models.constraints.Deferrable['DEFERRED'], fields=('template', 'ordem'), name='etapa_template_ordem_unica'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# O login grava ``last_login`` a cada autenticação, e nenhum cache usa essa
+# coluna: a trigger de UPDATE de usuarios_usuario (0009) passa a ignorar as
+# escritas que só mudam ``last_login``. Comparar a linha inteira sem ela (em
+# vez de listar colunas em UPDATE OF) faz colunas novas invalidarem sem mudar
+# a trigger. INSERT e DELETE continuam como antes.
+
+SQL_TRIGGERS = """
+DROP TRIGGER IF EXISTS trg_invalidacao_usuarios_usuario ON usuarios_usuario;
+
+CREATE TRIGGER trg_invalidacao_usuarios_usuario
+AFTER INSERT OR DELETE ON usuarios_usuario
+FOR EACH ROW EXECUTE FUNCTION fn_publicar_invalidacao('usuario', 'id');
+
+CREATE TRIGGER trg_invalidacao_usuarios_usuario_update
+AFTER UPDATE ON usuarios_usuario
+FOR EACH ROW
+WHEN ((to_jsonb(OLD) - 'last_login') IS DISTINCT FROM (to_jsonb(NEW) - 'last_login'))
+EXECUTE FUNCTION fn_publicar_invalidacao('usuario', 'id');
+"""
+
+SQL_TRIGGERS_0009 = """
+DROP TRIGGER IF EXISTS trg_invalidacao_usuarios_usuario_update ON usuarios_usuario;
+DROP TRIGGER IF EXISTS trg_invalidacao_usuarios_usuario ON usuarios_usuario;
+
+CREATE TRIGGER trg_invalidacao_usuarios_usuario
+AFTER INSERT OR UPDATE OR DELETE ON usuarios_usuario
+FOR EACH ROW EXECUTE FUNCTION fn_publicar_invalidacao('usuario', 'id');
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processos', '0018_reserva_execucao'),
+    ]
+
+    operations = [
+        migrations.RunSQL(SQL_TRIGGERS, reverse_sql=SQL_TRIGGERS_0009),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# Reservar, renovar ou liberar um processo na fila (processos/fila.py) não é
+# uma alteração do processo: o UPDATE que só mexe em ``reservado_por_id`` e
+# ``reservado_ate`` não incrementa ``versao`` (0013), senão o formulário aberto
+# por quem é responsável pelo processo daria CONFLITO depois de uma reserva.
+
+SQL_VERSAO = """
+CREATE OR REPLACE FUNCTION fn_incrementar_versao()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF (to_jsonb(NEW) - 'reservado_por_id' - 'reservado_ate' - 'versao')
+       IS NOT DISTINCT FROM (to_jsonb(OLD) - 'reservado_por_id' - 'reservado_ate' - 'versao') THEN
+        RETURN NEW;
+    END IF;
+    NEW.versao := OLD.versao + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+SQL_VERSAO_0013 = """
+CREATE OR REPLACE FUNCTION fn_incrementar_versao()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.versao := OLD.versao + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processos', '0019_invalidacao_sem_last_login'),
+    ]
+
+    operations = [
+        migrations.RunSQL(SQL_VERSAO, reverse_sql=SQL_VERSAO_0013),
+    ]
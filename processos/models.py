@@ -1,8 +1,13 @@
 from django.db import models
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from workflow import metricas
+from .condicoes import ErroCondicao, validar as validar_condicao
+
 
 class TemplateProcesso(models.Model):
     """
@@ -59,6 +64,12 @@ class Etapa(models.Model):
         ('REVISAO', 'Revisão'),
         ('FINALIZACAO', 'Finalização'),
     ]
+    # Quem assume o processo quando ele é encaminhado sem usuário escolhido (processos/atribuicao.py)
+    ATRIBUICAO_CHOICES = [
+        ('MENOS_CARGA', 'Menos processos em aberto'),
+        ('RODIZIO', 'Rodízio'),
+        ('ULTIMO_EXECUTOR', 'Quem já executou a etapa no processo'),
+    ]
     
     template = models.ForeignKey(
         TemplateProcesso,
@@ -79,12 +90,20 @@ class Etapa(models.Model):
         verbose_name='Usuários Permitidos',
         blank=True
     )
+    atribuicao = models.CharField(
+        'Atribuição Automática', max_length=20, choices=ATRIBUICAO_CHOICES, default='MENOS_CARGA'
+    )
     
     class Meta:
         verbose_name = 'Etapa'
         verbose_name_plural = 'Etapas'
         ordering = ['template', 'ordem']
-        unique_together = ['template', 'ordem']
+        constraints = [
+            # Conferida só no commit: reordenar pode trocar ordens num único UPDATE
+            models.UniqueConstraint(
+                fields=['template', 'ordem'], name='etapa_template_ordem_unica', deferrable=models.Deferrable.DEFERRED,
+            ),
+        ]
     
     def __str__(self):
         return f"{self.template.nome} - Etapa {self.ordem}: {self.nome}"
@@ -156,11 +175,31 @@ class Encaminhamento(models.Model):
         """Valida o encaminhamento"""
         if self.etapa_origem.template != self.etapa_destino.template:
             raise ValidationError("As etapas devem pertencer ao mesmo template.")
+        try:
+            validar_condicao(self.condicao)
+        except ErroCondicao as e:
+            raise ValidationError({'condicao': str(e)})
+
+
+class ConflitoVersao(Exception):
+    """
+    O processo foi alterado por outra pessoa depois de lido (``versao`` mudou).
+    Nada foi gravado: basta ler o processo de novo e repetir a operação.
+    """
+
+    def __init__(self, processo_id, versao=None):
+        self.processo_id = processo_id
+        self.versao = versao
+        super().__init__(f'Processo {processo_id} foi alterado por outra pessoa (versão {versao} desatualizada)')
 
 
 class ProcessoInstancia(models.Model):
     """
-    Instância de um processo em execução
+    Instância de um processo em execução.
+
+    ``versao`` aumenta a cada UPDATE (trigger da migração 0013, que pega
+    também as procedures); ``save()`` só grava se a versão no banco ainda é a
+    que foi lida e levanta ``ConflitoVersao`` se não for.
     """
     STATUS_CHOICES = [
         ('INICIADO', 'Iniciado'),
@@ -169,6 +208,11 @@ class ProcessoInstancia(models.Model):
         ('CONCLUIDO', 'Concluído'),
         ('CANCELADO', 'Cancelado'),
     ]
+    PRIORIDADE_CHOICES = [
+        (0, 'Normal'),
+        (1, 'Alta'),
+        (2, 'Urgente'),
+    ]
     
     template = models.ForeignKey(
         TemplateProcesso,
@@ -211,11 +255,32 @@ class ProcessoInstancia(models.Model):
     data_criacao = models.DateTimeField('Data de Criação', auto_now_add=True)
     data_conclusao = models.DateTimeField('Data de Conclusão', null=True, blank=True)
     data_atualizacao = models.DateTimeField('Última Atualização', auto_now=True)
+    versao = models.PositiveIntegerField('Versão', default=1, editable=False)
+    # Fila de tarefas (processos/fila.py)
+    prioridade = models.PositiveSmallIntegerField('Prioridade', choices=PRIORIDADE_CHOICES, default=0)
+    data_entrada_etapa = models.DateTimeField('Na Etapa Desde', default=timezone.now, editable=False)
+    reservado_por = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='tarefas_reservadas',
+        verbose_name='Reservado por'
+    )
+    reservado_ate = models.DateTimeField('Reservado até', null=True, blank=True)
     
     class Meta:
         verbose_name = 'Processo'
         verbose_name_plural = 'Processos'
         ordering = ['-data_criacao']
+        indexes = [
+            # Só os processos que podem estar na fila, na ordem em que ela é servida
+            models.Index(
+                models.F('prioridade').desc(), 'data_entrada_etapa', 'id',
+                name='processo_fila_idx',
+                condition=models.Q(status='EM_ANDAMENTO', etapa_atual__isnull=False),
+            ),
+        ]
     
     def __str__(self):
         return f"{self.numero_processo} - {self.titulo}"
@@ -267,6 +332,21 @@ class ProcessoInstancia(models.Model):
                     self.numero_processo = f"{timestamp:06d}/{ano}"
         
         super().save(*args, **kwargs)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Compare-and-swap: UPDATE ... WHERE id = %s AND versao = %s
+        versao = self.versao
+        campo_versao = self._meta.get_field('versao')
+        values = [valor for valor in values if valor[0] is not campo_versao] + [(campo_versao, None, versao + 1)]
+        atualizado = super()._do_update(
+            base_qs.filter(versao=versao), using, pk_val, values, update_fields, forced_update,
+        )
+        if atualizado:
+            self.versao = versao + 1
+        elif base_qs.filter(pk=pk_val).exists():
+            metricas.CONFLITOS_VERSAO.labels('salvar').inc()
+            raise ConflitoVersao(pk_val, versao)
+        return atualizado
     
     def iniciar(self, usuario):
         """Inicia o processo na primeira etapa"""
@@ -292,6 +372,11 @@ class ProcessoInstancia(models.Model):
         if not self.etapa_atual:
             return False
         return usuario.pode_executar_etapa(self.etapa_atual)
+
+    @property
+    def reservado(self):
+        """Tem reserva válida na fila de tarefas (só quem reservou executa a etapa)"""
+        return self.reservado_ate is not None and self.reservado_ate > timezone.now()
     
     def concluir(self):
         """Conclui o processo"""
@@ -395,11 +480,16 @@ class Documento(models.Model):
     )
     data_envio = models.DateTimeField('Data de Envio', auto_now_add=True)
     tamanho = models.BigIntegerField('Tamanho (bytes)', null=True, blank=True)
+    conteudo_busca = SearchVectorField('Conteúdo para busca', null=True, editable=False)
+    indexado_em = models.DateTimeField('Indexado em', null=True, blank=True, editable=False)
     
     class Meta:
         verbose_name = 'Documento'
         verbose_name_plural = 'Documentos'
         ordering = ['-data_envio']
+        indexes = [
+            GinIndex(fields=['conteudo_busca'], name='documento_conteudo_gin'),
+        ]
     
     def __str__(self):
         return f"{self.nome} - {self.etapa_executada.processo.numero_processo}"
@@ -469,3 +559,26 @@ class LogAuditoria(models.Model):
     
     def __str__(self):
         return f"{self.processo.numero_processo} - {self.get_acao_display()} - {self.data_hora}"
+
+
+class CargaUsuario(models.Model):
+    """
+    Processos em aberto sob responsabilidade de cada usuário, mantidos pela
+    trigger da migração 0016 (a atribuição automática não conta processos)
+    """
+    usuario = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='carga',
+        verbose_name='Usuário'
+    )
+    abertos = models.IntegerField('Processos em Aberto', default=0)
+    ultima_atribuicao = models.DateTimeField('Última Atribuição', null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Carga de Usuário'
+        verbose_name_plural = 'Cargas de Usuários'
+    
+    def __str__(self):
+        return f"{self.usuario} - {self.abertos} em aberto"
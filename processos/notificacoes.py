@@ -0,0 +1,107 @@
+# processos/notificacoes.py
+"""
+Eventos de processos (atribuído, avançou, concluído) para o SSE de "Meus Processos".
+
+Os eventos saem do banco com ``pg_notify('processos_eventos', ...)`` (função
+``fn_notificar_processo``, chamada pelo ``sp_encaminhar_processo`` e pelo
+``services.notificar_processo``). Cada worker tem um único ``OuvinteNotificacoes``:
+uma thread com uma conexão em LISTEN que distribui os eventos para as filas
+asyncio de todos os streams SSE abertos naquele worker.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from workflow import metricas
+from workflow.banco.escuta import OuvintePostgres
+
+logger = logging.getLogger(__name__)
+
+CANAL = 'processos_eventos'
+
+
+class OuvinteNotificacoes(OuvintePostgres):
+    """Conexão LISTEN compartilhada entre todos os assinantes SSE do worker"""
+
+    nome_thread = 'ouvinte-notificacoes'
+
+    def __init__(self, canal=CANAL, using=DEFAULT_DB_ALIAS):
+        super().__init__(canal, using)
+        self._assinantes = defaultdict(set)  # usuario_id -> {(loop, fila)}
+        self._lock = threading.Lock()
+
+    def assinar(self, usuario_id: int) -> asyncio.Queue:
+        """Fila com os eventos do usuário; chamar dentro do event loop que vai consumir"""
+        fila = asyncio.Queue(maxsize=100)
+        with self._lock:
+            self._assinantes[usuario_id].add((asyncio.get_running_loop(), fila))
+        self.iniciar()
+        metricas.SSE_ASSINANTES.inc()
+        return fila
+
+    def cancelar(self, usuario_id: int, fila: asyncio.Queue):
+        with self._lock:
+            destinos = self._assinantes.get(usuario_id, set())
+            destinos.difference_update({item for item in destinos if item[1] is fila})
+            if not destinos:
+                self._assinantes.pop(usuario_id, None)
+        metricas.SSE_ASSINANTES.dec()
+
+    def ao_notificar(self, payload: str):
+        # Eventos emitidos enquanto reconecta se perdem; o cliente recarrega a lista ao reconectar
+        try:
+            evento = json.loads(payload)
+        except ValueError:
+            logger.warning('Notificação inválida: %r', payload)
+            return
+        with self._lock:
+            destinos = list(self._assinantes.get(evento.get('usuario_id'), ()))
+        for loop, fila in destinos:
+            try:
+                loop.call_soon_threadsafe(_entregar, fila, evento)
+            except RuntimeError:
+                # Loop já encerrado; o stream é removido no finally dele
+                pass
+
+
+def _entregar(fila: asyncio.Queue, evento: dict):
+    try:
+        fila.put_nowait(evento)
+    except asyncio.QueueFull:
+        logger.warning('Fila SSE cheia, evento descartado: %s', evento)
+
+
+ouvinte = OuvinteNotificacoes()
+
+
+def formatar_evento(evento: dict) -> str:
+    """Evento no formato text/event-stream"""
+    return f'event: {evento.get("tipo", "mensagem")}\ndata: {json.dumps(evento)}\n\n'
+
+
+async def stream_eventos(usuario_id: int):
+    """
+    Gerador do SSE: eventos do usuário, heartbeat e encerramento após ``SSE_DURACAO_MAXIMA``.
+
+    O Django 4.2 não percebe o cliente desconectando no meio de um streaming,
+    então o stream tem duração máxima e o EventSource do navegador reconecta.
+    """
+    fila = ouvinte.assinar(usuario_id)
+    limite = time.monotonic() + settings.SSE_DURACAO_MAXIMA
+    try:
+        yield f'retry: {settings.SSE_RECONEXAO_MS}\n\n'
+        while time.monotonic() < limite:
+            try:
+                evento = await asyncio.wait_for(fila.get(), timeout=settings.SSE_HEARTBEAT_SEGUNDOS)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            yield formatar_evento(evento)
+    finally:
+        ouvinte.cancelar(usuario_id, fila)
@@ -3,6 +3,16 @@ from django.db import connection, transaction
 import sys
 from django.core.management.base import BaseCommand
 import logging
+from datetime import timedelta
+from django.db import OperationalError
+from django.core.exceptions import ValidationError
+from django.db.models import Exists, OuterRef, Value
+from django.utils import timezone
+from workflow import metricas
+from workflow.invalidacao import invalidar
+from workflow.marcacao_sql import marcar_origem
+from . import atribuicao, condicoes, fluxo
+from .models import ConflitoVersao, Etapa, EtapaExecutada, LogAuditoria, ProcessoInstancia
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +24,11 @@ def run_procedure(name: str, params: list):
         logger.debug(f"Executando: {sql} {params}")
         cursor.execute(sql, params)
 
-def encaminhar_processo(processo_id: int, proxima_etapa_id: int, usuario_id: int, observacao: str | None = None):
+@marcar_origem('servico.encaminhar_processo')
+def encaminhar_processo(
+    processo_id: int, proxima_etapa_id: int, usuario_id: int, observacao: str | None = None, versao: int | None = None,
+    responsavel_id: int | None = None,
+) -> int | None:
     """
     Chama a stored procedure sp_encaminhar_processo no PostgreSQL.
 
@@ -23,14 +37,36 @@ def encaminhar_processo(processo_id: int, proxima_etapa_id: int, usuario_id: int
         proxima_etapa_id: ID da próxima etapa
         usuario_id: ID do usuário que encaminha
         observacao: observação opcional
+        versao: versão do processo lida pelo formulário (levanta ConflitoVersao se mudou)
+        responsavel_id: quem assume o processo; omitido, a atribuição automática
+            da etapa escolhe (e, sem candidatos, fica com quem encaminha)
+
+    Returns:
+        A nova versão do processo
     """
     sys.stdout.write(f"aq chamamos a procedure({processo_id}, {proxima_etapa_id}, {usuario_id}, '{observacao}')")
+    if responsavel_id is None:
+        responsavel_id = atribuicao.escolher(proxima_etapa_id, processo_id)
+    try:
+        with connection.cursor() as cursor:
+            cursor.callproc(
+                'sp_encaminhar_processo',
+                [processo_id, proxima_etapa_id, usuario_id, observacao, versao, responsavel_id]
+            )
+            return cursor.fetchone()[0]
+    except OperationalError as e:
+        if getattr(e.__cause__, 'pgcode', None) == '40001':
+            metricas.CONFLITOS_VERSAO.labels('encaminhar').inc()
+            raise ConflitoVersao(processo_id, versao) from e
+        raise
+
+@marcar_origem('servico.notificar_processo')
+def notificar_processo(processo_id: int, usuario_id: int | None, tipo: str):
+    """Publica um evento do processo para o SSE de "Meus Processos" (sai no commit)"""
     with connection.cursor() as cursor:
-        cursor.callproc(
-            'sp_encaminhar_processo',
-            [processo_id, proxima_etapa_id, usuario_id, observacao]
-        )
+        cursor.execute("SELECT fn_notificar_processo(%s, %s, %s)", [processo_id, usuario_id, tipo])
 
+@marcar_origem('servico.criar_etapa_via_sp')
 def criar_etapa_via_sp(template_id, nome, ordem, responsavel_id, prazo_dias, descricao, usuario_id):
     """Executa a funct sp_criar_etapa"""
     with connection.cursor() as cursor:
@@ -38,7 +74,9 @@ def criar_etapa_via_sp(template_id, nome, ordem, responsavel_id, prazo_dias, des
             'sp_criar_etapa',
             [template_id, nome, ordem, responsavel_id, prazo_dias, descricao, usuario_id]
         )
+    invalidar('etapa', None)
 
+@marcar_origem('servico.atualizar_etapa_via_sp')
 def atualizar_etapa_via_sp(etapa_id, nome, ordem, responsavel_id, prazo_dias, descricao, usuario_id):
     """Executa a functsp_atualizar_etapa"""
     from django.db import connection
@@ -47,13 +85,48 @@ def atualizar_etapa_via_sp(etapa_id, nome, ordem, responsavel_id, prazo_dias, de
             'sp_atualizar_etapa',
             [etapa_id, nome, ordem, responsavel_id, prazo_dias, descricao, usuario_id]
         )
+    invalidar('etapa', etapa_id)
 
+@marcar_origem('servico.reordenar_etapas')
+def reordenar_etapas(template_id: int, etapa_ids: list[int]) -> int:
+    """
+    Reescreve a ordem das etapas do template na sequência de ``etapa_ids`` (a
+    primeira fica com ordem 1) num único UPDATE. A unicidade de (template,
+    ordem) é adiada, então trocas não colidem no meio do comando.
+    ``etapa_ids`` precisa ter todas as etapas do template, uma vez cada.
+    Retorna quantas etapas mudaram de ordem.
+    """
+    etapa_ids = [int(etapa_id) for etapa_id in etapa_ids]
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Trava as etapas: dois reordenamentos do mesmo template não se misturam
+        cursor.execute("SELECT id FROM processos_etapa WHERE template_id = %s FOR UPDATE", [template_id])
+        atuais = {linha[0] for linha in cursor.fetchall()}
+        if len(etapa_ids) != len(atuais) or set(etapa_ids) != atuais:
+            raise ValidationError('A nova ordem deve ter todas as etapas do template, uma vez cada.')
+        cursor.execute(
+            """
+            UPDATE processos_etapa e SET ordem = nova.ordem
+            FROM unnest(%s::BIGINT[]) WITH ORDINALITY AS nova(id, ordem)
+            WHERE e.id = nova.id AND e.ordem <> nova.ordem
+            """,
+            [etapa_ids],
+        )
+        alteradas = cursor.rowcount
+        # Confere agora, e não só no commit de quem chamou; depois volta a adiar
+        cursor.execute("SET CONSTRAINTS etapa_template_ordem_unica IMMEDIATE")
+        cursor.execute("SET CONSTRAINTS etapa_template_ordem_unica DEFERRED")
+    if alteradas:
+        invalidar('etapa', None)
+    return alteradas
+
+@marcar_origem('servico.get_processos_visiveis_ids')
 def get_processos_visiveis_ids(usuario_id: int):
     """Retorna IDs de processos visíveis para o usuario"""
     with connection.cursor() as cursor:
         cursor.execute("SELECT id FROM fn_processos_visiveis(%s);", [usuario_id])
         return [row[0] for row in cursor.fetchall()]
 
+@marcar_origem('servico.pode_ver_processo')
 def pode_ver_processo(processo_id: int, usuario_id: int) -> bool:
     """Verifica no banco se o usuário pode ver um o processo"""
     with connection.cursor() as cursor:
@@ -61,8 +134,263 @@ def pode_ver_processo(processo_id: int, usuario_id: int) -> bool:
         result = cursor.fetchone()
     return result[0] if result else False
 
+@marcar_origem('servico.finalizar_processo')
 def finalizar_processo(processo_id: int):
     run_procedure('sp_finalizar_processo', [processo_id])
 
+@marcar_origem('servico.cancelar_processo')
 def cancelar_processo(processo_id: int, usuario_id: int):
     run_procedure('sp_cancelar_processo', [processo_id, usuario_id])
+
+@marcar_origem('servico.executar_etapa')
+def executar_etapa(
+    processo_id: int, usuario_id: int, resultado: str, observacoes: str = '', etapa_id: int | None = None,
+    versao: int | None = None,
+) -> dict:
+    """
+    Executa a etapa atual do processo com o sp_executar_etapa (uma ida ao banco).
+
+    O destino vem da tabela de transições (processos/fluxo.py) para
+    ``etapa_id``, a etapa que o usuário viu ao executar; sem ela, a etapa
+    atual é lida do banco. Com ``versao`` (a lida pelo formulário), nada é
+    gravado se o processo mudou desde então. Retorna ``situacao``
+    (NAO_ENCONTRADO, SEM_ETAPA, ETAPA_MUDOU, CONFLITO, SEM_PERMISSAO, RESERVADO,
+    AVANCOU ou CONCLUIDO), ``status``, ``etapa_atual_id``, ``etapa_atual_nome``,
+    ``etapa_executada_id`` e ``versao``, já com o estado novo do processo.
+    RESERVADO: outra pessoa tem reserva válida do processo na fila (processos/fila.py).
+    """
+    if etapa_id is None:
+        etapa_id = ProcessoInstancia.objects.filter(pk=processo_id).values_list('etapa_atual_id', flat=True).first()
+    tabela = fluxo.da_etapa(etapa_id) if etapa_id is not None else None
+    destino = fluxo.FIM
+    if tabela and etapa_id is not None:
+        # Campos do processo só são lidos se alguma condição da etapa usa
+        processo = None
+        if tabela.usa_processo(etapa_id):
+            processo = ProcessoInstancia.objects.filter(pk=processo_id).values(*condicoes.CAMPOS_PROCESSO).first()
+        destino = tabela.proxima(etapa_id, resultado, condicoes.contexto(resultado, observacoes, processo))
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT * FROM sp_executar_etapa(%s, %s, %s, %s, %s, %s, %s)",
+            [processo_id, usuario_id, etapa_id, destino, resultado, observacoes, versao],
+        )
+        estado = dict(zip([coluna.name for coluna in cursor.description], cursor.fetchone()))
+    if estado['situacao'] == 'CONFLITO':
+        metricas.CONFLITOS_VERSAO.labels('executar').inc()
+    if estado['etapa_executada_id'] is not None:
+        metricas.ETAPAS_EXECUTADAS.labels(resultado).inc()
+        if tabela and etapa_id is not None:
+            tabela.registrar(etapa_id, destino, resultado)
+    return estado
+
+# Versões em lote (migration 0010): uma chamada para todos os processos,
+# retornando os ids que foram de fato alterados
+def _chamar_em_lote(funcao: str, params: list) -> list[int]:
+    placeholders = ', '.join(['%s'] * len(params))
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM {funcao}({placeholders})", params)
+        return [linha[0] for linha in cursor.fetchall()]
+
+@marcar_origem('servico.encaminhar_processos_em_lote')
+def encaminhar_processos_em_lote(
+    processo_ids: list[int], proxima_etapa_ids: list[int], usuario_ids: list[int], observacao: str | None = None,
+) -> list[int]:
+    """Encaminha cada processo para a etapa e o usuário na mesma posição das listas"""
+    if not processo_ids:
+        return []
+    return _chamar_em_lote(
+        'sp_encaminhar_processos',
+        [list(processo_ids), list(proxima_etapa_ids), list(usuario_ids), observacao],
+    )
+
+@marcar_origem('servico.cancelar_processos_em_lote')
+def cancelar_processos_em_lote(processo_ids: list[int], usuario_id: int) -> list[int]:
+    """Cancela os processos que ainda não foram concluídos/cancelados"""
+    if not processo_ids:
+        return []
+    return _chamar_em_lote('sp_cancelar_processos', [list(processo_ids), usuario_id])
+
+@marcar_origem('servico.finalizar_processos_em_lote')
+def finalizar_processos_em_lote(processo_ids: list[int]) -> list[int]:
+    """Conclui os processos que ainda não foram concluídos/cancelados"""
+    if not processo_ids:
+        return []
+    return _chamar_em_lote('sp_finalizar_processos', [list(processo_ids)])
+
+# Versão de etapas e templates (tabela do barramento de invalidação)
+_SQL_VERSOES = """
+    (SELECT COALESCE(MAX(versao), 0) FROM cache_versao WHERE grupo = 'etapa'),
+    (SELECT COALESCE(MAX(versao), 0) FROM cache_versao WHERE grupo = 'template')
+"""
+
+@marcar_origem('servico.validadores_processo')
+def validadores_processo(processo_id: int):
+    """
+    Para o GET condicional do detalhe: (última modificação do processo, do
+    template, dos usuários, do histórico e dos logs; versão das etapas; versão
+    dos templates), ou None se o processo não existe
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT GREATEST(
+                       p.data_atualizacao, t.data_atualizacao, uc.data_atualizacao, ua.data_atualizacao,
+                       (SELECT MAX(l.data_hora) FROM processos_logauditoria l WHERE l.processo_id = p.id),
+                       (SELECT MAX(GREATEST(e.data_inicio, e.data_conclusao))
+                          FROM processos_etapaexecutada e WHERE e.processo_id = p.id)
+                   ),
+                   {_SQL_VERSOES}
+            FROM processos_processoinstancia p
+            JOIN processos_templateprocesso t ON t.id = p.template_id
+            LEFT JOIN usuarios_usuario uc ON uc.id = p.criado_por_id
+            LEFT JOIN usuarios_usuario ua ON ua.id = p.usuario_atual_id
+            WHERE p.id = %s
+        """, [processo_id])
+        return cursor.fetchone()
+
+@marcar_origem('servico.validadores_template')
+def validadores_template(template_id: int):
+    """Para o GET condicional do detalhe: (última modificação do template e do criador; versão das etapas), ou None"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT GREATEST(t.data_atualizacao, u.data_atualizacao),
+                   (SELECT COALESCE(MAX(versao), 0) FROM cache_versao WHERE grupo = 'etapa')
+            FROM processos_templateprocesso t
+            LEFT JOIN usuarios_usuario u ON u.id = t.criado_por_id
+            WHERE t.id = %s
+        """, [template_id])
+        return cursor.fetchone()
+
+@marcar_origem('servico.versoes_etapas_templates')
+def versoes_etapas_templates():
+    """(versão das etapas, versão dos templates), que mudam a cada escrita neles"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {_SQL_VERSOES}")
+        return cursor.fetchone()
+
+# Execução em lote: quantos processos uma requisição pode executar de uma vez
+LOTE_EXECUCAO_MAXIMO = 200
+
+@marcar_origem('servico.executar_etapas_em_lote')
+def executar_etapas_em_lote(processo_ids, usuario, resultado: str, observacoes: str = '') -> dict[int, str | None]:
+    """
+    Executa a etapa atual de vários processos, como a execução de um só
+    (processo_executar_etapa), com um número fixo de consultas:
+
+    - uma busca (com lock) de processos e permissão (o destino de cada um vem
+      da tabela de transições do template, processos/fluxo.py);
+    - um bulk_create das etapas executadas e outro dos logs;
+    - um UPDATE para os que avançam e outro para os que concluem;
+    - uma consulta com as notificações.
+
+    Retorna ``{processo_id: None se executou, ou a mensagem de erro}``.
+    """
+    processo_ids = list(dict.fromkeys(processo_ids))
+    if usuario.perfil == 'ADMIN':
+        permitido = Value(True)
+    else:
+        permitido = Exists(Etapa.usuarios_permitidos.through.objects.filter(
+            etapa_id=OuterRef('etapa_atual_id'), usuario_id=usuario.pk,
+        ))
+    resultados: dict[int, str | None] = {pk: 'Processo não encontrado' for pk in processo_ids}
+    agora = timezone.now()
+
+    with transaction.atomic():
+        # Lock em ordem de id: dois lotes com processos em comum não entram em deadlock
+        linhas = ProcessoInstancia.objects.select_for_update().filter(
+            pk__in=processo_ids,
+        ).annotate(permitido=permitido).order_by('pk').values(
+            'pk', 'template_id', 'etapa_atual_id', 'usuario_atual_id', 'permitido',
+            'reservado_por_id', 'reservado_ate', *condicoes.CAMPOS_PROCESSO,
+        )
+
+        executaveis = []
+        for linha in linhas:
+            if linha['etapa_atual_id'] is None or linha['status'] in ('CONCLUIDO', 'CANCELADO'):
+                resultados[linha['pk']] = 'Processo sem etapa em andamento'
+            elif not linha['permitido']:
+                resultados[linha['pk']] = 'Sem permissão para executar a etapa atual'
+            elif linha['reservado_ate'] and linha['reservado_ate'] > agora and linha['reservado_por_id'] != usuario.pk:
+                # Mesma regra do sp_executar_etapa: só quem reservou na fila executa
+                resultados[linha['pk']] = 'Processo reservado na fila por outra pessoa'
+            else:
+                resultados[linha['pk']] = None
+                # Destino pela tabela de transições do template
+                linha['fluxo'] = fluxo.do_template(linha['template_id'])
+                linha['destino'] = linha['fluxo'].proxima(
+                    linha['etapa_atual_id'], resultado, condicoes.contexto(resultado, observacoes, linha, em=agora),
+                )
+                executaveis.append(linha)
+        if not executaveis:
+            return resultados
+
+        execucoes = EtapaExecutada.objects.bulk_create([
+            EtapaExecutada(
+                processo_id=linha['pk'],
+                etapa_id=linha['etapa_atual_id'],
+                executado_por=usuario,
+                resultado=resultado,
+                observacoes=observacoes,
+                data_conclusao=agora,
+                tempo_execucao=timedelta(0),
+            )
+            for linha in executaveis
+        ])
+
+        logs = []
+        avancam, concluem = [], []
+        for linha, execucao in zip(executaveis, execucoes):
+            logs.append(LogAuditoria(
+                processo_id=linha['pk'],
+                etapa_executada=execucao,
+                usuario=usuario,
+                acao='EXECUCAO_ETAPA',
+                descricao=f'Etapa "{linha["fluxo"].nomes[linha["etapa_atual_id"]]}" concluída com resultado: '
+                          f'{execucao.get_resultado_display()}',
+            ))
+            if linha['destino'] is not fluxo.FIM:
+                avancam.append(linha)
+                logs.append(LogAuditoria(
+                    processo_id=linha['pk'],
+                    usuario=usuario,
+                    acao='ENCAMINHAMENTO',
+                    descricao=f'Processo avançou automaticamente para: {linha["fluxo"].nomes[linha["destino"]]}',
+                ))
+            else:
+                concluem.append(linha)
+        LogAuditoria.objects.bulk_create(logs)
+
+        with connection.cursor() as cursor:
+            if avancam:
+                # Cada processo vai para a sua próxima etapa, num UPDATE só
+                cursor.execute("""
+                    UPDATE processos_processoinstancia p
+                       SET etapa_atual_id = v.etapa_id,
+                           usuario_atual_id = %s,
+                           data_atualizacao = %s
+                      FROM unnest(%s::bigint[], %s::bigint[]) AS v(processo_id, etapa_id)
+                     WHERE p.id = v.processo_id
+                """, [
+                    usuario.pk, agora,
+                    [linha['pk'] for linha in avancam], [linha['destino'] for linha in avancam],
+                ])
+            if concluem:
+                ProcessoInstancia.objects.filter(pk__in=[linha['pk'] for linha in concluem]).update(
+                    status='CONCLUIDO', data_conclusao=agora, etapa_atual=None, usuario_atual=None,
+                    data_atualizacao=agora,
+                )
+
+            # Mesmos eventos da execução individual: o novo responsável ou o anterior, na conclusão
+            notificacoes = (
+                [(linha['pk'], usuario.pk, 'avancou') for linha in avancam]
+                + [(linha['pk'], linha['usuario_atual_id'], 'concluido') for linha in concluem]
+            )
+            cursor.execute("""
+                SELECT fn_notificar_processo(v.processo_id, v.usuario_id, v.tipo)
+                  FROM unnest(%s::bigint[], %s::bigint[], %s::text[]) AS v(processo_id, usuario_id, tipo)
+            """, [list(coluna) for coluna in zip(*notificacoes)])
+
+    metricas.ETAPAS_EXECUTADAS.labels(resultado).inc(len(executaveis))
+    for linha in executaveis:
+        linha['fluxo'].registrar(linha['etapa_atual_id'], linha['destino'], resultado)
+    return resultados
@@ -1,9 +1,49 @@
-from django.test import TestCase, Client
-from django.urls import reverse
+import asyncio
+import io
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from datetime import timedelta
+from unittest import mock
+
+import psycopg2
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.http import Http404, HttpResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.urls import resolve, reverse
 from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache as django_cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from usuarios.backends import UsuarioCacheBackend
+from workflow.marcacao_sql import comentario_atual, origem_sql
+from workflow import idempotencia, invalidacao, routers
+from workflow.sessoes import limpar_sessoes_expiradas
+from workflow.middleware import MarcacaoSQLMiddleware
+from . import atribuicao, cache as cache_templates, condicoes, fila, fluxo, views_async
+from .api import codificar_cursor
+from .consultas import ContadorConsultas, em_paralelo, orcamento_consultas
+from .extracao import OrcamentoExcedido, extrair_texto
+from .forms import ExecucaoLoteForm, ProcessoFiltroForm
+from . import notificacoes
+from .services import (
+    cancelar_processos_em_lote, encaminhar_processo, encaminhar_processos_em_lote, executar_etapa, executar_etapas_em_lote,
+    finalizar_processos_em_lote, reordenar_etapas,
+)
+from .management.commands.relatorio_sql import extrair_origem, normalizar_sql
+from .views import MAX_CONSULTAS_DETALHE
 from .models import (
     TemplateProcesso, Etapa, Encaminhamento,
-    ProcessoInstancia, EtapaExecutada, LogAuditoria
+    ProcessoInstancia, EtapaExecutada, Documento, LogAuditoria, ConflitoVersao, CargaUsuario
 )
 
 User = get_user_model()
@@ -201,3 +241,1647 @@ class ViewsTestCase(TestCase):
         self.client.login(username='testuser', password='testpass123')
         response = self.client.get(reverse('processo_create'))
         self.assertEqual(response.status_code, 200)
+
+
+class ExtracaoTextoTestCase(TestCase):
+    """Testes para a extração de texto e busca nos anexos"""
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123',
+            perfil='ADMIN'
+        )
+        self.template = TemplateProcesso.objects.create(
+            nome='Template Teste',
+            criado_por=self.user
+        )
+        self.etapa = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        self.processo = ProcessoInstancia.objects.create(
+            template=self.template,
+            titulo='Processo Teste',
+            criado_por=self.user
+        )
+        self.etapa_exec = EtapaExecutada.objects.create(
+            processo=self.processo,
+            etapa=self.etapa,
+            executado_por=self.user
+        )
+
+    def test_extrair_csv(self):
+        """Testa extração de planilhas CSV"""
+        texto = extrair_texto(io.BytesIO(b'produto,valor\nnotebook,3500\n'), 'itens.csv')
+        self.assertIn('notebook 3500', texto)
+
+    def test_extrair_pdf_flate(self):
+        """Testa extração de streams de texto comprimidos em PDF"""
+        conteudo = zlib.compress(b'BT /F1 12 Tf (Contrato de loca\\347\\343o) Tj [(Ane) -20 (xo)] TJ ET')
+        pdf = (
+            b'%PDF-1.4\n1 0 obj\n<< /Length ' + str(len(conteudo)).encode()
+            + b' /Filter /FlateDecode >>\nstream\n' + conteudo + b'\nendstream\nendobj\n%%EOF'
+        )
+        texto = extrair_texto(io.BytesIO(pdf), 'contrato.pdf')
+        self.assertIn('Contrato de locação', texto)
+        self.assertIn('Anexo', texto)
+
+    def test_orcamento_de_tamanho_e_tempo(self):
+        """Testa que a extração respeita os limites de tamanho e tempo"""
+        self.assertEqual(extrair_texto(io.BytesIO(b'a' * 100), 'grande.txt', max_bytes=10), 'a' * 10)
+        with self.assertRaises(OrcamentoExcedido):
+            extrair_texto(io.BytesIO(b'a,b\n' * 10), 'lento.csv', timeout=-1)
+
+    def test_pdf_hostil_respeita_o_prazo(self):
+        """Testa que PDFs montados para forçar retrocesso terminam dentro do prazo"""
+        hostis = [
+            b'<<a>>' * 40000,
+            b'<< /Length 1 >>\nstream\n' + b'(' * 400000 + b'\nendstream',
+            b'<< /Length 1 >>\nstream\n' + b'(a)' * 400000 + b'\nendstream',
+        ]
+        for dados in hostis:
+            inicio = time.monotonic()
+            try:
+                extrair_texto(io.BytesIO(dados), 'hostil.pdf', max_bytes=len(dados), timeout=0.5)
+            except OrcamentoExcedido:
+                pass
+            self.assertLess(time.monotonic() - inicio, 2)
+
+    def test_upload_indexa_e_filtra_por_conteudo(self):
+        """Testa que o upload indexa o documento e a listagem busca pelo conteúdo"""
+        self.client.login(username='testuser', password='testpass123')
+        arquivo = SimpleUploadedFile('memorando.txt', b'Solicitamos a compra de impressoras laser.')
+
+        with self.settings(MEDIA_ROOT=self.media, EXTRACAO_TEXTO_ASSINCRONA=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(
+                    reverse('documento_upload', args=[self.etapa_exec.pk]),
+                    {'nome': 'Memorando', 'tipo': 'DOCUMENTO', 'arquivo': arquivo}
+                )
+
+        documento = Documento.objects.get()
+        self.assertIsNotNone(documento.indexado_em)
+
+        response = self.client.get(reverse('processo_list'), {'conteudo': 'impressora'})
+        self.assertContains(response, self.processo.numero_processo)
+        response = self.client.get(reverse('processo_list'), {'conteudo': 'geladeira'})
+        self.assertNotContains(response, self.processo.numero_processo)
+
+
+class ProcessoDetailConsultasTestCase(TestCase):
+    """Testes para o orçamento de consultas do detalhe do processo"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123',
+            perfil='OPERADOR'
+        )
+        self.template = TemplateProcesso.objects.create(
+            nome='Template Teste',
+            criado_por=self.user
+        )
+        self.etapa = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        self.etapa.usuarios_permitidos.add(self.user)
+        self.processo = ProcessoInstancia.objects.create(
+            template=self.template,
+            titulo='Processo Teste',
+            criado_por=self.user
+        )
+        self.processo.iniciar(self.user)
+        self.client.login(username='testuser', password='testpass123')
+
+    def _executar_etapas(self, quantidade):
+        for i in range(quantidade):
+            execucao = EtapaExecutada.objects.create(
+                processo=self.processo,
+                etapa=self.etapa,
+                executado_por=self.user
+            )
+            Documento.objects.bulk_create([Documento(
+                etapa_executada=execucao,
+                nome=f'Documento {i}',
+                arquivo=f'documentos/doc{i}.txt',
+                enviado_por=self.user,
+                tamanho=10
+            )])
+            execucao.concluir()
+
+    def test_consultas_nao_crescem_com_historico(self):
+        """Testa que o número de consultas é fixo, independente do histórico"""
+        url = reverse('processo_detail', args=[self.processo.pk])
+        self._executar_etapas(1)
+        self.client.get(url)  # aquece o cache do usuário
+        with ContadorConsultas() as poucas:
+            self.client.get(url)
+
+        self._executar_etapas(10)
+        with orcamento_consultas(MAX_CONSULTAS_DETALHE) as muitas:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Documento 9')
+        self.assertEqual(poucas.total, muitas.total)
+
+
+class MetricasTestCase(TestCase):
+    """Testes para o endpoint de métricas Prometheus"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123',
+            perfil='ADMIN'
+        )
+        self.template = TemplateProcesso.objects.create(
+            nome='Template Teste',
+            criado_por=self.user
+        )
+        Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+
+    def _valor(self, nome, **labels):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value(nome, labels) or 0
+
+    def test_metricas_http_e_de_negocio(self):
+        """Testa métricas por nome de URL e contador de processos criados"""
+        self.client.login(username='testuser', password='testpass123')
+        antes = self._valor('workflow_processos_criados_total')
+        requisicoes = self._valor('workflow_http_requisicao_segundos_count', view='processo_create', metodo='POST')
+
+        self.client.post(reverse('processo_create'), {
+            'template': self.template.pk,
+            'titulo': 'Processo Teste',
+        })
+
+        self.assertEqual(self._valor('workflow_processos_criados_total'), antes + 1)
+        self.assertEqual(
+            self._valor('workflow_http_requisicao_segundos_count', view='processo_create', metodo='POST'),
+            requisicoes + 1
+        )
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'workflow_db_consultas_por_requisicao_bucket')
+        self.assertContains(response, 'workflow_template_render_segundos')
+
+    def test_metricas_com_token(self):
+        """Testa que o token configurado é exigido"""
+        with self.settings(METRICAS_TOKEN='segredo'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer segredo')
+            self.assertEqual(response.status_code, 200)
+
+
+class MarcacaoSQLTestCase(TestCase):
+    """Testes para a marcação de origem das consultas e o relatório SQL"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123',
+            perfil='ADMIN'
+        )
+
+    def test_consultas_da_view_recebem_comentario(self):
+        """Testa que as consultas da requisição levam a view e o request id"""
+        sqls = []
+
+        def capturar(execute, sql, params, many, context):
+            sqls.append(sql)
+            return execute(sql, params, many, context)
+
+        def view(request):
+            middleware.process_view(request, None, (), {})
+            # Instalado por último, o wrapper enxerga o SQL já marcado
+            with connection.execute_wrapper(capturar):
+                User.objects.count()
+            return HttpResponse()
+
+        middleware = MarcacaoSQLMiddleware(view)
+        request = RequestFactory().get(reverse('template_list'), HTTP_X_REQUEST_ID='req-123')
+        request.resolver_match = resolve(request.path)
+        response = middleware(request)
+
+        self.assertEqual(response['X-Request-ID'], 'req-123')
+        self.assertTrue(sqls[0].startswith("/* origem='view.template_list',request_id='req-123' */ SELECT"))
+
+    def test_normalizar_e_extrair_origem(self):
+        """Testa a normalização usada para comparar relatórios entre versões"""
+        with origem_sql('servico.encaminhar_processo'):
+            sql = comentario_atual() + "SELECT * FROM t WHERE id IN ($1, $2, $3) AND nome = 'x'  LIMIT 21"
+
+        self.assertEqual(extrair_origem(sql), 'servico.encaminhar_processo')
+        self.assertEqual(normalizar_sql(sql), 'SELECT * FROM t WHERE id IN (...) AND nome = ? LIMIT ?')
+        self.assertEqual(extrair_origem('SELECT 1'), 'desconhecida')
+
+    def test_relatorio_sem_extensao(self):
+        """Testa o erro amigável quando o pg_stat_statements não está disponível"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+            if cursor.fetchone():
+                self.skipTest('pg_stat_statements instalado')
+        with self.assertRaises(CommandError):
+            call_command('relatorio_sql', formato='json', stdout=io.StringIO())
+
+
+class ConexoesBancoTestCase(TestCase):
+    """Testes para as métricas do backend de conexões persistentes"""
+
+    def _valor(self, nome, **labels):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value(nome, labels) or 0
+
+    def test_metricas_de_abertura_e_fechamento(self):
+        """Testa que abrir e fechar conexões atualiza as métricas"""
+        aberturas = self._valor('workflow_db_conexao_abertura_segundos_count', banco='default')
+        abertas = self._valor('workflow_db_conexoes_abertas', banco='default')
+
+        conexao = connections.create_connection('default')
+        with conexao.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertEqual(self._valor('workflow_db_conexao_abertura_segundos_count', banco='default'), aberturas + 1)
+        self.assertEqual(self._valor('workflow_db_conexoes_abertas', banco='default'), abertas + 1)
+
+        conexao.close()
+        self.assertEqual(self._valor('workflow_db_conexoes_abertas', banco='default'), abertas)
+
+
+class ReplicaRouterTestCase(TestCase):
+    """Testes para o roteamento de leituras para a réplica"""
+
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.factory = RequestFactory()
+        patch_config = mock.patch.object(routers, 'replica_configurada', return_value=True)
+        patch_saude = mock.patch.object(routers, 'replica_saudavel', return_value=True)
+        patch_config.start()
+        self.saude = patch_saude.start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _banco_na_view(self, request, model=ProcessoInstancia):
+        @routers.leitura_replica
+        def view(request):
+            return HttpResponse(self.router.db_for_read(model))
+        return view(request).content.decode()
+
+    def test_somente_views_marcadas_leem_da_replica(self):
+        """Testa que só leituras em views marcadas vão para a réplica"""
+        self.assertEqual(self.router.db_for_read(ProcessoInstancia), 'default')
+        self.assertEqual(self._banco_na_view(self.factory.get('/')), 'replica')
+        self.assertEqual(self._banco_na_view(self.factory.post('/')), 'default')
+        self.assertEqual(self.router.db_for_write(ProcessoInstancia), 'default')
+
+    def test_replica_atrasada_volta_para_primario(self):
+        """Testa o fallback para o primário quando a réplica está atrasada"""
+        self.saude.return_value = False
+        self.assertEqual(self._banco_na_view(self.factory.get('/')), 'default')
+
+    def test_fixacao_no_primario_apos_post(self):
+        """Testa a fixação (read-your-writes) após uma escrita"""
+        middleware = routers.ReplicaMiddleware(lambda request: HttpResponse())
+        response = middleware(self.factory.post('/'))
+        self.assertIn(routers.COOKIE_FIXACAO, response.cookies)
+
+        request = self.factory.get('/')
+        request.COOKIES[routers.COOKIE_FIXACAO] = response.cookies[routers.COOKIE_FIXACAO].value
+        middleware = routers.ReplicaMiddleware(lambda request: HttpResponse(self._banco_na_view(request)))
+        self.assertEqual(middleware(request).content.decode(), 'default')
+
+
+@override_settings(CONSULTAS_PARALELAS=0)
+class ViewsAssincronasTestCase(TestCase):
+    """Testes para as views de leitura assíncronas (servidor ASGI)"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123',
+            perfil='OPERADOR'
+        )
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        self.etapa.usuarios_permitidos.add(self.user)
+        self.processo = ProcessoInstancia.objects.create(
+            template=self.template,
+            titulo='Processo Teste',
+            criado_por=self.user
+        )
+        self.processo.iniciar(self.user)
+
+    def _get(self, view, path='/', **kwargs):
+        request = self.factory.get(path)
+        request.user = self.user
+        return async_to_sync(view)(request, **kwargs)
+
+    def test_dashboard_e_meus_processos(self):
+        """Testa que as views assíncronas renderizam os mesmos dados"""
+        self.assertContains(self._get(views_async.dashboard), self.processo.numero_processo)
+        self.assertContains(self._get(views_async.meus_processos), self.processo.numero_processo)
+
+    def test_detalhe_dentro_do_orcamento(self):
+        """Testa o detalhe assíncrono e o orçamento de consultas"""
+        execucao = EtapaExecutada.objects.create(processo=self.processo, etapa=self.etapa, executado_por=self.user)
+        execucao.concluir()
+        with orcamento_consultas(MAX_CONSULTAS_DETALHE):
+            response = self._get(views_async.processo_detail, pk=self.processo.pk)
+        self.assertContains(response, 'Etapa 1')
+
+        with self.assertRaises(Http404):
+            self._get(views_async.processo_detail, pk=0)
+
+    def test_lista_paginada(self):
+        """Testa a paginação com contagem e página consultadas em paralelo"""
+        for i in range(20):
+            ProcessoInstancia.objects.create(template=self.template, titulo=f'Extra {i}', criado_por=self.user)
+
+        response = self._get(views_async.processo_list, '/?page=2')
+        self.assertContains(response, 'Página 2 de 2')
+        with self.assertRaises(Http404):
+            self._get(views_async.processo_list, '/?page=3')
+
+    def test_login_obrigatorio(self):
+        """Testa o redirecionamento de anônimos para o login"""
+        from django.contrib.auth.models import AnonymousUser
+        request = self.factory.get('/processos/')
+        request.user = AnonymousUser()
+        response = async_to_sync(views_async.dashboard)(request)
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(CONSULTAS_PARALELAS=2)
+    def test_em_paralelo_executa_ao_mesmo_tempo(self):
+        """Testa que as funções rodam em threads diferentes ao mesmo tempo"""
+        barreira = threading.Barrier(2, timeout=5)
+
+        def esperar():
+            # Só passa da barreira se a outra função estiver rodando junto
+            barreira.wait()
+            return threading.current_thread().name
+
+        nomes = async_to_sync(em_paralelo)(esperar, esperar)
+        self.assertEqual(len(set(nomes)), 2)
+
+
+class NotificacoesTestCase(TestCase):
+    """Testes para os eventos de processos (LISTEN/NOTIFY + SSE)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='OPERADOR')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa1 = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        self.etapa2 = Etapa.objects.create(template=self.template, nome='Etapa 2', ordem=2)
+        self.processo = ProcessoInstancia.objects.create(
+            template=self.template,
+            titulo='Processo Teste',
+            criado_por=self.user
+        )
+        self.processo.iniciar(self.user)
+
+    def test_encaminhar_processo(self):
+        """Testa o sp_encaminhar_processo corrigido (sem o INSERT em processos_encaminhamento)"""
+        encaminhar_processo(self.processo.id, self.etapa2.id, self.user.id, 'Segue')
+        self.processo.refresh_from_db()
+        self.assertEqual(self.processo.etapa_atual, self.etapa2)
+        self.assertTrue(self.processo.logs.filter(acao='ENCAMINHAMENTO').exists())
+
+    def test_ouvinte_compartilhado_entrega_ao_usuario(self):
+        """Testa que uma conexão LISTEN entrega o evento a todos os streams do usuário"""
+        ouvinte = notificacoes.OuvinteNotificacoes()
+        self.addCleanup(ouvinte.parar)
+
+        def notificar(usuario_id):
+            # Conexão própria em autocommit: a transação do teste nunca faz commit
+            conexao = psycopg2.connect(**connection.get_connection_params())
+            conexao.autocommit = True
+            with conexao.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_notify(%s, json_build_object('tipo', 'atribuido', 'processo_id', 1, 'usuario_id', %s)::text)",
+                    [notificacoes.CANAL, usuario_id],
+                )
+            conexao.close()
+
+        async def cenario():
+            with mock.patch.object(notificacoes, 'ouvinte', ouvinte):
+                stream = notificacoes.stream_eventos(7)
+                self.assertTrue((await stream.__anext__()).startswith('retry:'))
+                outra_fila = ouvinte.assinar(7)
+                fila_outro_usuario = ouvinte.assinar(8)
+                await sync_to_async(ouvinte.escutando.wait)(5)
+
+                await sync_to_async(notificar)(7)
+                evento = await asyncio.wait_for(stream.__anext__(), 5)
+                self.assertEqual((await asyncio.wait_for(outra_fila.get(), 5))['tipo'], 'atribuido')
+                self.assertTrue(fila_outro_usuario.empty())
+                await stream.aclose()
+            return evento
+
+        with self.settings(SSE_HEARTBEAT_SEGUNDOS=10):
+            evento = async_to_sync(cenario)()
+        self.assertTrue(evento.startswith('event: atribuido\ndata: '))
+
+
+class InvalidacaoCacheTestCase(TestCase):
+    """Testes para o barramento de invalidação dos caches locais"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='GESTOR')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.recebidas = []
+        self._registrar('etapa')
+        self._registrar('template')
+
+    def _registrar(self, grupo):
+        def manipulador(ident):
+            self.recebidas.append((grupo, ident))
+        invalidacao.ao_invalidar(grupo)(manipulador)
+        self.addCleanup(invalidacao._manipuladores[grupo].remove, manipulador)
+
+    def _versao(self, grupo):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT versao FROM cache_versao WHERE grupo = %s', [grupo])
+            linha = cursor.fetchone()
+        return linha[0] if linha else 0
+
+    def test_trigger_incrementa_versao(self):
+        """Testa que escritas (inclusive no m2m) incrementam a versão do grupo"""
+        versao = self._versao('etapa')
+        etapa = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        etapa.usuarios_permitidos.add(self.user)
+        self.assertEqual(self._versao('etapa'), versao + 2)
+
+    def test_login_nao_invalida_usuario(self):
+        """Testa que gravar só o last_login não invalida o usuário, e mudar outro campo invalida"""
+        self._registrar('usuario')
+        versao = self._versao('usuario')
+        self.client.login(username='testuser', password='testpass123')
+        self.assertEqual(self._versao('usuario'), versao)
+        self.assertNotIn(('usuario', self.user.pk), self.recebidas)
+
+        User.objects.filter(pk=self.user.pk).update(first_name='Novo')
+        self.assertEqual(self._versao('usuario'), versao + 1)
+
+    def test_sinais_invalidam_na_hora_e_no_commit(self):
+        """Testa a invalidação no próprio processo, na escrita e de novo depois do commit"""
+        with self.captureOnCommitCallbacks(execute=True):
+            etapa = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+            self.assertEqual(self.recebidas, [('etapa', etapa.pk)])
+        self.assertEqual(self.recebidas, [('etapa', etapa.pk)] * 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.etapas_permitidas.add(etapa)
+        self.assertEqual(self.recebidas, [('etapa', etapa.pk)] * 4)
+
+    def test_mensagem_perdida_limpa_o_grupo(self):
+        """Testa que uma versão pulada invalida o grupo inteiro"""
+        ouvinte = invalidacao.OuvinteInvalidacao()
+        ouvinte.versoes = {'etapa': 4, 'template': 1}
+        ouvinte.ao_notificar('etapa:3:5')
+        ouvinte.ao_notificar('etapa:3:5')  # repetida
+        ouvinte.ao_notificar('etapa:8:7')
+        self.assertEqual(self.recebidas, [('etapa', 3), ('etapa', None)])
+
+        # A conferência periódica pega o grupo que mudou sem mensagem nenhuma
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO cache_versao VALUES ('template', 99)
+                ON CONFLICT (grupo) DO UPDATE SET versao = 99
+            """)
+        ouvinte.versoes = {'template': 1, 'etapa': self._versao('etapa')}
+        ouvinte.sincronizar(connection.connection)
+        self.assertIn(('template', None), self.recebidas)
+
+    def test_cache_local_nao_guarda_valor_calculado_durante_invalidacao(self):
+        """Testa a geração do CacheLocal"""
+        cache = invalidacao.CacheLocal('template')
+        self.addCleanup(invalidacao._manipuladores['template'].remove, cache.invalidar)
+
+        def calcular_com_invalidacao():
+            invalidacao.invalidar_local('template', self.template.pk)
+            return 'velho'
+
+        self.assertEqual(cache.obter(self.template.pk, calcular_com_invalidacao), 'velho')
+        self.assertEqual(cache.obter(self.template.pk, lambda: 'novo'), 'novo')
+        self.assertEqual(cache.obter(self.template.pk, lambda: 'outro'), 'novo')
+        invalidacao.invalidar_local('template')
+        self.assertEqual(cache.obter(self.template.pk, lambda: 'outro'), 'outro')
+
+
+class CacheTemplatesTestCase(TestCase):
+    """Testes para o cache versionado de templates e etapas"""
+
+    def setUp(self):
+        django_cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='GESTOR')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        self.client = Client()
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_detalhe_em_cache_ate_a_escrita(self):
+        """Testa que o detalhe sai do cache e muda quando uma etapa é criada"""
+        url = reverse('template_detail', args=[self.template.pk])
+        with ContadorConsultas() as primeira:
+            self.client.get(url)
+        with ContadorConsultas() as segunda:
+            response = self.client.get(url)
+        self.assertLess(segunda.total, primeira.total)
+        self.assertEqual(len(response.context['etapas']), 1)
+
+        Etapa.objects.create(template=self.template, nome='Etapa 2', ordem=2)
+        response = self.client.get(url)
+        self.assertEqual([etapa.nome for etapa in response.context['etapas']], ['Etapa 1', 'Etapa 2'])
+        self.assertEqual(response.context['template'].criado_por, self.user)
+        self.assertEqual(self.client.get(reverse('template_detail', args=[999999])).status_code, 404)
+
+    def test_proxima_ordem_e_opcoes_do_filtro(self):
+        """Testa a ordem sugerida e a lista de templates do filtro depois de escritas"""
+        self.assertEqual(cache_templates.proxima_ordem(self.template.pk), 2)
+        Etapa.objects.create(template=self.template, nome='Etapa 2', ordem=2)
+        self.assertEqual(cache_templates.proxima_ordem(self.template.pk), 3)
+
+        self.assertIn((self.template.pk, 'Template Teste'), ProcessoFiltroForm().fields['template'].choices)
+        self.template.nome = 'Renomeado'
+        self.template.save()
+        self.assertIn((self.template.pk, 'Renomeado'), ProcessoFiltroForm().fields['template'].choices)
+
+    def test_single_flight(self):
+        """Testa que requisições simultâneas recalculam uma entrada faltando uma vez só"""
+        calculos = []
+
+        def calcular():
+            calculos.append(1)
+            time.sleep(0.2)
+            return 'valor'
+
+        resultados = []
+        threads = [
+            threading.Thread(target=lambda: resultados.append(
+                cache_templates.obter('teste', [('template', None)], calcular, single_flight=True)
+            ))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(resultados, ['valor'] * 4)
+        self.assertEqual(len(calculos), 1)
+
+
+# Um processo só: o cache em memória serve ao cached_db (em produção ele exige cache compartilhado)
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+class SessoesUsuarioCacheTestCase(TestCase):
+    """Testes para as sessões em cache, o usuário da requisição em cache e a limpeza de sessões"""
+
+    def setUp(self):
+        django_cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='OPERADOR')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        self.client = Client()
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_requisicao_nao_consulta_sessao_nem_usuario(self):
+        """Testa que, com o cache quente, sessão e usuário não vão ao banco"""
+        self.client.get(reverse('template_list'))
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('template_list'))
+        self.assertEqual(response.status_code, 200)
+        sqls = ' '.join(consulta['sql'] for consulta in consultas.captured_queries)
+        self.assertNotIn('django_session', sqls)
+        self.assertNotIn('usuarios_usuario', sqls)
+
+    def test_usuario_em_cache_invalidado_na_escrita(self):
+        """Testa que perfil, etapas permitidas e is_active valem logo depois da escrita"""
+        backend = UsuarioCacheBackend()
+        self.assertFalse(backend.get_user(self.user.pk).pode_executar_etapa(self.etapa))
+
+        self.etapa.usuarios_permitidos.add(self.user)
+        self.assertTrue(backend.get_user(self.user.pk).pode_executar_etapa(self.etapa))
+        with self.assertNumQueries(0):
+            self.assertTrue(backend.get_user(self.user.pk).pode_executar_etapa(self.etapa))
+
+        self.user.perfil = 'GESTOR'
+        self.user.save()
+        self.assertEqual(backend.get_user(self.user.pk).perfil, 'GESTOR')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(backend.get_user(self.user.pk))
+        self.assertIsNone(backend.get_user('não é id'))
+
+    def test_limpeza_apaga_so_as_expiradas(self):
+        """Testa a limpeza em lotes das sessões expiradas"""
+        agora = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'expirada{i}', session_data='', expire_date=agora - timedelta(days=1))
+        Session.objects.create(session_key='valida', session_data='', expire_date=agora + timedelta(days=1))
+
+        self.assertEqual(limpar_sessoes_expiradas(lote=2), 5)
+        self.assertFalse(Session.objects.filter(session_key__startswith='expirada').exists())
+        self.assertTrue(Session.objects.filter(session_key='valida').exists())
+
+
+class EstaticosTestCase(TestCase):
+    """Testes para os estáticos locais e a coleta condicional"""
+
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root, ignore_errors=True)
+
+    def test_paginas_nao_usam_cdn(self):
+        """Testa que o layout carrega Bootstrap e ícones dos estáticos da aplicação"""
+        User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(reverse('dashboard'))
+        self.assertNotContains(response, 'cdn.jsdelivr.net')
+        self.assertContains(response, '/static/vendor/bootstrap-5.3.3/bootstrap.min.css')
+
+    def test_coleta_so_quando_os_estaticos_mudam(self):
+        """Testa que o collectstatic é ignorado se a origem não mudou"""
+        with override_settings(STATIC_ROOT=self.static_root), \
+                mock.patch('processos.management.commands.coletar_estaticos.call_command') as collectstatic:
+            call_command('coletar_estaticos', stdout=io.StringIO())
+            call_command('coletar_estaticos', stdout=io.StringIO())
+            self.assertEqual(collectstatic.call_count, 1)
+
+            with mock.patch(
+                'processos.management.commands.coletar_estaticos.impressao_digital', return_value='outra'
+            ):
+                call_command('coletar_estaticos', stdout=io.StringIO())
+            self.assertEqual(collectstatic.call_count, 2)
+
+
+# Um processo só: o cache em memória serve ao cached_db (em produção ele exige cache compartilhado)
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+class GetCondicionalTestCase(TestCase):
+    """Testes para ETag/Last-Modified das páginas e a compressão do HTML"""
+
+    def setUp(self):
+        django_cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='GESTOR')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        self.processo = ProcessoInstancia.objects.create(
+            template=self.template, titulo='Processo Teste', criado_por=self.user
+        )
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_detalhe_responde_304_ate_mudar(self):
+        """Testa o 304 sem renderizar e o 200 depois de uma mudança no histórico"""
+        url = reverse('processo_detail', args=[self.processo.pk])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        LogAuditoria.objects.create(processo=self.processo, usuario=self.user, acao='COMENTARIO', descricao='Novo')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etapas_e_lista_mudam_o_etag(self):
+        """Testa que etapa nova muda o ETag do template e processo novo o da listagem"""
+        url_template = reverse('template_detail', args=[self.template.pk])
+        etag_template = self.client.get(url_template)['ETag']
+        url_lista = reverse('processo_list')
+        etag_lista = self.client.get(url_lista)['ETag']
+        self.assertEqual(self.client.get(url_lista, HTTP_IF_NONE_MATCH=etag_lista).status_code, 304)
+
+        Etapa.objects.create(template=self.template, nome='Etapa 2', ordem=2)
+        ProcessoInstancia.objects.create(template=self.template, titulo='Outro', criado_por=self.user)
+        self.assertEqual(self.client.get(url_template, HTTP_IF_NONE_MATCH=etag_template).status_code, 200)
+        self.assertEqual(self.client.get(url_lista, HTTP_IF_NONE_MATCH=etag_lista).status_code, 200)
+
+    def test_mensagem_pendente_nao_gera_304(self):
+        """Testa que a página com mensagem pendente é renderizada de novo"""
+        url = reverse('processo_detail', args=[self.processo.pk])
+        etag = self.client.get(url)['ETag']
+        self.client.get(reverse('processo_executar', args=[self.processo.pk]))  # sem permissão: mensagem de erro
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(COMPRESSAO_HTML_MINIMO_BYTES=500)
+    def test_compressao_so_de_html_acima_do_minimo(self):
+        """Testa o gzip das páginas HTML"""
+        response = self.client.get(reverse('processo_list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'Processo Teste', zlib.decompress(response.content, 16 + zlib.MAX_WBITS))
+
+        with override_settings(COMPRESSAO_HTML_MINIMO_BYTES=10_000_000):
+            response = self.client.get(reverse('processo_list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class APIProcessosTestCase(TestCase):
+    """Testes para a API JSON de leitura"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='OPERADOR')
+        self.outro = User.objects.create_user(username='outro', password='testpass123', perfil='OPERADOR')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        self.processos = [
+            ProcessoInstancia.objects.create(template=self.template, titulo=f'Processo {i}', criado_por=self.user)
+            for i in range(5)
+        ]
+        self.alheio = ProcessoInstancia.objects.create(template=self.template, titulo='Alheio', criado_por=self.outro)
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_exige_login(self):
+        """Testa o 401 sem sessão"""
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api_processos')).status_code, 401)
+
+    def test_campos_e_paginacao_por_cursor(self):
+        """Testa fields=, a visibilidade da listagem e o cursor até a última página"""
+        url = reverse('api_processos') + '?fields=id,titulo,template&limite=2'
+        ids = []
+        while url:
+            dados = self.client.get(url).json()
+            for item in dados['resultados']:
+                self.assertEqual(set(item), {'id', 'titulo', 'template'})
+            ids += [item['id'] for item in dados['resultados']]
+            url = dados['proximo']
+        self.assertEqual(ids, sorted((p.pk for p in self.processos), reverse=True))
+
+        response = self.client.get(reverse('api_processos') + '?fields=id,senha')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_processos') + '?cursor=!!').status_code, 400)
+        for fora in (0, -5, 2 ** 63, 10 ** 30):
+            response = self.client.get(reverse('api_processos') + f'?cursor={codificar_cursor(fora)}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_historico(self):
+        """Testa o histórico, o 404 de processo não visível e o 304"""
+        processo = self.processos[0]
+        EtapaExecutada.objects.create(processo=processo, etapa=self.etapa, executado_por=self.user)
+        url = reverse('api_processo_historico', args=[processo.pk])
+        response = self.client.get(url + '?fields=etapa,executado_por')
+        self.assertEqual(response.json()['resultados'], [{'etapa': 'Etapa 1', 'executado_por': 'testuser'}])
+
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url + '?fields=etapa,executado_por', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(
+            self.client.get(reverse('api_processo_historico', args=[self.alheio.pk])).status_code, 404
+        )
+
+
+class ExecucaoLoteTestCase(TestCase):
+    """Testes para a execução da etapa atual de vários processos de uma vez"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='OPERADOR')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa1 = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        self.etapa2 = Etapa.objects.create(template=self.template, nome='Etapa 2', ordem=2)
+        self.etapa1.usuarios_permitidos.add(self.user)
+        self.etapa2.usuarios_permitidos.add(self.user)
+        self.processos = []
+        for i in range(3):
+            processo = ProcessoInstancia.objects.create(template=self.template, titulo=f'Processo {i}', criado_por=self.user)
+            processo.iniciar(self.user)
+            self.processos.append(processo)
+        # Na última etapa: conclui
+        self.ultimo = self.processos[2]
+        self.ultimo.etapa_atual = self.etapa2
+        self.ultimo.save()
+        self.nao_iniciado = ProcessoInstancia.objects.create(template=self.template, titulo='Novo', criado_por=self.user)
+
+    def test_executa_avanca_conclui_e_informa_erros(self):
+        """Testa avanço, conclusão, logs e os erros por processo"""
+        ids = [p.pk for p in self.processos] + [self.nao_iniciado.pk, 999999]
+        resultados = executar_etapas_em_lote(ids, self.user, 'APROVADO', 'Em lote')
+
+        self.assertEqual(resultados, {
+            self.processos[0].pk: None,
+            self.processos[1].pk: None,
+            self.ultimo.pk: None,
+            self.nao_iniciado.pk: 'Processo sem etapa em andamento',
+            999999: 'Processo não encontrado',
+        })
+        for processo in self.processos[:2]:
+            processo.refresh_from_db()
+            self.assertEqual(processo.etapa_atual, self.etapa2)
+            self.assertTrue(processo.logs.filter(acao='ENCAMINHAMENTO').exists())
+        self.ultimo.refresh_from_db()
+        self.assertEqual(self.ultimo.status, 'CONCLUIDO')
+        self.assertIsNone(self.ultimo.etapa_atual)
+        execucao = EtapaExecutada.objects.get(processo=self.ultimo)
+        self.assertEqual((execucao.etapa, execucao.resultado, execucao.observacoes), (self.etapa2, 'APROVADO', 'Em lote'))
+        self.assertEqual(LogAuditoria.objects.filter(acao='EXECUCAO_ETAPA', etapa_executada__isnull=False).count(), 3)
+
+        # Sem permissão na etapa 2
+        self.etapa2.usuarios_permitidos.remove(self.user)
+        resultados = executar_etapas_em_lote([self.processos[0].pk], self.user, 'APROVADO')
+        self.assertEqual(resultados, {self.processos[0].pk: 'Sem permissão para executar a etapa atual'})
+
+    def test_consultas_nao_crescem_com_o_lote(self):
+        """Testa o número fixo de consultas, independente de quantos processos"""
+        for i in range(20):
+            processo = ProcessoInstancia.objects.create(template=self.template, titulo=f'Extra {i}', criado_por=self.user)
+            processo.iniciar(self.user)
+            self.processos.append(processo)
+        fluxo.do_template(self.template.pk)
+        # Lock/permissões, 2 bulk_create, 2 UPDATEs, notificações + savepoint e release
+        with self.assertNumQueries(8):
+            resultados = executar_etapas_em_lote([p.pk for p in self.processos], self.user, 'CONCLUIDO')
+        self.assertTrue(all(erro is None for erro in resultados.values()))
+
+    def test_view(self):
+        """Testa a resposta JSON por processo, as mensagens e a validação do form"""
+        self.client.login(username='testuser', password='testpass123')
+        url = reverse('processo_executar_lote')
+        dados = {'processos': [self.processos[0].pk, self.nao_iniciado.pk], 'resultado': 'APROVADO'}
+
+        response = self.client.post(url, dados, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {
+            'executados': 1,
+            'resultados': [
+                {'id': self.processos[0].pk, 'ok': True},
+                {'id': self.nao_iniciado.pk, 'ok': False, 'erro': 'Processo sem etapa em andamento'},
+            ],
+        })
+
+        response = self.client.post(url, dados, follow=True)
+        self.assertRedirects(response, reverse('processo_list'))
+        self.assertContains(response, 'Etapa executada em 1 processo(s).')
+
+        response = self.client.post(url, {'processos': ['x'], 'resultado': 'APROVADO'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+
+class OperacoesEmLoteTestCase(TestCase):
+    """Testes para as procedures em lote (encaminhar, cancelar, finalizar) e as ações do admin"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='admin', password='testpass123', perfil='ADMIN', is_staff=True, is_superuser=True,
+        )
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa1 = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        self.etapa2 = Etapa.objects.create(template=self.template, nome='Etapa 2', ordem=2)
+        self.processos = []
+        for i in range(3):
+            processo = ProcessoInstancia.objects.create(template=self.template, titulo=f'Processo {i}', criado_por=self.user)
+            processo.iniciar(self.user)
+            self.processos.append(processo)
+        self.ids = [p.pk for p in self.processos]
+
+    def test_encaminhar_em_lote(self):
+        """Testa o UPDATE e os logs de todos os processos numa chamada"""
+        with self.assertNumQueries(1):
+            alterados = encaminhar_processos_em_lote(
+                self.ids + [999999], [self.etapa2.pk] * 4, [self.user.pk] * 4, 'Lote',
+            )
+        self.assertEqual(sorted(alterados), self.ids)
+        self.assertEqual(ProcessoInstancia.objects.filter(pk__in=self.ids, etapa_atual=self.etapa2).count(), 3)
+        self.assertEqual(
+            LogAuditoria.objects.filter(processo_id__in=self.ids, acao='ENCAMINHAMENTO', descricao__endswith='Lote').count(),
+            3,
+        )
+
+    def test_cancelar_e_finalizar_em_lote(self):
+        """Testa que processos já encerrados ficam de fora"""
+        self.assertEqual(cancelar_processos_em_lote(self.ids[:1], self.user.pk), self.ids[:1])
+        self.assertEqual(sorted(finalizar_processos_em_lote(self.ids)), self.ids[1:])
+        self.assertEqual(
+            list(ProcessoInstancia.objects.filter(pk__in=self.ids).order_by('pk').values_list('status', flat=True)),
+            ['CANCELADO', 'CONCLUIDO', 'CONCLUIDO'],
+        )
+        self.assertEqual(LogAuditoria.objects.filter(acao__in=['CANCELAMENTO', 'CONCLUSAO']).count(), 3)
+
+    def test_acao_admin_encaminhar(self):
+        """Testa a ação do admin, que ignora quem já está na última etapa"""
+        self.processos[2].etapa_atual = self.etapa2
+        self.processos[2].save()
+        self.client.login(username='admin', password='testpass123')
+        response = self.client.post(
+            reverse('admin:processos_processoinstancia_changelist'),
+            {'action': 'encaminhar_proxima_etapa', '_selected_action': self.ids},
+            follow=True,
+        )
+        self.assertContains(response, '2 de 3 processo(s) encaminhado(s).')
+        self.assertEqual(ProcessoInstancia.objects.filter(etapa_atual=self.etapa2).count(), 3)
+
+
+class ExecutarEtapaTestCase(TestCase):
+    """Testes para o sp_executar_etapa (execução de etapa numa ida ao banco)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='OPERADOR')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa1 = Etapa.objects.create(template=self.template, nome='Etapa 1', ordem=1)
+        self.etapa2 = Etapa.objects.create(template=self.template, nome='Etapa 2', ordem=2)
+        self.etapa1.usuarios_permitidos.add(self.user)
+        self.processo = ProcessoInstancia.objects.create(template=self.template, titulo='Processo', criado_por=self.user)
+        self.processo.iniciar(self.user)
+
+    def test_avanca_e_conclui(self):
+        """Testa o avanço, a conclusão, os logs e as situações sem gravação"""
+        fluxo.da_etapa(self.etapa1.pk)
+        with self.assertNumQueries(1):
+            estado = executar_etapa(self.processo.pk, self.user.pk, 'APROVADO', 'Ok', etapa_id=self.etapa1.pk)
+        self.assertEqual(estado['situacao'], 'AVANCOU')
+        self.assertEqual((estado['etapa_atual_id'], estado['etapa_atual_nome']), (self.etapa2.pk, 'Etapa 2'))
+        execucao = EtapaExecutada.objects.get(pk=estado['etapa_executada_id'])
+        self.assertEqual((execucao.etapa, execucao.resultado, execucao.observacoes), (self.etapa1, 'APROVADO', 'Ok'))
+        self.assertEqual(
+            execucao.logs.get().descricao, 'Etapa "Etapa 1" concluída com resultado: Aprovado'
+        )
+        self.assertTrue(self.processo.logs.filter(descricao='Processo avançou automaticamente para: Etapa 2').exists())
+
+        # Etapa 2 sem permissão: nada é gravado
+        self.assertEqual(executar_etapa(self.processo.pk, self.user.pk, 'APROVADO')['situacao'], 'SEM_PERMISSAO')
+        self.assertEqual(self.processo.etapas_executadas.count(), 1)
+
+        self.etapa2.usuarios_permitidos.add(self.user)
+        estado = executar_etapa(self.processo.pk, self.user.pk, 'CONCLUIDO')
+        self.assertEqual((estado['situacao'], estado['status']), ('CONCLUIDO', 'CONCLUIDO'))
+        self.processo.refresh_from_db()
+        self.assertEqual(self.processo.status, 'CONCLUIDO')
+        self.assertIsNone(self.processo.etapa_atual)
+        self.assertEqual(executar_etapa(self.processo.pk, self.user.pk, 'CONCLUIDO')['situacao'], 'SEM_ETAPA')
+        self.assertEqual(executar_etapa(999999, self.user.pk, 'CONCLUIDO')['situacao'], 'NAO_ENCONTRADO')
+
+    def test_view_faz_uma_chamada(self):
+        """Testa que o POST da view executa tudo numa consulta ao sp_executar_etapa"""
+        self.client.login(username='testuser', password='testpass123')
+        url = reverse('processo_executar', args=[self.processo.pk])
+        self.client.get(url)  # aquece o cache do usuário
+        fluxo.da_etapa(self.etapa1.pk)
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.post(url, {'resultado': 'APROVADO', 'observacoes': '', 'etapa_id': self.etapa1.pk})
+        self.assertRedirects(response, reverse('processo_detail', args=[self.processo.pk]), fetch_redirect_response=False)
+        self.assertEqual([c['sql'] for c in consultas if 'processos_' in c['sql'] or 'sp_' in c['sql']], [
+            c['sql'] for c in consultas if 'sp_executar_etapa' in c['sql']
+        ])
+        self.assertEqual(sum('sp_executar_etapa' in c['sql'] for c in consultas), 1)
+        self.processo.refresh_from_db()
+        self.assertEqual(self.processo.etapa_atual, self.etapa2)
+
+
+class FluxoTestCase(TestCase):
+    """Testes para a tabela de transições (processos/fluxo.py)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='ADMIN')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa1 = Etapa.objects.create(template=self.template, nome='Análise', ordem=1)
+        self.etapa2 = Etapa.objects.create(template=self.template, nome='Revisão', ordem=2)
+        self.etapa3 = Etapa.objects.create(template=self.template, nome='Arquivo', ordem=3)
+
+    def _valor(self, labels):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value('workflow_transicoes_total', labels) or 0
+
+    def test_condicao_padrao_e_ordem(self):
+        """Testa a prioridade: encaminhamento com condição, sem condição e etapa seguinte"""
+        tabela = fluxo.do_template(self.template.pk)
+        self.assertEqual(tabela.proxima(self.etapa1.pk, 'APROVADO'), self.etapa2.pk)
+        self.assertIs(tabela.proxima(self.etapa3.pk), fluxo.FIM)
+
+        Encaminhamento.objects.create(etapa_origem=self.etapa2, etapa_destino=self.etapa1, condicao='Precisa Revisão')
+        Encaminhamento.objects.create(etapa_origem=self.etapa1, etapa_destino=self.etapa3)
+        # Os sinais descartam a tabela compilada
+        tabela = fluxo.da_etapa(self.etapa2.pk)
+        with self.assertNumQueries(0):
+            self.assertIs(fluxo.do_template(self.template.pk), tabela)
+            self.assertEqual(tabela.proxima(self.etapa2.pk, 'PRECISA_REVISAO'), self.etapa1.pk)
+            self.assertEqual(tabela.proxima(self.etapa2.pk, 'APROVADO'), self.etapa3.pk)
+            self.assertEqual(tabela.proxima(self.etapa1.pk, 'APROVADO'), self.etapa3.pk)
+        self.assertEqual(tabela.destinos[self.etapa2.pk], {self.etapa1.pk: 'Precisa Revisão'})
+
+    def test_execucao_segue_a_tabela_e_conta_transicoes(self):
+        """Testa a execução por um encaminhamento condicional, o contador e a etapa que mudou"""
+        Encaminhamento.objects.create(etapa_origem=self.etapa1, etapa_destino=self.etapa3, condicao='Rejeitado')
+        processo = ProcessoInstancia.objects.create(template=self.template, titulo='Processo', criado_por=self.user)
+        processo.iniciar(self.user)
+        rotulos = {
+            'template': str(self.template.pk), 'origem': str(self.etapa1.pk),
+            'destino': str(self.etapa3.pk), 'condicao': 'REJEITADO',
+        }
+        antes = self._valor(rotulos)
+
+        self.client.login(username='testuser', password='testpass123')
+        url = reverse('processo_executar', args=[processo.pk])
+        self.client.post(url, {'resultado': 'REJEITADO', 'etapa_id': self.etapa1.pk})
+        processo.refresh_from_db()
+        self.assertEqual(processo.etapa_atual, self.etapa3)
+        self.assertEqual(self._valor(rotulos), antes + 1)
+
+        # Formulário antigo (etapa 1): nada é gravado
+        response = self.client.post(url, {'resultado': 'REJEITADO', 'etapa_id': self.etapa1.pk}, follow=True)
+        self.assertContains(response, 'O processo mudou de etapa')
+        self.assertEqual(processo.etapas_executadas.count(), 1)
+
+
+class CondicoesTestCase(TestCase):
+    """Testes para as condições em expressão (processos/condicoes.py) e a simulação"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='ADMIN')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa1 = Etapa.objects.create(template=self.template, nome='Análise', ordem=1)
+        self.etapa2 = Etapa.objects.create(template=self.template, nome='Revisão', ordem=2)
+        self.etapa3 = Etapa.objects.create(template=self.template, nome='Arquivo', ordem=3)
+
+    def test_compilar_e_avaliar(self):
+        """Testa a avaliação, o cache por texto e as construções recusadas"""
+        condicao = condicoes.compilar("resultado == 'REJEITADO' and dias > 30")
+        self.assertIs(condicoes.compilar("resultado == 'REJEITADO' and dias > 30"), condicao)
+        self.assertTrue(condicao.usa_processo)
+        self.assertTrue(condicao.avaliar({'resultado': 'REJEITADO', 'dias': 31}))
+        self.assertFalse(condicao.avaliar({'resultado': 'REJEITADO', 'dias': 30}))
+        self.assertTrue(condicoes.compilar("'urgente' in titulo or 0 < dias <= 2").avaliar({'titulo': 'urgente', 'dias': 9}))
+        self.assertFalse(condicoes.compilar("resultado not in ('APROVADO', 'PENDENTE')").usa_processo)
+        # Tipos incompatíveis: a condição não vale
+        self.assertFalse(condicoes.compilar('dias > 3').avaliar({'dias': None}))
+
+        for texto in ("__import__('os')", 'titulo.upper()', 'titulo[0]', 'usuario == 1', 'resultado ==', 'dias + 1'):
+            with self.subTest(texto=texto), self.assertRaises(condicoes.ErroCondicao):
+                condicoes.compilar(texto)
+        self.assertTrue(condicoes.eh_rotulo('Precisa Revisão'))
+        condicoes.validar('Aprovado')
+
+    def test_validacao_do_encaminhamento(self):
+        """Testa que o admin recusa expressões inválidas"""
+        encaminhamento = Encaminhamento(etapa_origem=self.etapa1, etapa_destino=self.etapa3, condicao='titulo.lower()')
+        with self.assertRaises(ValidationError) as contexto:
+            encaminhamento.full_clean()
+        self.assertIn('condicao', contexto.exception.message_dict)
+
+    def test_roteamento_por_expressao(self):
+        """Testa a expressão com campos do processo na tabela e na execução"""
+        Encaminhamento.objects.create(
+            etapa_origem=self.etapa1, etapa_destino=self.etapa3, condicao="resultado == 'APROVADO' and 'urgente' in titulo",
+        )
+        tabela = fluxo.do_template(self.template.pk)
+        self.assertTrue(tabela.usa_processo(self.etapa1.pk))
+        self.assertFalse(tabela.usa_processo(self.etapa2.pk))
+        self.assertEqual(tabela.proxima(self.etapa1.pk, 'APROVADO', {'resultado': 'APROVADO', 'titulo': 'urgente'}), self.etapa3.pk)
+        self.assertEqual(tabela.proxima(self.etapa1.pk, 'APROVADO', {'resultado': 'APROVADO', 'titulo': 'normal'}), self.etapa2.pk)
+
+        urgente = ProcessoInstancia.objects.create(template=self.template, titulo='Pedido urgente', criado_por=self.user)
+        normal = ProcessoInstancia.objects.create(template=self.template, titulo='Pedido', criado_por=self.user)
+        for processo in (urgente, normal):
+            processo.iniciar(self.user)
+        executar_etapa(urgente.pk, self.user.pk, 'APROVADO', etapa_id=self.etapa1.pk)
+        executar_etapas_em_lote([normal.pk], self.user, 'APROVADO')
+        urgente.refresh_from_db()
+        normal.refresh_from_db()
+        self.assertEqual(urgente.etapa_atual, self.etapa3)
+        self.assertEqual(normal.etapa_atual, self.etapa2)
+
+    def test_simulacao(self):
+        """Testa a simulação contra o histórico e uma condição nova pelo comando"""
+        for titulo in ('Pedido urgente', 'Pedido'):
+            processo = ProcessoInstancia.objects.create(template=self.template, titulo=titulo, criado_por=self.user)
+            processo.iniciar(self.user)
+            executar_etapa(processo.pk, self.user.pk, 'APROVADO', etapa_id=self.etapa1.pk)
+
+        execucoes = fluxo.historico(self.template.pk)
+        self.assertEqual(len(execucoes), 2)
+        # Os dois foram para a etapa 2, que ainda está aberta
+        self.assertEqual({seguinte for _, seguinte, _ in execucoes}, {'aberto'})
+
+        Encaminhamento.objects.create(etapa_origem=self.etapa1, etapa_destino=self.etapa3, condicao="'urgente' in titulo")
+        resultado = fluxo.simular(fluxo.compilar(self.template.pk), execucoes)
+        self.assertEqual(resultado['transicoes'], {(self.etapa1.pk, self.etapa3.pk): 1, (self.etapa1.pk, self.etapa2.pk): 1})
+        self.assertFalse(resultado['divergencias'])
+
+        saida = io.StringIO()
+        call_command(
+            'simular_fluxo', self.template.pk, '--condicao', "titulo == 'Pedido'", '--origem', self.etapa1.pk,
+            stdout=saida,
+        )
+        self.assertIn('2 execuções', saida.getvalue())
+        self.assertIn('Análise → fim', saida.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('simular_fluxo', self.template.pk, '--condicao', 'dias(', '--origem', self.etapa1.pk)
+
+
+class VersaoProcessoTestCase(TestCase):
+    """Testes para a concorrência otimista em ProcessoInstancia (versao)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='ADMIN')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa1 = Etapa.objects.create(template=self.template, nome='Análise', ordem=1)
+        self.etapa2 = Etapa.objects.create(template=self.template, nome='Revisão', ordem=2)
+        self.processo = ProcessoInstancia.objects.create(template=self.template, titulo='Processo', criado_por=self.user)
+        self.processo.iniciar(self.user)
+
+    def _conflitos(self, operacao):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value('workflow_conflitos_versao_total', {'operacao': operacao}) or 0
+
+    def test_save_compara_versao(self):
+        """Testa que o save sobre uma cópia desatualizada é recusado"""
+        self.assertEqual(self.processo.versao, 2)
+        outra_copia = ProcessoInstancia.objects.get(pk=self.processo.pk)
+        self.processo.titulo = 'Primeiro'
+        self.processo.save()
+        self.assertEqual(self.processo.versao, 3)
+
+        antes = self._conflitos('salvar')
+        outra_copia.titulo = 'Segundo'
+        with self.assertRaises(ConflitoVersao), transaction.atomic():
+            outra_copia.save()
+        self.assertEqual(self._conflitos('salvar'), antes + 1)
+        self.processo.refresh_from_db()
+        self.assertEqual(self.processo.titulo, 'Primeiro')
+
+        # UPDATEs fora do save (lote, procedures) também mudam a versão
+        ProcessoInstancia.objects.filter(pk=self.processo.pk).update(status='AGUARDANDO')
+        self.processo.refresh_from_db()
+        self.assertEqual(self.processo.versao, 4)
+
+    def test_execucao_com_versao_antiga(self):
+        """Testa a execução e o encaminhamento com a versão lida no formulário"""
+        versao = self.processo.versao
+        ProcessoInstancia.objects.filter(pk=self.processo.pk).update(usuario_atual=None)
+
+        antes = self._conflitos('executar')
+        estado = executar_etapa(self.processo.pk, self.user.pk, 'APROVADO', etapa_id=self.etapa1.pk, versao=versao)
+        self.assertEqual(estado['situacao'], 'CONFLITO')
+        self.assertEqual(estado['versao'], versao + 1)
+        self.assertEqual(self._conflitos('executar'), antes + 1)
+        self.assertFalse(self.processo.etapas_executadas.exists())
+
+        antes = self._conflitos('encaminhar')
+        with self.assertRaises(ConflitoVersao), transaction.atomic():
+            encaminhar_processo(self.processo.pk, self.etapa2.pk, self.user.pk, versao=versao)
+        self.assertEqual(self._conflitos('encaminhar'), antes + 1)
+        # Só quem detecta o conflito conta; criar a exceção não
+        antes = self._conflitos('salvar')
+        ConflitoVersao(self.processo.pk, versao)
+        self.assertEqual(self._conflitos('salvar'), antes)
+        self.assertEqual(encaminhar_processo(self.processo.pk, self.etapa2.pk, self.user.pk, versao=versao + 1), versao + 2)
+
+    def test_view_pede_para_repetir(self):
+        """Testa que o formulário desatualizado volta para o usuário sem gravar nada"""
+        self.client.login(username='testuser', password='testpass123')
+        url = reverse('processo_executar', args=[self.processo.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.context['form'].initial['versao'], self.processo.versao)
+
+        ProcessoInstancia.objects.filter(pk=self.processo.pk).update(descricao='Alterado')
+        dados = {'resultado': 'APROVADO', 'etapa_id': self.etapa1.pk, 'versao': self.processo.versao}
+        response = self.client.post(url, dados)
+        self.assertRedirects(response, url)
+        self.assertFalse(self.processo.etapas_executadas.exists())
+
+        dados['versao'] = self.processo.versao + 1
+        self.client.post(url, dados)
+        self.processo.refresh_from_db()
+        self.assertEqual(self.processo.etapa_atual, self.etapa2)
+
+
+class IdempotenciaTestCase(TestCase):
+    """Testes para as chaves de idempotência dos POSTs (workflow/idempotencia.py)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123', perfil='ADMIN')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        self.etapa1 = Etapa.objects.create(template=self.template, nome='Análise', ordem=1)
+        Etapa.objects.create(template=self.template, nome='Revisão', ordem=2)
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_formulario_repetido_cria_um_processo(self):
+        """Testa que o mesmo formulário enviado duas vezes cria um processo só"""
+        response = self.client.get(reverse('processo_create'))
+        chave = response.context['chave_idempotencia']
+        self.assertContains(response, f'name="chave_idempotencia" value="{chave}"')
+
+        dados = {'template': self.template.pk, 'titulo': 'Processo', 'chave_idempotencia': chave}
+        primeira = self.client.post(reverse('processo_create'), dados)
+        repetida = self.client.post(reverse('processo_create'), dados)
+        self.assertEqual(ProcessoInstancia.objects.count(), 1)
+        self.assertEqual(repetida.status_code, 302)
+        self.assertEqual(repetida['Location'], primeira['Location'])
+        self.assertEqual(repetida['Idempotent-Replayed'], 'true')
+
+        # Outra chave é outro processo
+        self.client.post(reverse('processo_create'), {**dados, 'chave_idempotencia': 'outra'})
+        self.assertEqual(ProcessoInstancia.objects.count(), 2)
+
+    def test_cabecalho_e_requisicao_em_andamento(self):
+        """Testa a chave no cabeçalho e o 409 enquanto a primeira ainda roda"""
+        processo = ProcessoInstancia.objects.create(template=self.template, titulo='Processo', criado_por=self.user)
+        processo.iniciar(self.user)
+        url = reverse('processo_executar', args=[processo.pk])
+        dados = {'resultado': 'APROVADO', 'etapa_id': self.etapa1.pk, 'versao': processo.versao}
+
+        for _ in range(2):
+            response = self.client.post(url, dados, HTTP_IDEMPOTENCY_KEY='abc')
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(processo.etapas_executadas.count(), 1)
+
+        request = RequestFactory().post(url)
+        request.user = self.user
+        digest = idempotencia._digest(request, 'processos.views.processo_executar_etapa', {'pk': processo.pk}, 'xyz')
+        self.assertIsNone(idempotencia._reservar(digest))
+        response = self.client.post(url, dados, HTTP_IDEMPOTENCY_KEY='xyz')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(processo.etapas_executadas.count(), 1)
+
+    def test_limpeza_das_chaves_expiradas(self):
+        """Testa que só as chaves mais velhas que o TTL são apagadas"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO idempotencia_chave (chave, criada_em) VALUES "
+                "('\\x01', NOW() - INTERVAL '2 days'), ('\\x02', NOW() - INTERVAL '3 days'), ('\\x03', NOW())"
+            )
+            self.assertEqual(idempotencia.limpar_chaves_expiradas(lote=1), 2)
+            cursor.execute('SELECT COUNT(*) FROM idempotencia_chave')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class FilaTarefasTestCase(TestCase):
+    """Testes para a fila de tarefas (processos/fila.py)"""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='testpass123', perfil='ADMIN')
+        self.operador = User.objects.create_user(username='operador', password='testpass123', perfil='OPERADOR')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.admin)
+        self.etapa1 = Etapa.objects.create(template=self.template, nome='Análise', ordem=1)
+        self.etapa2 = Etapa.objects.create(template=self.template, nome='Revisão', ordem=2)
+        self.etapa1.usuarios_permitidos.add(self.operador)
+        self.antigo, self.novo, self.urgente = [self._processo(titulo) for titulo in ('Antigo', 'Novo', 'Urgente')]
+        ProcessoInstancia.objects.filter(pk=self.antigo.pk).update(data_entrada_etapa=timezone.now() - timedelta(days=2))
+        ProcessoInstancia.objects.filter(pk=self.urgente.pk).update(prioridade=2)
+
+    def _processo(self, titulo):
+        processo = ProcessoInstancia.objects.create(template=self.template, titulo=titulo, criado_por=self.admin)
+        processo.iniciar(self.admin)
+        return processo
+
+    def test_ordem_e_reserva(self):
+        """Testa a prioridade, a ordem de chegada, as reservas e a expiração"""
+        self.assertEqual(fila.reservar(self.operador)['id'], self.urgente.pk)
+        self.assertEqual(fila.reservar(self.operador)['id'], self.antigo.pk)
+        tarefa = fila.reservar(self.admin)
+        self.assertEqual(tarefa['id'], self.novo.pk)
+        self.assertIsNone(fila.reservar(self.admin))
+
+        self.novo.refresh_from_db()
+        self.assertEqual(self.novo.reservado_por, self.admin)
+        self.assertTrue(fila.renovar(self.novo.pk, self.admin))
+        self.assertFalse(fila.renovar(self.novo.pk, self.operador))
+
+        # Reserva expirada volta para a fila
+        ProcessoInstancia.objects.filter(pk=self.antigo.pk).update(reservado_ate=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(fila.reservar(self.admin)['id'], self.antigo.pk)
+        self.assertTrue(fila.liberar(self.novo.pk, self.admin))
+        self.assertEqual(fila.reservar(self.admin)['id'], self.novo.pk)
+
+    def test_so_etapas_permitidas_e_mudanca_de_etapa(self):
+        """Testa que o operador só pega as etapas dele e que avançar desfaz a reserva"""
+        for processo in (self.antigo, self.novo, self.urgente):
+            executar_etapa(processo.pk, self.admin.pk, 'APROVADO', etapa_id=self.etapa1.pk)
+        self.assertIsNone(fila.reservar(self.operador))
+        self.assertIsNone(fila.reservar(self.admin, etapa_id=self.etapa1.pk))
+
+        tarefa = fila.reservar(self.admin, etapa_id=self.etapa2.pk)
+        executar_etapa(tarefa['id'], self.admin.pk, 'APROVADO', etapa_id=self.etapa2.pk)
+        processo = ProcessoInstancia.objects.get(pk=tarefa['id'])
+        self.assertEqual(processo.status, 'CONCLUIDO')
+        self.assertIsNone(processo.reservado_por)
+
+    def test_reservar_e_liberar_nao_mudam_o_responsavel(self):
+        """Testa que a reserva não muda usuario_atual, a versão nem "Meus Processos" de quem é responsável"""
+        responsavel = User.objects.create_user(username='responsavel', password='testpass123', perfil='OPERADOR')
+        ProcessoInstancia.objects.filter(pk=self.urgente.pk).update(usuario_atual=responsavel)
+        versao = ProcessoInstancia.objects.get(pk=self.urgente.pk).versao
+
+        tarefa = fila.reservar(self.operador)
+        self.assertEqual(tarefa['id'], self.urgente.pk)
+        self.assertEqual(tarefa['versao'], versao)
+        processo = ProcessoInstancia.objects.get(pk=self.urgente.pk)
+        self.assertEqual((processo.usuario_atual, processo.versao), (responsavel, versao))
+
+        self.client.login(username='operador', password='testpass123')
+        self.assertIn(processo, self.client.get(reverse('meus_processos')).context['processos'])
+        response = self.client.post(reverse('tarefa_reserva', args=[self.urgente.pk]), {'acao': 'liberar'})
+        self.assertRedirects(response, reverse('meus_processos'))
+        self.assertNotIn(processo, self.client.get(reverse('meus_processos')).context['processos'])
+
+        processo.refresh_from_db()
+        self.assertEqual((processo.usuario_atual, processo.versao, processo.reservado_por), (responsavel, versao, None))
+        self.client.login(username='responsavel', password='testpass123')
+        self.assertEqual(list(self.client.get(reverse('meus_processos')).context['processos']), [processo])
+
+    def test_reserva_vale_na_execucao(self):
+        """Testa que só quem reservou executa enquanto a reserva vale e os controles da tela de execução"""
+        tarefa = fila.reservar(self.operador)
+        self.assertEqual(tarefa['id'], self.urgente.pk)
+
+        estado = executar_etapa(self.urgente.pk, self.admin.pk, 'APROVADO', etapa_id=self.etapa1.pk)
+        self.assertEqual(estado['situacao'], 'RESERVADO')
+        self.assertIsNone(estado['etapa_executada_id'])
+        resultados = executar_etapas_em_lote([self.urgente.pk, self.novo.pk], self.admin, 'APROVADO')
+        self.assertEqual(resultados[self.urgente.pk], 'Processo reservado na fila por outra pessoa')
+        self.assertIsNone(resultados[self.novo.pk])
+        self.assertFalse(EtapaExecutada.objects.filter(processo=self.urgente).exists())
+
+        self.client.login(username='admin', password='testpass123')
+        response = self.client.get(reverse('processo_executar', args=[self.urgente.pk]))
+        self.assertContains(response, 'Reservado na fila para')
+        self.assertNotContains(response, 'value="renovar"')
+        response = self.client.post(reverse('processo_executar', args=[self.urgente.pk]), {
+            'resultado': 'APROVADO', 'etapa_id': self.etapa1.pk, 'versao': tarefa['versao'],
+        }, follow=True)
+        self.assertContains(response, 'reservado na fila para operador')
+
+        self.client.login(username='operador', password='testpass123')
+        response = self.client.get(reverse('processo_executar', args=[self.urgente.pk]))
+        self.assertContains(response, 'value="renovar"')
+        response = self.client.post(reverse('tarefa_reserva', args=[self.urgente.pk]), {'acao': 'renovar'})
+        self.assertRedirects(response, reverse('processo_executar', args=[self.urgente.pk]))
+        estado = executar_etapa(self.urgente.pk, self.operador.pk, 'APROVADO', etapa_id=self.etapa1.pk)
+        self.assertEqual(estado['situacao'], 'AVANCOU')
+
+        # Reserva expirada não impede ninguém
+        # (NOW() no banco é o início da transação do teste)
+        fila.reservar(self.operador)
+        ProcessoInstancia.objects.filter(pk=self.antigo.pk).update(reservado_ate=timezone.now() - timedelta(hours=1))
+        estado = executar_etapa(self.antigo.pk, self.admin.pk, 'APROVADO', etapa_id=self.etapa1.pk)
+        self.assertEqual(estado['situacao'], 'AVANCOU')
+
+    def test_resumo_view_e_metricas(self):
+        """Testa o resumo por etapa, a página, o endpoint e o coletor do /metrics"""
+        fila.reservar(self.operador)
+        [linha] = fila.resumo([self.etapa1.pk])
+        self.assertEqual((linha['disponiveis'], linha['reservadas']), (2, 1))
+        self.assertGreaterEqual(linha['espera_maxima'], timedelta(days=2))
+
+        self.client.login(username='operador', password='testpass123')
+        response = self.client.get(reverse('meus_processos'))
+        self.assertEqual(response.context['fila'][0]['disponiveis'], 2)
+        response = self.client.post(reverse('proxima_tarefa'))
+        self.assertRedirects(response, reverse('processo_executar', args=[self.antigo.pk]))
+        response = self.client.post(reverse('proxima_tarefa'), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['tarefa']['id'], self.novo.pk)
+        response = self.client.post(reverse('proxima_tarefa'), HTTP_ACCEPT='application/json')
+        self.assertIsNone(response.json()['tarefa'])
+
+        metricas = {
+            (amostra.labels['situacao'], amostra.labels['etapa']): amostra.value
+            for familia in fila.ColetorFila().collect() if familia.name == 'workflow_fila_tarefas'
+            for amostra in familia.samples
+        }
+        self.assertEqual(metricas[('reservadas', str(self.etapa1.pk))], 3)
+
+
+class AtribuicaoTestCase(TestCase):
+    """Testes para a atribuição automática no encaminhamento (processos/atribuicao.py)"""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='testpass123', perfil='ADMIN')
+        self.ana = User.objects.create_user(username='ana', password='testpass123')
+        self.bia = User.objects.create_user(username='bia', password='testpass123')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.admin)
+        self.etapa1 = Etapa.objects.create(template=self.template, nome='Triagem', ordem=1)
+        self.etapa2 = Etapa.objects.create(template=self.template, nome='Análise', ordem=2)
+        self.etapa2.usuarios_permitidos.add(self.ana, self.bia)
+
+    def _processo(self, responsavel):
+        processo = ProcessoInstancia.objects.create(template=self.template, titulo='Processo', criado_por=self.admin)
+        processo.iniciar(responsavel)
+        return processo
+
+    def _carga(self, usuario):
+        return CargaUsuario.objects.filter(usuario=usuario).values_list('abertos', flat=True).first() or 0
+
+    def test_fila_respeita_a_distribuicao(self):
+        """Testa que "pegar a próxima tarefa" não entrega a um operador o processo distribuído ao outro"""
+        processos = [self._processo(self.admin) for _ in range(2)]
+        ProcessoInstancia.objects.filter(pk__in=[p.pk for p in processos]).update(etapa_atual=self.etapa2)
+        escolhidos = atribuicao.distribuir([(p.pk, self.etapa2.pk) for p in processos])
+        self.assertEqual(set(escolhidos.values()), {self.ana.pk, self.bia.pk})
+        for processo_id, usuario_id in escolhidos.items():
+            ProcessoInstancia.objects.filter(pk=processo_id).update(usuario_atual_id=usuario_id)
+        # Com responsável que não é candidato da etapa: vai para quem pegar
+        livre = self._processo(self.admin)
+        ProcessoInstancia.objects.filter(pk=livre.pk).update(etapa_atual=self.etapa2, prioridade=2)
+
+        da_ana = next(pk for pk, usuario_id in escolhidos.items() if usuario_id == self.ana.pk)
+        da_bia = next(pk for pk, usuario_id in escolhidos.items() if usuario_id == self.bia.pk)
+        self.assertEqual(fila.reservar(self.bia)['id'], livre.pk)
+        self.assertEqual(fila.reservar(self.bia)['id'], da_bia)
+        self.assertIsNone(fila.reservar(self.bia))
+        self.assertEqual(fila.reservar(self.ana)['id'], da_ana)
+        self.assertEqual(
+            dict(ProcessoInstancia.objects.filter(pk__in=escolhidos).values_list('pk', 'usuario_atual_id')), escolhidos,
+        )
+
+        # Responsável inativo não segura o processo
+        self.ana.is_active = False
+        self.ana.save()
+        ProcessoInstancia.objects.filter(pk=da_ana).update(reservado_por=None, reservado_ate=None)
+        self.assertEqual(fila.reservar(self.bia)['id'], da_ana)
+
+    def test_carga_mantida_pela_trigger(self):
+        """Testa a carga em criações, trocas de responsável, conclusões em lote e exclusões"""
+        processos = [self._processo(self.ana) for _ in range(3)]
+        self.assertEqual(self._carga(self.ana), 3)
+
+        ProcessoInstancia.objects.filter(pk=processos[0].pk).update(usuario_atual=self.bia)
+        ProcessoInstancia.objects.filter(pk=processos[1].pk).update(data_atualizacao=timezone.now())
+        self.assertEqual((self._carga(self.ana), self._carga(self.bia)), (2, 1))
+
+        finalizar_processos_em_lote([processos[0].pk, processos[1].pk])
+        processos[2].delete()
+        self.assertEqual((self._carga(self.ana), self._carga(self.bia)), (0, 0))
+        self.assertEqual(atribuicao.recalcular_cargas(), 0)
+
+    def test_estrategias(self):
+        """Testa menos carga, rodízio e último executor sem contar processos por candidato"""
+        self._processo(self.ana)
+        with self.assertNumQueries(2):
+            self.assertEqual(atribuicao.escolher(self.etapa2.pk), self.bia.pk)
+        self.assertIsNone(atribuicao.escolher(self.etapa1.pk))
+
+        # Rodízio ignora a carga: a bia nunca recebeu processo
+        Etapa.objects.filter(pk=self.etapa2.pk).update(atribuicao='RODIZIO')
+        self.assertEqual(atribuicao.escolher(self.etapa2.pk), self.bia.pk)
+        CargaUsuario.objects.update_or_create(usuario=self.bia, defaults={'ultima_atribuicao': timezone.now()})
+        self.assertEqual(atribuicao.escolher(self.etapa2.pk), self.ana.pk)
+
+        processo = self._processo(self.admin)
+        EtapaExecutada.objects.create(processo=processo, etapa=self.etapa2, executado_por=self.bia)
+        Etapa.objects.filter(pk=self.etapa2.pk).update(atribuicao='ULTIMO_EXECUTOR')
+        self.assertEqual(atribuicao.escolher(self.etapa2.pk, processo.pk), self.bia.pk)
+        # Sem permissão na etapa, cai para a menor carga
+        self.etapa2.usuarios_permitidos.remove(self.bia)
+        self.assertEqual(atribuicao.escolher(self.etapa2.pk, processo.pk), self.ana.pk)
+
+    def test_distribuir_lote(self):
+        """Testa que o lote soma a carga do que já distribuiu"""
+        self._processo(self.ana)
+        processos = [self._processo(self.admin) for _ in range(5)]
+        responsaveis = atribuicao.distribuir([(processo.pk, self.etapa2.pk) for processo in processos])
+        self.assertEqual(sorted(responsaveis.values()).count(self.bia.pk), 3)
+        self.assertEqual(sorted(responsaveis.values()).count(self.ana.pk), 2)
+        self.assertEqual(atribuicao.distribuir([(processos[0].pk, self.etapa1.pk)]), {})
+
+    def test_encaminhar(self):
+        """Testa o encaminhamento automático e o responsável escolhido no formulário"""
+        self._processo(self.ana)
+        processo = self._processo(self.admin)
+        self.client.login(username='admin', password='testpass123')
+        url = reverse('processo_encaminhar', args=[processo.pk])
+        response = self.client.post(url, {'proxima_etapa': self.etapa2.pk, 'versao': processo.versao})
+        self.assertRedirects(response, reverse('processo_detail', args=[processo.pk]))
+        processo.refresh_from_db()
+        self.assertEqual(processo.usuario_atual, self.bia)
+        self.assertEqual(processo.logs.get(acao='ENCAMINHAMENTO').usuario, self.admin)
+        self.assertEqual((self._carga(self.admin), self._carga(self.bia)), (0, 1))
+
+        # Escolhido no formulário: só quem pode executar a etapa
+        outro = self._processo(self.admin)
+        url = reverse('processo_encaminhar', args=[outro.pk])
+        carlos = User.objects.create_user(username='carlos', password='testpass123')
+        response = self.client.post(url, {
+            'proxima_etapa': self.etapa2.pk, 'usuario_destino': carlos.pk, 'versao': outro.versao,
+        })
+        self.assertIn('usuario_destino', response.context['form'].errors)
+        self.client.post(url, {'proxima_etapa': self.etapa2.pk, 'usuario_destino': self.ana.pk, 'versao': outro.versao})
+        outro.refresh_from_db()
+        self.assertEqual(outro.usuario_atual, self.ana)
+
+
+class CorrigirNumerosTestCase(TestCase):
+    """Testes para o comando corrigir_numeros"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.user)
+        agora = timezone.now()
+        # Números trocados entre si (exigem o número provisório) e um de outro ano
+        self.processos = []
+        for numero, criado in [
+            ('000002/2030', agora.replace(year=2030, month=1, day=1)),
+            ('000001/2030', agora.replace(year=2030, month=2, day=1)),
+            ('000003/2030', agora.replace(year=2030, month=3, day=1)),
+            ('000009/2031', agora.replace(year=2031, month=1, day=1)),
+        ]:
+            processo = ProcessoInstancia.objects.create(
+                template=self.template, titulo='Processo', criado_por=self.user, numero_processo=numero,
+            )
+            ProcessoInstancia.objects.filter(pk=processo.pk).update(data_criacao=criado)
+            self.processos.append(processo)
+
+    def _numeros(self):
+        return list(ProcessoInstancia.objects.order_by('data_criacao').values_list('numero_processo', flat=True))
+
+    def test_dry_run_nao_grava(self):
+        """Testa que o --dry-run mostra as diferenças sem gravar"""
+        antes = self._numeros()
+        saida = io.StringIO()
+        call_command('corrigir_numeros', dry_run=True, stdout=saida)
+        self.assertIn('000002/2030 → 000001/2030', saida.getvalue())
+        self.assertIn('3 processo(s) seriam corrigidos', saida.getvalue())
+        self.assertEqual(self._numeros(), antes)
+
+    def test_renumera_em_lotes(self):
+        """Testa a renumeração por ano em lotes, com números trocando de dono"""
+        saida = io.StringIO()
+        call_command('corrigir_numeros', lote=2, stdout=saida)
+        self.assertEqual(self._numeros(), ['000001/2030', '000002/2030', '000003/2030', '000001/2031'])
+        self.assertIn('Lote 2/2: 3/3', saida.getvalue())
+        saida = io.StringIO()
+        call_command('corrigir_numeros', stdout=saida)
+        self.assertIn('Nenhum processo precisou ser corrigido', saida.getvalue())
+
+    def test_lote_invalido(self):
+        """Testa que --lote menor que 1 é recusado antes de tocar no banco"""
+        antes = self._numeros()
+        for lote in (0, -1):
+            with self.assertRaises(CommandError):
+                call_command('corrigir_numeros', lote=lote, stdout=io.StringIO())
+        self.assertEqual(self._numeros(), antes)
+
+
+class ReordenarEtapasTestCase(TestCase):
+    """Testes para a reordenação de etapas e o comando corrigir_etapas"""
+
+    def setUp(self):
+        self.gestor = User.objects.create_user(username='gestor', password='testpass123', perfil='GESTOR')
+        self.template = TemplateProcesso.objects.create(nome='Template Teste', criado_por=self.gestor)
+        self.etapas = [
+            Etapa.objects.create(template=self.template, nome=nome, ordem=ordem)
+            for ordem, nome in enumerate(['Triagem', 'Análise', 'Aprovação'], start=1)
+        ]
+
+    def _ordem(self, template=None):
+        return list(Etapa.objects.filter(template=template or self.template).order_by('ordem').values_list('id', flat=True))
+
+    def test_troca_num_unico_update(self):
+        """Testa trocas de ordem (que colidiriam com a unicidade imediata) e a tabela de transições"""
+        triagem, analise, aprovacao = self.etapas
+        self.assertEqual(fluxo.do_template(self.template.pk).padrao[triagem.pk], analise.pk)
+
+        self.assertEqual(reordenar_etapas(self.template.pk, [aprovacao.pk, triagem.pk, analise.pk]), 3)
+        self.assertEqual(self._ordem(), [aprovacao.pk, triagem.pk, analise.pk])
+        self.assertEqual(fluxo.do_template(self.template.pk).padrao[triagem.pk], analise.pk)
+        self.assertEqual(fluxo.do_template(self.template.pk).padrao[aprovacao.pk], triagem.pk)
+        self.assertEqual(reordenar_etapas(self.template.pk, [aprovacao.pk, analise.pk, triagem.pk]), 2)
+
+        for invalida in ([triagem.pk, analise.pk], [triagem.pk, triagem.pk, analise.pk], [triagem.pk, analise.pk, 0]):
+            with self.assertRaises(ValidationError):
+                reordenar_etapas(self.template.pk, invalida)
+
+    def test_endpoint(self):
+        """Testa o endpoint do arrastar e soltar (JSON) e a permissão"""
+        url = reverse('etapas_reordenar', args=[self.template.pk])
+        nova = [self.etapas[1].pk, self.etapas[0].pk, self.etapas[2].pk]
+        self.client.login(username='gestor', password='testpass123')
+        response = self.client.post(url, {'etapas': nova}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'alteradas': 2})
+        self.assertEqual(self._ordem(), nova)
+        response = self.client.post(url, {'etapas': nova[:2]}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        # Template inexistente, mesmo com a lista vazia, e etapas de outro template
+        vazio = reverse('etapas_reordenar', args=[self.template.pk + 1000])
+        self.assertEqual(self.client.post(vazio, {}, HTTP_ACCEPT='application/json').status_code, 404)
+        outro = TemplateProcesso.objects.create(nome='Outro', criado_por=self.gestor)
+        response = self.client.post(
+            reverse('etapas_reordenar', args=[outro.pk]), {'etapas': nova}, HTTP_ACCEPT='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+        User.objects.create_user(username='operador', password='testpass123')
+        self.client.login(username='operador', password='testpass123')
+        response = self.client.post(url, {'etapas': list(reversed(nova))}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self._ordem(), nova)
+
+    def test_corrigir_etapas(self):
+        """Testa o comando em todos os templates num único UPDATE, com --dry-run"""
+        outro = TemplateProcesso.objects.create(nome='Outro', criado_por=self.gestor)
+        segunda = Etapa.objects.create(template=outro, nome='Segunda', ordem=7)
+        primeira = Etapa.objects.create(template=outro, nome='Primeira', ordem=3)
+        Etapa.objects.filter(pk=self.etapas[2].pk).update(ordem=9)
+
+        saida = io.StringIO()
+        call_command('corrigir_etapas', dry_run=True, stdout=saida)
+        self.assertIn('Ordem 9 → 3', saida.getvalue())
+        self.assertIn('3 etapa(s) seriam corrigidas', saida.getvalue())
+        self.assertEqual(Etapa.objects.get(pk=primeira.pk).ordem, 3)
+
+        call_command('corrigir_etapas', stdout=io.StringIO())
+        self.assertEqual(list(Etapa.objects.filter(template=outro).order_by('ordem').values_list('id', 'ordem')),
+                         [(primeira.pk, 1), (segunda.pk, 2)])
+        self.assertEqual(Etapa.objects.get(pk=self.etapas[2].pk).ordem, 3)
@@ -1,10 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, views_async
+
+# Sob ASGI as views de leitura usam as versões assíncronas (processos/views_async.py)
+if settings.SERVIDOR_ASGI:
+    dashboard, meus_processos = views_async.dashboard, views_async.meus_processos
+    processo_list, processo_detail = views_async.processo_list, views_async.processo_detail
+else:
+    dashboard, meus_processos = views.dashboard, views.meus_processos
+    processo_list, processo_detail = views.ProcessoListView.as_view(), views.ProcessoDetailView.as_view()
 
 urlpatterns = [
     # Dashboard
-    path('', views.dashboard, name='dashboard'),
-    path('meus-processos/', views.meus_processos, name='meus_processos'),
+    path('', dashboard, name='dashboard'),
+    path('meus-processos/', meus_processos, name='meus_processos'),
     
     # Templates
     path('templates/', views.TemplateProcessoListView.as_view(), name='template_list'),
@@ -14,15 +23,25 @@ urlpatterns = [
     
     # Etapas
     path('templates/<int:template_pk>/etapas/nova/', views.etapa_create, name='etapa_create'),
+    path('templates/<int:template_pk>/etapas/reordenar/', views.etapas_reordenar, name='etapas_reordenar'),
     path('etapas/<int:pk>/editar/', views.etapa_update, name='etapa_update'),
     
     # Processos
-    path('processos/', views.ProcessoListView.as_view(), name='processo_list'),
-    path('processos/<int:pk>/', views.ProcessoDetailView.as_view(), name='processo_detail'),
+    path('processos/', processo_list, name='processo_list'),
+    path('processos/<int:pk>/', processo_detail, name='processo_detail'),
     path('processos/novo/', views.processo_create, name='processo_create'),
+    path('processos/executar-lote/', views.processo_executar_lote, name='processo_executar_lote'),
     path('processos/<int:pk>/executar/', views.processo_executar_etapa, name='processo_executar'),
     path('processos/<int:pk>/encaminhar/', views.processo_encaminhar, name='processo_encaminhar'),
+    path('processos/proxima-tarefa/', views.proxima_tarefa, name='proxima_tarefa'),
+    path('processos/<int:pk>/reserva/', views.tarefa_reserva, name='tarefa_reserva'),
     
     # Documentos
     path('etapas-executadas/<int:etapa_executada_pk>/documentos/novo/', views.documento_upload, name='documento_upload'),
 ]
+
+# Streams SSE ficam abertos por minutos: só com o worker ASGI
+if settings.SERVIDOR_ASGI:
+    urlpatterns += [
+        path('meus-processos/eventos/', views_async.eventos_processos, name='processo_eventos'),
+    ]
@@ -0,0 +1,8 @@
+from django.urls import path
+from . import api
+
+# Incluído em /api/v1/ (workflow/urls.py)
+urlpatterns = [
+    path('processos/', api.processos, name='api_processos'),
+    path('processos/<int:pk>/historico/', api.historico, name='api_processo_historico'),
+]
@@ -1,28 +1,65 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db import transaction
+from django.core.exceptions import ValidationError
 from django.contrib import messages
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy, reverse
-from django.db.models import Q, Count
+from django.utils.decorators import method_decorator
+from django.db.models import Q, Count, Max, Prefetch
+from django.contrib.postgres.search import SearchQuery
 from django.utils import timezone
-from django.http import HttpResponseForbidden
+from django.http import Http404, HttpResponseForbidden, JsonResponse
+from django.views.decorators.http import require_POST
 from .models import (
     TemplateProcesso, Etapa, Encaminhamento,
-    ProcessoInstancia, EtapaExecutada, Documento, LogAuditoria
+    ProcessoInstancia, EtapaExecutada, Documento, LogAuditoria, ConflitoVersao
 )
 from processos.services import *
+from workflow import metricas
+from workflow.condicional import get_condicional
+from workflow.idempotencia import idempotente
+from workflow.routers import leitura_replica
+from . import atribuicao, cache, fila, fluxo
+from .consultas import limitar_consultas
+from .extracao import CONFIG_BUSCA, agendar_indexacao
 from .forms import (
     TemplateProcessoForm, EtapaForm, EncaminhamentoForm,
     ProcessoInstanciaForm, EtapaExecutadaForm, DocumentoForm,
-    ProcessoFiltroForm, EncaminharProcessoForm
+    ProcessoFiltroForm, EncaminharProcessoForm, ExecucaoLoteForm
 )
+from usuarios.models import Usuario
+
+# Sessão, usuário, processo, 3 prefetches e 2 checagens de permissão (+ folga)
+MAX_CONSULTAS_DETALHE = 10
+
+
+# ==================== GET CONDICIONAL ====================
+
+def validadores_processo_detail(request, pk):
+    linha = validadores_processo(pk)
+    return None if linha is None else (linha[0], linha[1:])
+
+
+def validadores_template_detail(request, pk):
+    linha = validadores_template(pk)
+    return None if linha is None else (linha[0], linha[1:])
+
+
+def validadores_processo_list(request):
+    # Processo que entra, sai ou muda na listagem altera o total ou a última modificação
+    resumo = filtrar_processos(request.user, request.GET).order_by().aggregate(
+        ultima=Max('data_atualizacao'), total=Count('id'),
+    )
+    return resumo['ultima'], (resumo['total'], versoes_etapas_templates())
 
 
 # ==================== DASHBOARD ====================
 
 @login_required
+@leitura_replica
 def dashboard(request):
     """Dashboard principal do sistema"""
     usuario = request.user
@@ -65,21 +102,25 @@ class TemplateProcessoListView(LoginRequiredMixin, ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        if not self.request.user.perfil in ['ADMIN', 'GESTOR']:
-            queryset = queryset.filter(ativo=True)
-        return queryset.annotate(num_etapas=Count('etapas'))
+        return cache.templates_com_etapas(somente_ativos=self.request.user.perfil not in ['ADMIN', 'GESTOR'])
 
 
+@method_decorator(get_condicional(validadores_template_detail), name='dispatch')
 class TemplateProcessoDetailView(LoginRequiredMixin, DetailView):
     """Detalhes de um template de processo"""
     model = TemplateProcesso
     template_name = 'processos/template_detail.html'
     context_object_name = 'template'
 
+    def get_object(self, queryset=None):
+        template, self.etapas = cache.template_detalhe(self.kwargs['pk'])
+        if template is None:
+            raise Http404('Template não encontrado')
+        return template
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['etapas'] = self.object.etapas.all().order_by('ordem')
+        context['etapas'] = self.etapas
         return context
 
 
@@ -149,9 +190,8 @@ def etapa_create(request, template_pk):
             except Exception as e:
                 messages.error(request, f'Erro ao criar etapa: {str(e)}')
     else:
-        # Sugere a próxima ordem
-        ultima_ordem = template.etapas.count()
-        form = EtapaForm(template=template, initial={'ordem': ultima_ordem + 1})
+        # A próxima ordem é sugerida pelo próprio form
+        form = EtapaForm(template=template)
 
     return render(request, 'processos/etapa_form.html', {
         'form': form,
@@ -196,8 +236,79 @@ def etapa_update(request, pk):
         'action': 'Editar'
     })
 
+@login_required
+@require_POST
+def etapas_reordenar(request, template_pk):
+    """Reordena as etapas do template (``etapas``: ids na nova ordem), usado pelo arrastar e soltar"""
+    template = get_object_or_404(TemplateProcesso, pk=template_pk)
+    quer_json = 'application/json' in request.headers.get('Accept', '')
+    if not request.user.perfil in ['ADMIN', 'GESTOR']:
+        if quer_json:
+            return JsonResponse({'erro': 'Sem permissão para reordenar etapas.'}, status=403)
+        messages.error(request, 'Você não tem permissão para reordenar etapas.')
+        return redirect('template_detail', pk=template.pk)
+
+    etapa_ids = request.POST.getlist('etapas')
+    try:
+        if not all(etapa_id.isdigit() for etapa_id in etapa_ids):
+            raise ValidationError('Etapas inválidas.')
+        alteradas = reordenar_etapas(template.pk, [int(etapa_id) for etapa_id in etapa_ids])
+    except ValidationError as e:
+        if quer_json:
+            return JsonResponse({'erro': e.messages[0]}, status=400)
+        messages.error(request, e.messages[0])
+        return redirect('template_detail', pk=template.pk)
+
+    if quer_json:
+        return JsonResponse({'alteradas': alteradas})
+    messages.success(request, 'Ordem das etapas atualizada!')
+    return redirect('template_detail', pk=template_pk)
+
 # ==================== PROCESSOS ====================
 
+def filtrar_processos(usuario, dados):
+    """Processos visíveis ao usuário com os filtros da listagem (compartilhado com as views assíncronas)"""
+    queryset = ProcessoInstancia.objects.all()
+
+    # Filtra por usuário se não for admin/gestor
+    if not usuario.perfil in ['ADMIN', 'GESTOR']:
+        queryset = queryset.filter(
+            Q(criado_por=usuario) |
+            Q(usuario_atual=usuario) |
+            Q(etapas_executadas__executado_por=usuario)
+        ).distinct()
+
+    # Aplica filtros do formulário
+    form = ProcessoFiltroForm(dados)
+    if form.is_valid():
+        if form.cleaned_data.get('numero_processo'):
+            queryset = queryset.filter(
+                numero_processo__icontains=form.cleaned_data['numero_processo']
+            )
+        if form.cleaned_data.get('template'):
+            queryset = queryset.filter(template=form.cleaned_data['template'])
+        if form.cleaned_data.get('status'):
+            queryset = queryset.filter(status=form.cleaned_data['status'])
+        if form.cleaned_data.get('criado_por'):
+            queryset = queryset.filter(criado_por=form.cleaned_data['criado_por'])
+        if form.cleaned_data.get('usuario_atual'):
+            queryset = queryset.filter(usuario_atual=form.cleaned_data['usuario_atual'])
+        if form.cleaned_data.get('data_inicio'):
+            queryset = queryset.filter(data_criacao__gte=form.cleaned_data['data_inicio'])
+        if form.cleaned_data.get('data_fim'):
+            queryset = queryset.filter(data_criacao__lte=form.cleaned_data['data_fim'])
+        if form.cleaned_data.get('conteudo'):
+            # Busca textual nos anexos (tsvector com índice GIN)
+            busca = SearchQuery(form.cleaned_data['conteudo'], config=CONFIG_BUSCA, search_type='websearch')
+            queryset = queryset.filter(
+                id__in=Documento.objects.filter(conteudo_busca=busca).values('etapa_executada__processo_id')
+            )
+
+    return queryset.select_related('template', 'etapa_atual', 'usuario_atual', 'criado_por').order_by('-data_criacao')
+
+
+@method_decorator(leitura_replica, name='dispatch')
+@method_decorator(get_condicional(validadores_processo_list), name='dispatch')
 class ProcessoListView(LoginRequiredMixin, ListView):
     """Lista processos com filtros"""
     model = ProcessoInstancia
@@ -206,71 +317,61 @@ class ProcessoListView(LoginRequiredMixin, ListView):
     paginate_by = 15
 
     def get_queryset(self):
-        queryset = ProcessoInstancia.objects.all()
-
-        # Filtra por usuário se não for admin/gestor
-        if not self.request.user.perfil in ['ADMIN', 'GESTOR']:
-            queryset = queryset.filter(
-                Q(criado_por=self.request.user) |
-                Q(usuario_atual=self.request.user) |
-                Q(etapas_executadas__executado_por=self.request.user)
-            ).distinct()
-
-        # Aplica filtros do formulário
-        form = ProcessoFiltroForm(self.request.GET)
-        if form.is_valid():
-            if form.cleaned_data.get('numero_processo'):
-                queryset = queryset.filter(
-                    numero_processo__icontains=form.cleaned_data['numero_processo']
-                )
-            if form.cleaned_data.get('template'):
-                queryset = queryset.filter(template=form.cleaned_data['template'])
-            if form.cleaned_data.get('status'):
-                queryset = queryset.filter(status=form.cleaned_data['status'])
-            if form.cleaned_data.get('criado_por'):
-                queryset = queryset.filter(criado_por=form.cleaned_data['criado_por'])
-            if form.cleaned_data.get('usuario_atual'):
-                queryset = queryset.filter(usuario_atual=form.cleaned_data['usuario_atual'])
-            if form.cleaned_data.get('data_inicio'):
-                queryset = queryset.filter(data_criacao__gte=form.cleaned_data['data_inicio'])
-            if form.cleaned_data.get('data_fim'):
-                queryset = queryset.filter(data_criacao__lte=form.cleaned_data['data_fim'])
-
-        return queryset.select_related('template', 'etapa_atual', 'usuario_atual', 'criado_por').order_by('-data_criacao')
+        return filtrar_processos(self.request.user, self.request.GET)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['filtro_form'] = ProcessoFiltroForm(self.request.GET)
+        context['execucao_lote_form'] = ExecucaoLoteForm()
         return context
 
 
+@method_decorator(limitar_consultas(MAX_CONSULTAS_DETALHE), name='dispatch')
+@method_decorator(get_condicional(validadores_processo_detail), name='dispatch')
 class ProcessoDetailView(LoginRequiredMixin, DetailView):
     """Detalhes de um processo com validação no banco"""
     model = ProcessoInstancia
     template_name = 'processos/processo_detail.html'
     context_object_name = 'processo'
 
-    def dispatch(self, request, *args, **kwargs):
-        obj = self.get_object()
-        usuario_id = getattr(request.user, "pk", None)
-
-        if not usuario_id or not pode_ver_processo(obj.id, usuario_id):
+    def get_queryset(self):
+        # Uma busca do processo + prefetches fixos, independente do tamanho do histórico
+        return ProcessoInstancia.objects.select_related(
+            'template', 'etapa_atual', 'usuario_atual', 'criado_por'
+        ).prefetch_related(
+            Prefetch(
+                'etapas_executadas',
+                queryset=EtapaExecutada.objects.select_related('etapa', 'executado_por')
+                .prefetch_related('documentos').order_by('-data_inicio'),
+                to_attr='historico_etapas',
+            ),
+            Prefetch(
+                'logs',
+                queryset=LogAuditoria.objects.select_related('usuario').order_by('-data_hora')[:20],
+                to_attr='logs_recentes',
+            ),
+        )
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+
+        if not pode_ver_processo(self.object.id, request.user.pk):
             messages.error(request, 'Você não tem permissão para visualizar este processo.')
             #return redirect('processo_list')
 
-        self.object = obj
-        return super().dispatch(request, *args, **kwargs)
+        context = self.get_context_data(object=self.object)
+        return self.render_to_response(context)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['etapas_executadas'] = self.object.etapas_executadas.all().order_by('-data_inicio')
-        context['logs'] = self.object.logs.all().order_by('-data_hora')[:20]
+        context['etapas_executadas'] = self.object.historico_etapas
+        context['logs'] = self.object.logs_recentes
         context['pode_executar'] = self.object.pode_ser_executado_por(self.request.user)
         return context
 
 
-
 @login_required
+@idempotente
 def processo_create(request):
     """Criar novo processo"""
     if request.method == 'POST':
@@ -283,6 +384,7 @@ def processo_create(request):
             # Inicia o processo
             try:
                 processo.iniciar(request.user)
+                metricas.PROCESSOS_CRIADOS.inc()
                 messages.success(request, f'Processo {processo.numero_processo} iniciado com sucesso!')
                 return redirect('processo_detail', pk=processo.pk)
             except Exception as e:
@@ -295,58 +397,58 @@ def processo_create(request):
 
 
 @login_required
+@idempotente
 def processo_executar_etapa(request, pk):
     """Executar etapa do processo"""
-    processo = get_object_or_404(ProcessoInstancia, pk=pk)
-
-    # Verifica permissão
-    if not processo.pode_ser_executado_por(request.user):
-        messages.error(request, 'Você não tem permissão para executar esta etapa.')
-        return redirect('processo_detail', pk=pk)
-
     if request.method == 'POST':
         form = EtapaExecutadaForm(request.POST)
         if form.is_valid():
-            etapa_exec = form.save(commit=False)
-            etapa_exec.processo = processo
-            etapa_exec.etapa = processo.etapa_atual
-            etapa_exec.executado_por = request.user
-            etapa_exec.save()
-
-            # Conclui a etapa
-            etapa_exec.concluir(
-                resultado=form.cleaned_data['resultado'],
-                observacoes=form.cleaned_data['observacoes']
+            # Permissão, registro, avanço/conclusão e logs numa chamada (sp_executar_etapa)
+            estado = executar_etapa(
+                pk, request.user.pk, form.cleaned_data['resultado'], form.cleaned_data['observacoes'],
+                etapa_id=form.cleaned_data['etapa_id'], versao=form.cleaned_data['versao'],
             )
+            if estado['situacao'] == 'NAO_ENCONTRADO':
+                raise Http404('Processo não encontrado')
+            if estado['situacao'] in ('SEM_ETAPA', 'SEM_PERMISSAO'):
+                messages.error(request, 'Você não tem permissão para executar esta etapa.')
+                return redirect('processo_detail', pk=pk)
+            if estado['situacao'] == 'RESERVADO':
+                processo = ProcessoInstancia.objects.select_related('reservado_por').get(pk=pk)
+                if processo.reservado:
+                    dono = processo.reservado_por.get_full_name() or processo.reservado_por.username
+                    messages.warning(
+                        request,
+                        f'O processo está reservado na fila para {dono} até '
+                        f'{timezone.localtime(processo.reservado_ate):%H:%M}; só essa pessoa pode executá-lo até lá.',
+                    )
+                else:
+                    messages.warning(request, 'A reserva do processo acabou de mudar. Confira e envie de novo.')
+                return redirect('processo_detail', pk=pk)
+            if estado['situacao'] == 'ETAPA_MUDOU':
+                messages.warning(request, 'O processo mudou de etapa enquanto você preenchia. Confira antes de executar.')
+                return redirect('processo_detail', pk=pk)
+            if estado['situacao'] == 'CONFLITO':
+                messages.warning(request, 'O processo foi alterado por outra pessoa enquanto você preenchia. Confira e envie de novo.')
+                return redirect('processo_executar', pk=pk)
 
             messages.success(request, 'Etapa executada com sucesso!')
-
-            # Verifica se há próxima etapa
-            proxima_etapa = processo.etapa_atual.get_proxima_etapa()
-            if proxima_etapa:
-                # Avança automaticamente para próxima etapa
-                processo.etapa_atual = proxima_etapa
-                # Mantém o usuário atual (ou pode ser alterado conforme regra de negócio)
-                processo.usuario_atual = request.user
-                processo.save()
-
-                # Cria log de encaminhamento automático
-                LogAuditoria.objects.create(
-                    processo=processo,
-                    usuario=request.user,
-                    acao='ENCAMINHAMENTO',
-                    descricao=f'Processo avançou automaticamente para: {proxima_etapa.nome}'
-                )
-
-                messages.info(request, f'Processo avançou para: {proxima_etapa.nome}')
-                return redirect('processo_detail', pk=pk)
+            if estado['situacao'] == 'AVANCOU':
+                messages.info(request, f'Processo avançou para: {estado["etapa_atual_nome"]}')
             else:
-                # Última etapa - conclui o processo
-                processo.concluir()
                 messages.success(request, 'Processo concluído com sucesso!')
-                return redirect('processo_detail', pk=pk)
+            return redirect('processo_detail', pk=pk)
     else:
-        form = EtapaExecutadaForm()
+        form = None
+
+    processo = get_object_or_404(ProcessoInstancia.objects.select_related('etapa_atual', 'reservado_por'), pk=pk)
+    if form is None:
+        form = EtapaExecutadaForm(initial={'etapa_id': processo.etapa_atual_id, 'versao': processo.versao})
+
+    # Verifica permissão
+    if not processo.pode_ser_executado_por(request.user):
+        messages.error(request, 'Você não tem permissão para executar esta etapa.')
+        return redirect('processo_detail', pk=pk)
 
     return render(request, 'processos/etapa_executar.html', {
         'form': form,
@@ -355,6 +457,46 @@ def processo_executar_etapa(request, pk):
     })
 
 
+@login_required
+@require_POST
+def processo_executar_lote(request):
+    """Executar a etapa atual de vários processos (JSON com o resultado de cada um, se pedido)"""
+    form = ExecucaoLoteForm(request.POST, maximo=LOTE_EXECUCAO_MAXIMO)
+    quer_json = 'application/json' in request.headers.get('Accept', '')
+
+    if not form.is_valid():
+        if quer_json:
+            return JsonResponse({'erros': form.errors}, status=400)
+        for erros in form.errors.values():
+            for erro in erros:
+                messages.error(request, erro)
+        return redirect('processo_list')
+
+    resultados = executar_etapas_em_lote(
+        form.cleaned_data['processos'],
+        request.user,
+        form.cleaned_data['resultado'],
+        form.cleaned_data['observacoes'],
+    )
+    executados = sum(erro is None for erro in resultados.values())
+
+    if quer_json:
+        return JsonResponse({
+            'executados': executados,
+            'resultados': [
+                {'id': pk, 'ok': erro is None, **({'erro': erro} if erro else {})}
+                for pk, erro in resultados.items()
+            ],
+        })
+
+    if executados:
+        messages.success(request, f'Etapa executada em {executados} processo(s).')
+    for pk, erro in resultados.items():
+        if erro:
+            messages.warning(request, f'Processo #{pk}: {erro}')
+    return redirect('processo_list')
+
+
 @login_required
 def processo_encaminhar(request, pk):
     """Encaminhar processo para próxima etapa via stored procedure"""
@@ -374,12 +516,22 @@ def processo_encaminhar(request, pk):
 
             try:
                 with transaction.atomic():
+                    if usuario_destino is None:
+                        # Atribuição automática da etapa; sem candidatos, fica com quem encaminha
+                        responsavel_id = atribuicao.escolher(proxima_etapa.id, processo.id)
+                        usuario_destino = Usuario.objects.get(pk=responsavel_id) if responsavel_id else request.user
                     encaminhar_processo(
                         processo_id=processo.id,
                         proxima_etapa_id=proxima_etapa.id,
                         usuario_id=request.user.id,
-                        observacao=observacoes
+                        observacao=observacoes,
+                        versao=form.cleaned_data['versao'],
+                        responsavel_id=usuario_destino.id,
                     )
+                metricas.ENCAMINHAMENTOS.inc()
+                fluxo.do_template(processo.template_id).registrar(
+                    processo.etapa_atual_id, proxima_etapa.id, form.destinos.get(proxima_etapa.id)
+                )
 
                 messages.success(
                     request,
@@ -387,10 +539,13 @@ def processo_encaminhar(request, pk):
                 )
                 return redirect('processo_detail', pk=pk)
 
+            except ConflitoVersao:
+                messages.warning(request, 'O processo foi alterado por outra pessoa enquanto você preenchia. Confira e envie de novo.')
+                return redirect('processo_encaminhar', pk=pk)
             except Exception as e:
                 messages.error(request, f'Erro ao encaminhar processo: {str(e)}')
     else:
-        form = EncaminharProcessoForm(etapa_atual=processo.etapa_atual)
+        form = EncaminharProcessoForm(etapa_atual=processo.etapa_atual, initial={'versao': processo.versao})
 
     return render(request, 'processos/processo_encaminhar.html', {
         'form': form,
@@ -398,6 +553,7 @@ def processo_encaminhar(request, pk):
     })
 
 @login_required
+@idempotente
 def documento_upload(request, etapa_executada_pk):
     """Upload de documento em etapa executada"""
     etapa_executada = get_object_or_404(EtapaExecutada, pk=etapa_executada_pk)
@@ -415,6 +571,7 @@ def documento_upload(request, etapa_executada_pk):
             documento.etapa_executada = etapa_executada
             documento.enviado_por = request.user
             documento.save()
+            agendar_indexacao(documento.pk)
 
             # Cria log
             LogAuditoria.objects.create(
@@ -425,6 +582,7 @@ def documento_upload(request, etapa_executada_pk):
                 descricao=f'Documento "{documento.nome}" anexado à etapa {etapa_executada.etapa.nome}'
             )
 
+            metricas.DOCUMENTOS_ENVIADOS.inc()
             messages.success(request, 'Documento enviado com sucesso!')
             return redirect('processo_detail', pk=processo.pk)
     else:
@@ -438,13 +596,48 @@ def documento_upload(request, etapa_executada_pk):
 
 
 @login_required
+@leitura_replica
 def meus_processos(request):
-    """Lista processos do usuário atual"""
+    """Lista processos do usuário atual (os dele e os que ele reservou na fila)"""
     processos = ProcessoInstancia.objects.filter(
-        usuario_atual=request.user,
+        Q(usuario_atual=request.user) | Q(reservado_por=request.user, reservado_ate__gt=timezone.now()),
         status='EM_ANDAMENTO'
     ).select_related('template', 'etapa_atual').order_by('-data_atualizacao')
 
     return render(request, 'processos/meus_processos.html', {
-        'processos': processos
+        'processos': processos,
+        'fila': fila.resumo(fila.etapas_do_usuario(request.user)),
+        'eventos_ativos': settings.SERVIDOR_ASGI,
     })
+
+
+@login_required
+@require_POST
+def proxima_tarefa(request):
+    """Reserva o próximo processo da fila do usuário (opcionalmente de uma etapa) e abre a execução"""
+    etapa_id = request.POST.get('etapa')
+    tarefa = fila.reservar(request.user, int(etapa_id) if etapa_id and etapa_id.isdigit() else None)
+
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse({'tarefa': tarefa})
+    if tarefa is None:
+        messages.info(request, 'Nenhuma tarefa disponível na fila das suas etapas.')
+        return redirect('meus_processos')
+    reservado_ate = timezone.localtime(tarefa['reservado_ate'])
+    messages.success(request, f'Processo {tarefa["numero_processo"]} reservado para você até {reservado_ate:%H:%M}.')
+    return redirect('processo_executar', pk=tarefa['id'])
+
+
+@login_required
+@require_POST
+def tarefa_reserva(request, pk):
+    """Renova (``acao=renovar``) ou devolve à fila (``acao=liberar``) a reserva do usuário"""
+    if request.POST.get('acao') == 'renovar':
+        if fila.renovar(pk, request.user):
+            messages.success(request, 'Reserva renovada.')
+        else:
+            messages.warning(request, 'A reserva expirou ou é de outra pessoa.')
+        return redirect('processo_executar', pk=pk)
+    if fila.liberar(pk, request.user):
+        messages.info(request, 'Processo devolvido à fila.')
+    return redirect('meus_processos')
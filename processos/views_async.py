@@ -0,0 +1,185 @@
+"""
+Versões assíncronas das views de leitura (dashboard, meus processos, lista e
+detalhe de processos) e o SSE de eventos, usadas quando ``SERVIDOR_ASGI`` está ligado.
+
+Enquanto o Postgres responde o worker ASGI continua atendendo outras
+requisições. Consultas independentes rodam ao mesmo tempo com ``em_paralelo``.
+O render acontece fora do event loop porque o template ainda pode tocar na
+sessão (mensagens) e em relações não carregadas.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.core.paginator import EmptyPage, Paginator
+from django.db.models import Q
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import render
+
+from processos.services import pode_ver_processo
+from workflow.condicional import get_condicional
+from workflow.routers import leitura_replica
+from . import fila
+from .consultas import em_paralelo, limitar_consultas
+from .forms import ExecucaoLoteForm, ProcessoFiltroForm
+from .models import TemplateProcesso, ProcessoInstancia, EtapaExecutada, LogAuditoria
+from .notificacoes import stream_eventos
+from .views import (
+    MAX_CONSULTAS_DETALHE, ProcessoListView, filtrar_processos,
+    validadores_processo_detail, validadores_processo_list,
+)
+
+renderizar = sync_to_async(render)
+
+
+def login_obrigatorio(view):
+    """``login_required`` para views assíncronas (o usuário é carregado fora do event loop)"""
+    @functools.wraps(view)
+    async def _view(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return _view
+
+
+# ==================== DASHBOARD ====================
+
+@login_obrigatorio
+@leitura_replica
+async def dashboard(request):
+    """Dashboard principal do sistema"""
+    usuario = request.user
+    processos_meus = ProcessoInstancia.objects.filter(usuario_atual=usuario)
+    processos_criados = ProcessoInstancia.objects.filter(criado_por=usuario)
+
+    aguardando, concluidos, recentes, templates, logs = await em_paralelo(
+        processos_meus.filter(status='EM_ANDAMENTO').count,
+        processos_criados.filter(status='CONCLUIDO').count,
+        lambda: list(processos_meus.select_related('etapa_atual').order_by('-data_atualizacao')[:5]),
+        lambda: list(TemplateProcesso.objects.filter(ativo=True)),
+        lambda: list(
+            LogAuditoria.objects.filter(
+                Q(processo__usuario_atual=usuario) | Q(processo__criado_por=usuario)
+            ).distinct().select_related('usuario').order_by('-data_hora')[:10]
+        ),
+    )
+
+    return await renderizar(request, 'processos/dashboard.html', {
+        'processos_aguardando': aguardando,
+        'processos_concluidos': concluidos,
+        'processos_recentes': recentes,
+        'templates_disponiveis': templates,
+        'logs_recentes': logs,
+    })
+
+
+@login_obrigatorio
+@leitura_replica
+async def meus_processos(request):
+    """Lista processos do usuário atual e a fila das etapas dele"""
+    usuario = request.user
+    processos, fila_etapas = await em_paralelo(
+        lambda: list(
+            ProcessoInstancia.objects.filter(
+                usuario_atual=usuario,
+                status='EM_ANDAMENTO'
+            ).select_related('template', 'etapa_atual').order_by('-data_atualizacao')
+        ),
+        lambda: fila.resumo(fila.etapas_do_usuario(usuario)),
+    )
+
+    return await renderizar(request, 'processos/meus_processos.html', {
+        'processos': processos,
+        'fila': fila_etapas,
+        'eventos_ativos': settings.SERVIDOR_ASGI,
+    })
+
+
+@login_obrigatorio
+async def eventos_processos(request):
+    """Server-Sent Events com os processos atribuídos, avançados e concluídos do usuário"""
+    return StreamingHttpResponse(
+        stream_eventos(request.user.pk),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+# ==================== PROCESSOS ====================
+
+@login_obrigatorio
+@leitura_replica
+@get_condicional(validadores_processo_list)
+async def processo_list(request):
+    """Lista processos com filtros (contagem e página consultadas em paralelo)"""
+    por_pagina = ProcessoListView.paginate_by
+    try:
+        numero = int(request.GET.get('page') or 1)
+    except ValueError:
+        raise Http404('Página inválida')
+    if numero < 1:
+        raise Http404('Página inválida')
+
+    queryset = await sync_to_async(filtrar_processos)(request.user, request.GET)
+    # O form lê a lista de templates do cache (e do banco, se ela faltar)
+    filtro_form = await sync_to_async(ProcessoFiltroForm)(request.GET)
+    inicio = (numero - 1) * por_pagina
+    total, processos = await em_paralelo(
+        queryset.count,
+        lambda: list(queryset[inicio:inicio + por_pagina]),
+    )
+
+    paginator = Paginator(queryset, por_pagina)
+    paginator.count = total
+    try:
+        page_obj = paginator.page(numero)
+    except EmptyPage:
+        raise Http404('Página inválida')
+    page_obj.object_list = processos
+
+    return await renderizar(request, ProcessoListView.template_name, {
+        'processos': processos,
+        'object_list': processos,
+        'paginator': paginator,
+        'page_obj': page_obj,
+        'is_paginated': paginator.num_pages > 1,
+        'filtro_form': filtro_form,
+        'execucao_lote_form': ExecucaoLoteForm(),
+    })
+
+
+@login_obrigatorio
+@limitar_consultas(MAX_CONSULTAS_DETALHE)
+@get_condicional(validadores_processo_detail)
+async def processo_detail(request, pk):
+    """Detalhes de um processo: processo, histórico, logs e permissão buscados em paralelo"""
+    usuario = request.user
+    try:
+        processo, historico, logs, pode_ver = await em_paralelo(
+            lambda: ProcessoInstancia.objects.select_related(
+                'template', 'etapa_atual', 'usuario_atual', 'criado_por'
+            ).get(pk=pk),
+            lambda: list(
+                EtapaExecutada.objects.filter(processo_id=pk).select_related('etapa', 'executado_por')
+                .prefetch_related('documentos').order_by('-data_inicio')
+            ),
+            lambda: list(LogAuditoria.objects.filter(processo_id=pk).select_related('usuario').order_by('-data_hora')[:20]),
+            lambda: pode_ver_processo(pk, usuario.pk),
+        )
+    except ProcessoInstancia.DoesNotExist:
+        raise Http404('Processo não encontrado')
+
+    if not pode_ver:
+        messages.error(request, 'Você não tem permissão para visualizar este processo.')
+
+    pode_executar = await sync_to_async(processo.pode_ser_executado_por)(usuario)
+
+    return await renderizar(request, 'processos/processo_detail.html', {
+        'processo': processo,
+        'object': processo,
+        'etapas_executadas': historico,
+        'logs': logs,
+        'pode_executar': pode_executar,
+    })
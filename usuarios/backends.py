@@ -0,0 +1,22 @@
+from django.contrib.auth.backends import ModelBackend
+
+
+class UsuarioCacheBackend(ModelBackend):
+    """
+    ``ModelBackend`` que carrega o usuário de cada requisição do cache
+    versionado (processos/cache.py) em vez de consultar ``usuarios_usuario``.
+
+    O cache é invalidado quando o usuário ou as etapas permitidas mudam
+    (sinais e barramento de invalidação), então perfil, ``is_active`` e senha
+    nova valem na requisição seguinte.
+    """
+
+    def get_user(self, user_id):
+        from processos.cache import usuario_autenticado
+
+        try:
+            usuario_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        usuario = usuario_autenticado(usuario_id)
+        return usuario if self.user_can_authenticate(usuario) else None
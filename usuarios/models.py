@@ -41,8 +41,13 @@ class Usuario(AbstractUser):
         if self.perfil == 'ADMIN':
             return True
         
+        # Usuário da sessão já traz as etapas permitidas (usuarios/backends.py)
+        etapas_permitidas_ids = getattr(self, 'etapas_permitidas_ids', None)
+        if etapas_permitidas_ids is not None:
+            return etapa.pk in etapas_permitidas_ids
+
         # Verifica se o usuário está na lista de usuários permitidos da etapa
-        return self in etapa.usuarios_permitidos.all()
+        return etapa.usuarios_permitidos.filter(pk=self.pk).exists()
     
     def pode_visualizar_processo(self, processo: 'ProcessoInstancia') -> bool:
         """
@@ -0,0 +1,65 @@
+"""
+Backend PostgreSQL do Django instrumentado com métricas de conexão.
+
+Com CONN_MAX_AGE cada thread do worker mantém uma conexão persistente
+(validada por CONN_HEALTH_CHECKS antes de ser reutilizada). As métricas
+mostram quanto tempo as requisições esperam para abrir conexões e quantas
+estão abertas em relação ao limite por worker.
+
+``execute_wrapper_contexto`` é o equivalente de ``connection.execute_wrapper``
+para código assíncrono: o wrapper fica num ContextVar e vale para qualquer
+conexão usada no mesmo contexto, inclusive nas threads do ``sync_to_async``
+(cada thread tem a sua própria conexão).
+"""
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.backends.postgresql import base
+
+from workflow import metricas
+
+_wrappers_contexto: ContextVar[tuple] = ContextVar('execute_wrappers_contexto', default=())
+
+
+@contextmanager
+def execute_wrapper_contexto(wrapper):
+    """Instala ``wrapper`` em todas as conexões usadas dentro do bloco (e das tarefas/threads filhas)"""
+    token = _wrappers_contexto.set(_wrappers_contexto.get() + (wrapper,))
+    try:
+        yield
+    finally:
+        _wrappers_contexto.reset(token)
+
+
+def _executar_wrappers_contexto(execute, sql, params, many, context):
+    # Mesma composição do Django: o primeiro wrapper instalado é o mais externo
+    for wrapper in reversed(_wrappers_contexto.get()):
+        execute = functools.partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.execute_wrappers.append(_executar_wrappers_contexto)
+
+    def get_new_connection(self, conn_params):
+        inicio = time.perf_counter()
+        conexao = super().get_new_connection(conn_params)
+        metricas.DB_CONEXAO_ABERTURA_SEGUNDOS.labels(self.alias).observe(time.perf_counter() - inicio)
+        metricas.DB_CONEXOES_ABERTAS.labels(self.alias).inc()
+        return conexao
+
+    def _close(self):
+        if self.connection is not None:
+            metricas.DB_CONEXOES_ABERTAS.labels(self.alias).dec()
+        return super()._close()
+
+    def is_usable(self):
+        utilizavel = super().is_usable()
+        if not utilizavel:
+            metricas.DB_CONEXOES_DESCARTADAS.labels(self.alias).inc()
+        return utilizavel
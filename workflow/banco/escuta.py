@@ -0,0 +1,95 @@
+"""
+Base das threads que escutam canais do Postgres com LISTEN/NOTIFY.
+
+Cada ouvinte abre a sua própria conexão em autocommit (fora do ORM), reconecta
+quando ela cai e entrega os payloads para ``ao_notificar``. Usado pelas
+notificações SSE (processos/notificacoes.py) e pelo barramento de invalidação
+de cache (workflow/invalidacao.py).
+"""
+import logging
+import select
+import threading
+
+import psycopg2
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+ESPERA_RECONEXAO_SEGUNDOS = 2.0
+
+
+class OuvintePostgres:
+    """Thread com uma conexão em LISTEN num canal do Postgres"""
+
+    nome_thread = 'ouvinte-postgres'
+    # Sem mensagens, ``ao_ocioso`` roda a cada intervalo (e o pedido de parada é checado)
+    intervalo_ocioso = 1.0
+
+    def __init__(self, canal: str, using=DEFAULT_DB_ALIAS):
+        self.canal = canal
+        self.using = using
+        self._lock_thread = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        # Ligado enquanto a conexão está em LISTEN
+        self.escutando = threading.Event()
+
+    def iniciar(self):
+        """Inicia a thread (se ainda não estiver rodando)"""
+        with self._lock_thread:
+            if self._thread is None or not self._thread.is_alive():
+                self._parar.clear()
+                self._thread = threading.Thread(target=self._executar, name=self.nome_thread, daemon=True)
+                self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def ao_conectar(self, conexao):
+        """Chamado a cada (re)conexão, já em LISTEN (pode consultar usando ``conexao``)"""
+
+    def ao_notificar(self, payload: str):
+        raise NotImplementedError
+
+    def ao_ocioso(self, conexao):
+        """Chamado a cada ``intervalo_ocioso`` segundos sem mensagens"""
+
+    def _conectar(self):
+        conexao = psycopg2.connect(**connections[self.using].get_connection_params())
+        conexao.autocommit = True
+        with conexao.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.canal}')
+        return conexao
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                conexao = self._conectar()
+            except psycopg2.Error as e:
+                logger.warning('%s sem conexão: %s', self.nome_thread, e)
+                self._parar.wait(ESPERA_RECONEXAO_SEGUNDOS)
+                continue
+            try:
+                self.ao_conectar(conexao)
+                self.escutando.set()
+                self._escutar(conexao)
+            except psycopg2.Error as e:
+                logger.warning('%s perdeu a conexão LISTEN, reconectando: %s', self.nome_thread, e)
+            finally:
+                self.escutando.clear()
+                conexao.close()
+
+    def _escutar(self, conexao):
+        while not self._parar.is_set():
+            if not select.select([conexao], [], [], self.intervalo_ocioso)[0]:
+                self.ao_ocioso(conexao)
+                continue
+            conexao.poll()
+            while conexao.notifies:
+                payload = conexao.notifies.pop(0).payload
+                try:
+                    self.ao_notificar(payload)
+                except Exception:
+                    logger.exception('%s falhou ao tratar %r', self.nome_thread, payload)
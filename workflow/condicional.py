@@ -0,0 +1,108 @@
+"""
+GET condicional (ETag / Last-Modified) para páginas HTML.
+
+A view declara uma função de validadores, bem mais barata que a página: ela
+devolve ``(ultima_modificacao, partes)`` a partir dos timestamps
+``data_atualizacao`` e das versões de ``cache_versao``. Se o navegador já tem
+essa versão, a resposta é um 304 sem consultar o resto nem renderizar.
+
+O ETag também leva o usuário (a página muda com o perfil e as permissões),
+a URL completa e a versão dos templates HTML e do manifesto de estáticos, para
+que um deploy nunca devolva 304 com HTML antigo.
+"""
+import functools
+import hashlib
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+@functools.cache
+def versao_html() -> str:
+    """Hash dos templates HTML e do manifesto de estáticos (calculado uma vez por processo)"""
+    digest = hashlib.sha256()
+    for pasta in settings.TEMPLATES[0]['DIRS']:
+        for caminho in sorted(Path(pasta).rglob('*.html')):
+            digest.update(str(caminho).encode())
+            digest.update(caminho.read_bytes())
+    manifesto = Path(settings.STATIC_ROOT) / 'staticfiles.json'
+    if manifesto.exists():
+        digest.update(manifesto.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def _etag(request, partes) -> str:
+    usuario = request.user
+    chave = repr((usuario.pk, usuario.data_atualizacao, request.get_full_path(), versao_html(), partes))
+    return f'W/"{hashlib.md5(chave.encode()).hexdigest()}"'
+
+
+def _avaliar(request, validadores, args, kwargs):
+    """``(etag, ultima_modificacao)`` ou ``None`` se a requisição não admite 304"""
+    if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+        return None
+    # Mensagens pendentes precisam aparecer na página, não num 304
+    if len(get_messages(request)):
+        return None
+    resultado = validadores(request, *args, **kwargs)
+    if resultado is None:
+        return None
+    ultima_modificacao, partes = resultado
+    return _etag(request, (ultima_modificacao, partes)), ultima_modificacao
+
+
+def _finalizar(request, resposta, avaliacao):
+    if avaliacao is None or resposta.status_code not in (200, 304):
+        return resposta
+    etag, ultima_modificacao = avaliacao
+    resposta.headers.setdefault('ETag', etag)
+    if ultima_modificacao and not resposta.has_header('Last-Modified'):
+        resposta.headers['Last-Modified'] = http_date(ultima_modificacao.timestamp())
+    # O navegador guarda a página, mas sempre revalida; proxies não guardam
+    patch_cache_control(resposta, private=True, no_cache=True)
+    return resposta
+
+
+def _resposta_304(request, avaliacao):
+    if avaliacao is None:
+        return None
+    etag, ultima_modificacao = avaliacao
+    return get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(ultima_modificacao.timestamp()) if ultima_modificacao else None,
+    )
+
+
+def get_condicional(validadores):
+    """
+    Decorator de views (síncronas ou assíncronas) que responde 304 quando os
+    ``validadores(request, *args, **kwargs)`` não mudaram.
+
+    ``validadores`` devolve ``(ultima_modificacao: datetime | None, partes)``
+    ou ``None`` para deixar a view responder normalmente (ex: 404).
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def _view_async(request, *args, **kwargs):
+                avaliacao = await sync_to_async(_avaliar)(request, validadores, args, kwargs)
+                resposta = _resposta_304(request, avaliacao)
+                if resposta is None:
+                    resposta = await view(request, *args, **kwargs)
+                return _finalizar(request, resposta, avaliacao)
+            return _view_async
+
+        @functools.wraps(view)
+        def _view(request, *args, **kwargs):
+            avaliacao = _avaliar(request, validadores, args, kwargs)
+            resposta = _resposta_304(request, avaliacao)
+            if resposta is None:
+                resposta = view(request, *args, **kwargs)
+            return _finalizar(request, resposta, avaliacao)
+        return _view
+    return decorator
@@ -0,0 +1,162 @@
+"""
+Chaves de idempotência para os POSTs que criam ou alteram dados.
+
+Proxies e usuários impacientes repetem o POST de criar processo, executar
+etapa e anexar documento. Com ``@idempotente``, a primeira requisição com uma
+chave (cabeçalho ``Idempotency-Key`` ou campo ``chave_idempotencia`` dos
+formulários) reserva a chave e guarda a resposta; as repetições recebem a
+mesma resposta (com ``Idempotent-Replayed: true``) sem executar a view de
+novo. Uma repetição que chega enquanto a primeira ainda roda recebe 409.
+
+As chaves ficam em ``idempotencia_chave`` (migração 0014 de processos): o
+digest de usuário + view + argumentos + chave é a chave primária, então
+reservar e consultar são uma busca pelo índice. Depois de
+``IDEMPOTENCIA_TTL_SEGUNDOS`` a chave expira e a limpeza periódica
+(workflow/limpeza.py) apaga as expiradas.
+"""
+import functools
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.utils.functional import SimpleLazyObject
+
+from workflow import metricas
+from workflow.limpeza import LimpezaPeriodica
+
+CABECALHO = 'Idempotency-Key'
+CAMPO = 'chave_idempotencia'
+# Respostas guardadas para as repetições
+CABECALHOS_GUARDADOS = ('Content-Type', 'Location')
+CORPO_MAXIMO = 64 * 1024
+# Chave do pg_try_advisory_lock da limpeza
+TRAVA_LIMPEZA = 7_310_002
+
+SQL_RESERVAR = """
+    INSERT INTO idempotencia_chave (chave) VALUES (%(chave)s)
+    ON CONFLICT (chave) DO UPDATE
+        SET criada_em = NOW(), status = NULL, cabecalhos = NULL, corpo = NULL
+        WHERE idempotencia_chave.criada_em < NOW() - make_interval(secs => %(ttl)s)
+           OR (idempotencia_chave.status IS NULL
+               AND idempotencia_chave.criada_em < NOW() - make_interval(secs => %(abandono)s))
+    RETURNING 1
+"""
+
+
+def chave_idempotencia(request):
+    """Context processor: uma chave nova por página, para o campo oculto dos formulários"""
+    return {'chave_idempotencia': SimpleLazyObject(lambda: uuid.uuid4().hex)}
+
+
+def _digest(request, nome_view: str, kwargs: dict, chave: str) -> bytes:
+    # A mesma chave em outro processo (ou por outro usuário) é outra chave
+    return hashlib.sha256(f'{request.user.pk}:{nome_view}:{sorted(kwargs.items())}:{chave}'.encode()).digest()[:16]
+
+
+def _reservar(digest: bytes):
+    """``None`` se a chave ficou com esta requisição; senão ``(status, cabecalhos, corpo)``"""
+    with connection.cursor() as cursor:
+        cursor.execute(SQL_RESERVAR, {
+            'chave': digest, 'ttl': settings.IDEMPOTENCIA_TTL_SEGUNDOS,
+            'abandono': settings.IDEMPOTENCIA_ABANDONO_SEGUNDOS,
+        })
+        if cursor.fetchone():
+            return None
+        cursor.execute('SELECT status, cabecalhos, corpo FROM idempotencia_chave WHERE chave = %s', [digest])
+        # Apagada entre os dois comandos: trata como em andamento
+        return cursor.fetchone() or (None, None, None)
+
+
+def _guardar(digest: bytes, resposta):
+    cabecalhos = {nome: resposta[nome] for nome in CABECALHOS_GUARDADOS if resposta.has_header(nome)}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE idempotencia_chave SET status = %s, cabecalhos = %s, corpo = %s WHERE chave = %s',
+            [resposta.status_code, json.dumps(cabecalhos), resposta.content, digest],
+        )
+
+
+def _liberar(digest: bytes):
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM idempotencia_chave WHERE chave = %s', [digest])
+
+
+def _repetir(status, cabecalhos, corpo) -> HttpResponse:
+    if status is None:
+        resposta = HttpResponse('Requisição com esta chave ainda em processamento.'.encode(), status=409)
+        resposta['Retry-After'] = '1'
+        return resposta
+    resposta = HttpResponse(bytes(corpo), status=status)
+    # O Django não decodifica jsonb em consultas cruas
+    for nome, valor in json.loads(cabecalhos).items():
+        resposta[nome] = valor
+    resposta['Idempotent-Replayed'] = 'true'
+    return resposta
+
+
+def idempotente(view):
+    """
+    Decorator de views POST: executa uma vez por chave de idempotência.
+    Sem chave, a view roda normalmente. Erros (exceção ou 5xx) liberam a chave
+    para que a repetição execute de novo.
+    """
+    nome_view = f'{view.__module__}.{view.__name__}'
+
+    @functools.wraps(view)
+    def _view(request, *args, **kwargs):
+        chave = None
+        if request.method == 'POST' and request.user.is_authenticated:
+            chave = request.headers.get(CABECALHO) or request.POST.get(CAMPO)
+        if not chave:
+            return view(request, *args, **kwargs)
+
+        digest = _digest(request, nome_view, kwargs, chave)
+        anterior = _reservar(digest)
+        if anterior is not None:
+            metricas.IDEMPOTENCIA.labels(view.__name__, 'repetida' if anterior[0] else 'em_andamento').inc()
+            return _repetir(*anterior)
+
+        try:
+            resposta = view(request, *args, **kwargs)
+        except BaseException:
+            _liberar(digest)
+            raise
+        if resposta.status_code >= 500 or resposta.streaming or len(resposta.content) > CORPO_MAXIMO:
+            _liberar(digest)
+        else:
+            _guardar(digest, resposta)
+        metricas.IDEMPOTENCIA.labels(view.__name__, 'nova').inc()
+        return resposta
+    return _view
+
+
+# ==================== LIMPEZA ====================
+
+def limpar_chaves_expiradas(lote: int = 1000) -> int:
+    """Apaga as chaves expiradas em lotes; retorna quantas foram apagadas"""
+    total = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                DELETE FROM idempotencia_chave WHERE chave IN (
+                    SELECT chave FROM idempotencia_chave
+                    WHERE criada_em < NOW() - make_interval(secs => %s)
+                    LIMIT %s
+                )
+                """,
+                [settings.IDEMPOTENCIA_TTL_SEGUNDOS, lote],
+            )
+            apagadas = cursor.rowcount
+        total += apagadas
+        if apagadas < lote:
+            return total
+
+
+limpeza = LimpezaPeriodica(
+    'idempotencia', TRAVA_LIMPEZA, limpar_chaves_expiradas,
+    intervalo='IDEMPOTENCIA_LIMPEZA_SEGUNDOS', lote='IDEMPOTENCIA_LIMPEZA_LOTE',
+)
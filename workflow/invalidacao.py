@@ -0,0 +1,186 @@
+"""
+Barramento de invalidação dos caches locais (em memória de cada worker).
+
+Qualquer escrita em templates, etapas (inclusive usuários permitidos),
+encaminhamentos e usuários dispara um trigger no Postgres (migração
+processos/0009) que incrementa a versão do grupo em ``cache_versao`` e publica
+``grupo:id:versao`` no canal ``cache_invalidacao``. Em cada worker:
+
+- o próprio processo que escreveu invalida pelos sinais do Django, na hora e
+  de novo no ``transaction.on_commit`` (uma leitura feita entre as duas, que
+  ainda vê o dado antigo, não fica no cache);
+- o ``OuvinteInvalidacao`` (iniciado no gunicorn.conf.py) recebe as mensagens
+  dos outros nós. Se a versão pular um número, alguma mensagem se perdeu e o
+  grupo inteiro é limpo; a cada ``INVALIDACAO_VERIFICACAO_SEGUNDOS`` (e ao
+  reconectar) as versões são comparadas com a tabela, então uma mensagem
+  perdida nunca deixa o cache velho por mais que esse intervalo.
+
+Os caches se registram com ``@ao_invalidar(grupo)`` ou usam ``CacheLocal``.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from . import metricas
+from .banco.escuta import OuvintePostgres
+
+logger = logging.getLogger(__name__)
+
+CANAL = 'cache_invalidacao'
+GRUPOS = ('template', 'etapa', 'encaminhamento', 'usuario')
+
+_manipuladores = defaultdict(list)
+
+
+def ao_invalidar(grupo: str):
+    """Registra ``funcao(ident)``, chamada quando um objeto do grupo muda (``ident=None``: o grupo inteiro)"""
+    if grupo not in GRUPOS:
+        raise ValueError(f'Grupo de invalidação desconhecido: {grupo}')
+
+    def decorator(funcao):
+        _manipuladores[grupo].append(funcao)
+        return funcao
+    return decorator
+
+
+def invalidar_local(grupo: str, ident: int | None = None):
+    """Limpa as entradas do grupo (ou só as do objeto ``ident``) nos caches deste processo"""
+    metricas.INVALIDACOES_CACHE.labels(grupo, 'grupo' if ident is None else 'objeto').inc()
+    for funcao in list(_manipuladores.get(grupo, ())):
+        try:
+            funcao(ident)
+        except Exception:
+            logger.exception('Falha ao invalidar %s:%s em %r', grupo, ident, funcao)
+
+
+class CacheLocal:
+    """
+    Cache em memória do processo, por id de objeto, limpo pelo barramento.
+
+    Cada invalidação incrementa a geração do cache: um valor calculado enquanto
+    uma invalidação chegava não é guardado, para não gravar dado velho.
+    """
+
+    def __init__(self, grupo: str):
+        self.grupo = grupo
+        self._dados = {}
+        self._geracao = 0
+        self._lock = threading.Lock()
+        ao_invalidar(grupo)(self.invalidar)
+
+    def obter(self, ident, calcular):
+        try:
+            return self._dados[ident]
+        except KeyError:
+            pass
+        geracao = self._geracao
+        valor = calcular()
+        with self._lock:
+            if geracao == self._geracao:
+                self._dados[ident] = valor
+        return valor
+
+    def invalidar(self, ident=None):
+        with self._lock:
+            self._geracao += 1
+            if ident is None:
+                self._dados.clear()
+            else:
+                self._dados.pop(ident, None)
+
+
+class OuvinteInvalidacao(OuvintePostgres):
+    """Recebe as invalidações dos outros nós e mantém as versões conhecidas de cada grupo"""
+
+    nome_thread = 'ouvinte-invalidacao'
+
+    def __init__(self):
+        super().__init__(CANAL)
+        self.versoes = {}
+        self._ultima_verificacao = 0.0
+
+    def ao_conectar(self, conexao):
+        # Mensagens emitidas enquanto estava desconectado se perderam
+        self.sincronizar(conexao)
+
+    def ao_ocioso(self, conexao):
+        if time.monotonic() - self._ultima_verificacao >= settings.INVALIDACAO_VERIFICACAO_SEGUNDOS:
+            self.sincronizar(conexao)
+
+    def sincronizar(self, conexao):
+        """Limpa os grupos cuja versão no banco é diferente da última recebida"""
+        with conexao.cursor() as cursor:
+            cursor.execute('SELECT grupo, versao FROM cache_versao')
+            atuais = dict(cursor.fetchall())
+        for grupo, versao in atuais.items():
+            if self.versoes.get(grupo) != versao:
+                invalidar_local(grupo)
+        self.versoes.update(atuais)
+        self._ultima_verificacao = time.monotonic()
+
+    def ao_notificar(self, payload: str):
+        grupo, ident, versao = payload.rsplit(':', 2)
+        versao = int(versao)
+        conhecida = self.versoes.get(grupo, 0)
+        if versao <= conhecida:
+            return
+        if versao > conhecida + 1:
+            # Versão pulada: uma mensagem se perdeu, não dá para saber qual objeto mudou
+            invalidar_local(grupo)
+        else:
+            invalidar_local(grupo, int(ident) if ident else None)
+        self.versoes[grupo] = versao
+
+
+ouvinte = OuvinteInvalidacao()
+
+
+# ==================== SINAIS (INVALIDAÇÃO NO PRÓPRIO PROCESSO) ====================
+
+def invalidar(grupo: str, ident: int | None = None):
+    """Invalida neste processo agora e de novo no commit (também para escritas via SQL, sem sinais)"""
+    invalidar_local(grupo, ident)
+    transaction.on_commit(lambda: invalidar_local(grupo, ident))
+
+
+def conectar_sinais():
+    """Liga os sinais dos modelos ao barramento (chamado no ready() do app processos)"""
+    from processos.models import Encaminhamento, Etapa, TemplateProcesso
+    from usuarios.models import Usuario
+
+    for modelo, grupo in (
+        (TemplateProcesso, 'template'),
+        (Etapa, 'etapa'),
+        (Encaminhamento, 'encaminhamento'),
+        (Usuario, 'usuario'),
+    ):
+        def _ao_salvar(sender, instance, grupo=grupo, update_fields=None, **kwargs):
+            # O login só grava last_login, que nenhum cache usa (a trigger também ignora)
+            if update_fields is not None and set(update_fields) == {'last_login'}:
+                return
+            invalidar(grupo, instance.pk)
+
+        post_save.connect(_ao_salvar, sender=modelo, weak=False, dispatch_uid=f'invalidacao_save_{grupo}')
+        post_delete.connect(_ao_salvar, sender=modelo, weak=False, dispatch_uid=f'invalidacao_delete_{grupo}')
+
+    def _ao_mudar_permitidos(sender, instance, action, reverse, pk_set, **kwargs):
+        if not action.startswith('post_'):
+            return
+        if not reverse:
+            invalidar('etapa', instance.pk)
+        elif pk_set:
+            for etapa_id in pk_set:
+                invalidar('etapa', etapa_id)
+        else:
+            # clear() a partir do usuário: não sabemos quais etapas
+            invalidar('etapa', None)
+
+    m2m_changed.connect(
+        _ao_mudar_permitidos, sender=Etapa.usuarios_permitidos.through,
+        weak=False, dispatch_uid='invalidacao_etapa_permitidos',
+    )
@@ -0,0 +1,74 @@
+"""
+Limpeza periódica de tabelas que acumulam linhas expiradas.
+
+Uma thread por worker (iniciada no gunicorn.conf.py) acorda a cada
+``intervalo`` segundos; um advisory lock (``trava``, uma chave por tabela)
+garante que só um worker do cluster limpa por vez. ``limpar(lote)`` apaga em
+lotes e retorna quantas linhas apagou. Usada pelas sessões
+(workflow/sessoes.py) e pelas chaves de idempotência (workflow/idempotencia.py).
+"""
+import logging
+import threading
+from typing import Callable
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class LimpezaPeriodica:
+    """
+    Thread que roda ``limpar`` de tempos em tempos. ``intervalo`` e ``lote`` são
+    nomes de settings (lidos a cada execução; intervalo 0 desliga) e
+    ``habilitada``, se informada, decide no ``iniciar`` se a limpeza se aplica.
+    """
+
+    def __init__(
+        self, nome: str, trava: int, limpar: Callable[[int], int], intervalo: str, lote: str,
+        habilitada: Callable[[], bool] | None = None,
+    ):
+        self.nome = nome
+        self.trava = trava
+        self.limpar = limpar
+        self.intervalo = intervalo
+        self.lote = lote
+        self.habilitada = habilitada
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        if not getattr(settings, self.intervalo) or (self.habilitada and not self.habilitada()):
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._executar, name=f'limpeza-{self.nome}', daemon=True)
+            self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+
+    def executar_uma_vez(self) -> int | None:
+        """Limpa se nenhum outro worker estiver limpando; ``None`` se não pegou a trava"""
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_lock(%s)', [self.trava])
+                if not cursor.fetchone()[0]:
+                    return None
+                try:
+                    apagadas = self.limpar(getattr(settings, self.lote))
+                finally:
+                    cursor.execute('SELECT pg_advisory_unlock(%s)', [self.trava])
+        finally:
+            # Não deixa uma conexão parada entre as execuções
+            connection.close()
+        if apagadas:
+            logger.info('Limpeza de %s: %s linha(s) expirada(s) apagada(s)', self.nome, apagadas)
+        return apagadas
+
+    def _executar(self):
+        while not self._parar.wait(getattr(settings, self.intervalo)):
+            try:
+                self.executar_uma_vez()
+            except Exception:
+                logger.exception('Falha na limpeza de %s', self.nome)
@@ -0,0 +1,64 @@
+"""
+Marcação das consultas SQL com a origem (view ou serviço) e o id da requisição.
+
+O comentário prefixado em cada consulta (``/* origem='processo_detail',
+request_id='...' */``) aparece no ``pg_stat_statements`` e nos logs do Postgres,
+e é usado pelo comando ``relatorio_sql`` para atribuir cada consulta à sua origem.
+"""
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_origem: ContextVar[str | None] = ContextVar('sql_origem', default=None)
+_request_id: ContextVar[str | None] = ContextVar('sql_request_id', default=None)
+
+
+def _limpar(valor: str) -> str:
+    # Impede que o valor feche o comentário, quebre as aspas ou vire placeholder
+    return valor.replace('*/', '').replace("'", '').replace('%', '')
+
+
+def comentario_atual() -> str:
+    """Retorna o comentário SQL da origem atual (ou vazio)"""
+    origem = _origem.get()
+    if not origem:
+        return ''
+    partes = [f"origem='{_limpar(origem)}'"]
+    request_id = _request_id.get()
+    if request_id:
+        partes.append(f"request_id='{_limpar(request_id)}'")
+    return f"/* {','.join(partes)} */ "
+
+
+def marcar_sql(execute, sql, params, many, context):
+    """execute_wrapper que prefixa a consulta com o comentário de origem"""
+    return execute(comentario_atual() + sql, params, many, context)
+
+
+def definir_origem(origem: str):
+    """Troca a origem do contexto atual (usado pelo middleware após resolver a URL)"""
+    _origem.set(origem)
+
+
+@contextmanager
+def origem_sql(origem: str, request_id: str | None = None):
+    """Define a origem das consultas executadas dentro do bloco"""
+    token_origem = _origem.set(origem)
+    token_request = _request_id.set(request_id) if request_id is not None else None
+    try:
+        yield
+    finally:
+        _origem.reset(token_origem)
+        if token_request is not None:
+            _request_id.reset(token_request)
+
+
+def marcar_origem(origem: str):
+    """Decorator para funções de serviço: ``@marcar_origem('servico.encaminhar_processo')``"""
+    def decorator(func):
+        @functools.wraps(func)
+        def _func(*args, **kwargs):
+            with origem_sql(origem):
+                return func(*args, **kwargs)
+        return _func
+    return decorator
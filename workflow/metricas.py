@@ -0,0 +1,179 @@
+"""
+Métricas Prometheus da aplicação web.
+
+Com vários workers do gunicorn as métricas são agregadas pelo modo
+multiprocesso do prometheus_client (diretório PROMETHEUS_MULTIPROC_DIR,
+configurado e esvaziado no entrypoint.sh antes de subir o gunicorn; o
+gunicorn.conf.py descarta as métricas "live" de cada worker que sai).
+"""
+import os
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess,
+)
+
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# ==================== HTTP / BANCO / TEMPLATES ====================
+
+REQUISICAO_SEGUNDOS = Histogram(
+    'workflow_http_requisicao_segundos',
+    'Latência das requisições por nome de URL',
+    ['view', 'metodo'],
+)
+REQUISICOES_TOTAL = Counter(
+    'workflow_http_requisicoes_total',
+    'Requisições atendidas por nome de URL e status',
+    ['view', 'metodo', 'status'],
+)
+REQUISICOES_EM_ANDAMENTO = Gauge(
+    'workflow_http_requisicoes_em_andamento',
+    'Requisições sendo processadas no momento',
+    multiprocess_mode='livesum',
+)
+CONSULTAS_POR_REQUISICAO = Histogram(
+    'workflow_db_consultas_por_requisicao',
+    'Número de consultas SQL por requisição',
+    ['view'],
+    buckets=BUCKETS_CONSULTAS,
+)
+TEMPO_DB_POR_REQUISICAO = Histogram(
+    'workflow_db_tempo_por_requisicao_segundos',
+    'Tempo gasto no banco por requisição',
+    ['view'],
+)
+DB_CONEXAO_ABERTURA_SEGUNDOS = Histogram(
+    'workflow_db_conexao_abertura_segundos',
+    'Tempo de espera para abrir uma nova conexão com o banco',
+    ['banco'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DB_CONEXOES_ABERTAS = Gauge(
+    'workflow_db_conexoes_abertas',
+    'Conexões persistentes abertas (somadas entre os workers)',
+    ['banco'],
+    multiprocess_mode='livesum',
+)
+DB_CONEXOES_LIMITE = Gauge(
+    'workflow_db_conexoes_limite',
+    'Conexões permitidas (DB_CONEXOES_POR_WORKER somado entre os workers)',
+    multiprocess_mode='livesum',
+)
+DB_CONEXOES_DESCARTADAS = Counter(
+    'workflow_db_conexoes_descartadas_total',
+    'Conexões persistentes descartadas pela checagem de saúde',
+    ['banco'],
+)
+SSE_ASSINANTES = Gauge(
+    'workflow_sse_assinantes',
+    'Streams SSE de "Meus Processos" abertos',
+    multiprocess_mode='livesum',
+)
+INVALIDACOES_CACHE = Counter(
+    'workflow_cache_invalidacoes_total',
+    'Invalidações de cache local recebidas (objeto ou grupo inteiro)',
+    ['grupo', 'abrangencia'],
+)
+CACHE_CONSULTAS = Counter(
+    'workflow_cache_consultas_total',
+    'Leituras do cache versionado de templates e etapas',
+    ['entrada', 'resultado'],
+)
+RENDER_TEMPLATE_SEGUNDOS = Histogram(
+    'workflow_template_render_segundos',
+    'Tempo de renderização de templates',
+    ['template'],
+)
+
+# ==================== NEGÓCIO ====================
+
+PROCESSOS_CRIADOS = Counter(
+    'workflow_processos_criados_total',
+    'Processos criados',
+)
+ETAPAS_EXECUTADAS = Counter(
+    'workflow_etapas_executadas_total',
+    'Etapas executadas por resultado',
+    ['resultado'],
+)
+ENCAMINHAMENTOS = Counter(
+    'workflow_encaminhamentos_total',
+    'Processos encaminhados',
+)
+TRANSICOES = Counter(
+    'workflow_transicoes_total',
+    'Transições de etapa percorridas (destino "fim": processo concluído)',
+    ['template', 'origem', 'destino', 'condicao'],
+)
+CONFLITOS_VERSAO = Counter(
+    'workflow_conflitos_versao_total',
+    'Escritas recusadas porque o processo mudou desde a leitura (versao)',
+    ['operacao'],
+)
+IDEMPOTENCIA = Counter(
+    'workflow_idempotencia_total',
+    'POSTs com chave de idempotência por desfecho (nova, repetida, em_andamento)',
+    ['view', 'desfecho'],
+)
+DOCUMENTOS_ENVIADOS = Counter(
+    'workflow_documentos_enviados_total',
+    'Documentos anexados',
+)
+
+
+DB_CONEXOES_LIMITE.set(settings.DB_CONEXOES_POR_WORKER)
+
+# Coletores que leem o banco a cada scrape (valores do cluster, não de um worker)
+COLETORES_BANCO = []
+
+
+def registrar_coletor_banco(coletor):
+    COLETORES_BANCO.append(coletor)
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        REGISTRY.register(coletor)
+
+
+class TemplateInstrumentado:
+    """Envolve um template do Django medindo o tempo de render"""
+
+    def __init__(self, template):
+        self.template = template
+        self.origin = template.origin
+
+    def render(self, context=None, request=None):
+        inicio = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            RENDER_TEMPLATE_SEGUNDOS.labels(self.origin.template_name or '<string>').observe(time.perf_counter() - inicio)
+
+
+class DjangoTemplatesInstrumentado(DjangoTemplates):
+    """Backend de templates do Django com métrica de tempo de render"""
+
+    def from_string(self, template_code):
+        return TemplateInstrumentado(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TemplateInstrumentado(super().get_template(template_name))
+
+
+def metrics_view(request):
+    """Expõe as métricas no formato texto do Prometheus"""
+    token = settings.METRICAS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for coletor in COLETORES_BANCO:
+            registry.register(coletor)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,135 @@
+"""
+Middlewares do projeto.
+
+Todos funcionam em modo síncrono (WSGI) e assíncrono (ASGI), para que a
+cadeia inteira rode no event loop quando a view for assíncrona.
+"""
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+from . import metricas
+from .banco.base import execute_wrapper_contexto
+from .marcacao_sql import definir_origem, marcar_sql, origem_sql
+
+_RE_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class MiddlewareSyncAsync:
+    """
+    Base de middlewares que envolvem a requisição num context manager.
+
+    As subclasses implementam ``envolver(request)`` (gerador que faz ``yield``
+    enquanto a view executa) e, se precisarem, ``processar_resposta``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.envolver(request) as estado:
+            estado['response'] = self.get_response(request)
+        return self.processar_resposta(request, estado['response'])
+
+    async def __acall__(self, request):
+        with self.envolver(request) as estado:
+            estado['response'] = await self.get_response(request)
+        return self.processar_resposta(request, estado['response'])
+
+    @contextmanager
+    def envolver(self, request):
+        yield {}
+
+    def processar_resposta(self, request, response):
+        return response
+
+
+class _MedidorBanco:
+    """Conta e cronometra as consultas SQL de uma requisição"""
+
+    def __init__(self):
+        self.consultas = 0
+        self.segundos = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas += 1
+            self.segundos += time.perf_counter() - inicio
+
+
+class MetricasMiddleware(MiddlewareSyncAsync):
+    """Registra latência, requisições em andamento e uso do banco por nome de URL"""
+
+    @contextmanager
+    def envolver(self, request):
+        medidor = _MedidorBanco()
+        inicio = time.perf_counter()
+        metricas.REQUISICOES_EM_ANDAMENTO.inc()
+        estado = {}
+        try:
+            with execute_wrapper_contexto(medidor):
+                yield estado
+        finally:
+            metricas.REQUISICOES_EM_ANDAMENTO.dec()
+            status = estado['response'].status_code if 'response' in estado else 500
+            match = getattr(request, 'resolver_match', None)
+            view = (match.view_name if match else None) or '<nao_resolvida>'
+            if view != 'metrics':
+                metricas.REQUISICAO_SEGUNDOS.labels(view, request.method).observe(time.perf_counter() - inicio)
+                metricas.REQUISICOES_TOTAL.labels(view, request.method, status).inc()
+                metricas.CONSULTAS_POR_REQUISICAO.labels(view).observe(medidor.consultas)
+                metricas.TEMPO_DB_POR_REQUISICAO.labels(view).observe(medidor.segundos)
+
+
+class MarcacaoSQLMiddleware(MiddlewareSyncAsync):
+    """Marca as consultas SQL com o nome da view e o id da requisição"""
+
+    @contextmanager
+    def envolver(self, request):
+        request_id = request.headers.get('X-Request-ID', '')
+        if not _RE_REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+
+        # Até a URL ser resolvida as consultas são dos middlewares (sessão, usuário)
+        with origem_sql('middleware', request_id), execute_wrapper_contexto(marcar_sql):
+            yield {}
+
+    def processar_resposta(self, request, response):
+        response['X-Request-ID'] = request.request_id
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        definir_origem(f'view.{match.view_name}' if match and match.view_name else 'view.<anonima>')
+
+
+class CompressaoHTMLMiddleware(GZipMiddleware):
+    """
+    Gzip só das páginas HTML acima de ``COMPRESSAO_HTML_MINIMO_BYTES``.
+
+    Respostas em streaming são comprimidas pedaço a pedaço. Estáticos já vêm
+    comprimidos do WhiteNoise e o SSE (text/event-stream) não pode ficar
+    retido no buffer do gzip, então ficam de fora.
+    """
+
+    def process_response(self, request, response):
+        if not response.get('Content-Type', '').startswith('text/html'):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSAO_HTML_MINIMO_BYTES:
+            return response
+        return super().process_response(request, response)
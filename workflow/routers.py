@@ -0,0 +1,162 @@
+"""
+Roteamento de leituras para a réplica do PostgreSQL.
+
+Só vão para a réplica as leituras feitas dentro de views marcadas com
+``@leitura_replica`` (listas, relatórios e dashboard). Depois de um POST o
+navegador fica fixado no primário por ``REPLICA_FIXACAO_SEGUNDOS`` (cookie),
+garantindo que o usuário leia o que acabou de gravar. Se a réplica estiver
+atrasada mais que ``REPLICA_ATRASO_MAXIMO`` ou fora do ar, as leituras voltam
+para o primário.
+"""
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError
+
+from .middleware import MiddlewareSyncAsync
+
+logger = logging.getLogger(__name__)
+
+REPLICA = 'replica'
+COOKIE_FIXACAO = 'fixar_primario'
+APPS_REPLICADAS = {'processos', 'usuarios'}
+
+SQL_ATRASO = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+_leitura_replica: ContextVar[bool] = ContextVar('leitura_replica', default=False)
+_fixado_primario: ContextVar[bool] = ContextVar('fixado_primario', default=False)
+
+# Estado da réplica por processo: (verificado_em, saudavel)
+_estado_replica = {'verificado_em': 0.0, 'saudavel': False}
+
+
+def replica_configurada() -> bool:
+    return REPLICA in settings.DATABASES
+
+
+def atraso_replica() -> float:
+    """Atraso de replicação em segundos (consulta na própria réplica)"""
+    with connections[REPLICA].cursor() as cursor:
+        cursor.execute(SQL_ATRASO)
+        return float(cursor.fetchone()[0])
+
+
+def replica_saudavel() -> bool:
+    """Verifica (com cache curto) se a réplica está no ar e dentro do atraso aceito"""
+    agora = time.monotonic()
+    if agora - _estado_replica['verificado_em'] < settings.REPLICA_VERIFICACAO_SEGUNDOS:
+        return _estado_replica['saudavel']
+
+    try:
+        atraso = atraso_replica()
+        saudavel = atraso <= settings.REPLICA_ATRASO_MAXIMO
+        if not saudavel:
+            logger.warning('Réplica atrasada %.1fs; leituras voltam para o primário', atraso)
+    except DatabaseError as e:
+        logger.warning('Réplica indisponível, usando o primário: %s', e)
+        saudavel = False
+
+    _estado_replica.update(verificado_em=agora, saudavel=saudavel)
+    return saudavel
+
+
+def alias_leitura() -> str:
+    """Alias para leituras em SQL puro (ex: views vw_*) respeitando as mesmas regras do router"""
+    if (
+        replica_configurada()
+        and _leitura_replica.get()
+        and not _fixado_primario.get()
+        and replica_saudavel()
+    ):
+        return REPLICA
+    return DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """Envia as leituras permitidas para a réplica e todas as escritas para o primário"""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in APPS_REPLICADAS:
+            return None
+        return alias_leitura()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplica e primário têm os mesmos dados
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def leitura_replica(view):
+    """Decorator de views somente leitura (síncronas ou assíncronas) que podem consultar a réplica"""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def _view_async(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+
+            # O ContextVar é copiado para as threads do sync_to_async onde o ORM executa
+            token = _leitura_replica.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _leitura_replica.reset(token)
+        return _view_async
+
+    @functools.wraps(view)
+    def _view(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+
+        token = _leitura_replica.set(True)
+        try:
+            response = view(request, *args, **kwargs)
+            # TemplateResponse das CBVs avalia as querysets no render
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            return response
+        finally:
+            _leitura_replica.reset(token)
+    return _view
+
+
+class ReplicaMiddleware(MiddlewareSyncAsync):
+    """Fixa o navegador no primário por alguns segundos depois de uma escrita"""
+
+    @contextmanager
+    def envolver(self, request):
+        try:
+            fixado = float(request.COOKIES.get(COOKIE_FIXACAO, 0)) > time.time()
+        except ValueError:
+            fixado = False
+
+        token = _fixado_primario.set(fixado)
+        try:
+            yield {}
+        finally:
+            _fixado_primario.reset(token)
+
+    def processar_resposta(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') and replica_configurada():
+            segundos = settings.REPLICA_FIXACAO_SEGUNDOS
+            response.set_cookie(
+                COOKIE_FIXACAO, str(time.time() + segundos),
+                max_age=segundos, httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,39 @@
+"""
+Limpeza periódica das sessões expiradas da tabela ``django_session``.
+
+Roda a cada ``SESSOES_LIMPEZA_SEGUNDOS`` num worker do cluster por vez
+(workflow/limpeza.py). As linhas são apagadas em lotes para não segurar locks
+longos numa tabela que toda requisição autenticada pode ler.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+from workflow.limpeza import LimpezaPeriodica
+
+# Chave do pg_try_advisory_lock da limpeza
+TRAVA_LIMPEZA = 7_310_001
+
+ARMAZENAMENTOS_NO_BANCO = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+def limpar_sessoes_expiradas(lote: int = 1000) -> int:
+    """Apaga as sessões expiradas em lotes; retorna quantas foram apagadas"""
+    from django.contrib.sessions.models import Session
+
+    total = 0
+    while True:
+        chaves = Session.objects.filter(expire_date__lt=timezone.now()).values('pk')[:lote]
+        apagadas, _ = Session.objects.filter(pk__in=chaves).delete()
+        total += apagadas
+        if apagadas < lote:
+            return total
+
+
+limpeza = LimpezaPeriodica(
+    'sessoes', TRAVA_LIMPEZA, limpar_sessoes_expiradas,
+    intervalo='SESSOES_LIMPEZA_SEGUNDOS', lote='SESSOES_LIMPEZA_LOTE',
+    habilitada=lambda: settings.SESSION_ENGINE in ARMAZENAMENTOS_NO_BANCO,
+)
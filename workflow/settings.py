@@ -12,11 +12,13 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
-from decouple import config, Csv
+from decouple import config, Choices, Csv
+from django.core.exceptions import ImproperlyConfigured
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = config('SECRET_KEY', default='django-insecure-*q94-ld&)yqxfn3des=hb1#ae_za^h#=)k1)x(a@442+qulu%@')
 DEBUG = config('DEBUG', default=True, cast=bool)
+ORCAMENTO_CONSULTAS_ESTRITO = config('ORCAMENTO_CONSULTAS_ESTRITO', default=DEBUG, cast=bool)
 ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='localhost,127.0.0.1', cast=Csv())
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -25,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # Third party apps
     'crispy_forms',
@@ -36,11 +39,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'workflow.middleware.MetricasMiddleware',
+    'workflow.middleware.MarcacaoSQLMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'workflow.middleware.CompressaoHTMLMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'workflow.routers.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -49,7 +57,7 @@ ROOT_URLCONF = 'workflow.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'workflow.metricas.DjangoTemplatesInstrumentado',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -59,6 +67,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.media',
+                'workflow.idempotencia.chave_idempotencia',
             ],
         },
     },
@@ -79,17 +88,74 @@ WSGI_APPLICATION = 'workflow.wsgi.application'
 # }
 
 
+# Servidor ASGI (uvicorn): views de leitura assíncronas. Ver processos/views_async.py
+SERVIDOR_ASGI = config('SERVIDOR_ASGI', default=False, cast=bool)
+# Threads (e conexões) por worker para consultas independentes em paralelo nas views assíncronas
+CONSULTAS_PARALELAS = config('CONSULTAS_PARALELAS', default=4, cast=int)
+CONSULTAS_PARALELAS_CONN_MAX_AGE = config('CONSULTAS_PARALELAS_CONN_MAX_AGE', default=60, cast=int)
+
+# SSE de "Meus Processos" (só com SERVIDOR_ASGI). Ver processos/notificacoes.py
+SSE_HEARTBEAT_SEGUNDOS = config('SSE_HEARTBEAT_SEGUNDOS', default=15, cast=int)
+SSE_DURACAO_MAXIMA = config('SSE_DURACAO_MAXIMA', default=300, cast=int)
+SSE_RECONEXAO_MS = config('SSE_RECONEXAO_MS', default=3000, cast=int)
+
+# Conexões persistentes: cada thread do worker reaproveita a sua conexão por
+# DB_CONN_MAX_AGE segundos (validada antes do uso por CONN_HEALTH_CHECKS).
+# Conexões por worker = threads do gunicorn (GUNICORN_THREADS); o total
+# GUNICORN_WORKERS * GUNICORN_THREADS por container precisa caber no max_connections.
+# Sob ASGI cada requisição roda numa thread nova, então as conexões não são
+# reaproveitadas (DB_CONN_MAX_AGE=0); fixos são o pool de CONSULTAS_PARALELAS
+# e a conexão LISTEN das notificações SSE. Todo worker tem ainda a conexão LISTEN
+# do barramento de invalidação de cache.
+if SERVIDOR_ASGI:
+    DB_CONEXOES_POR_WORKER = CONSULTAS_PARALELAS + 2
+else:
+    DB_CONEXOES_POR_WORKER = config('GUNICORN_THREADS', default=1, cast=int) + 1
+
+# Caches locais: de quanto em quanto tempo as versões são conferidas no banco,
+# limitando quanto tempo uma invalidação perdida pode deixar dado velho
+INVALIDACAO_VERIFICACAO_SEGUNDOS = config('INVALIDACAO_VERIFICACAO_SEGUNDOS', default=30, cast=int)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'workflow.banco',
         'NAME': config('DB_NAME', default='workflow_db'),
         'USER': config('DB_USER', default='postgres'),
         'PASSWORD': config('DB_PASSWORD', default='postgres'),
         'HOST': config('DB_HOST', default='localhost'),
         'PORT': config('DB_PORT', default='5432'),
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=0 if SERVIDOR_ASGI else 60, cast=int),
+        'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
+    }
+}
+
+# Cache de templates e etapas (processos/cache.py): memória de cada worker por
+# padrão; para compartilhar entre workers e nós use, por exemplo,
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache e CACHE_LOCATION=redis://redis:6379/1
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='workflow'),
+        'TIMEOUT': config('CACHE_TIMEOUT', default=3600, cast=int),
     }
 }
 
+# Réplica de leitura (opcional): listas, relatórios e dashboard leem dela
+# Ver workflow/routers.py
+DB_REPLICA_HOST = config('DB_REPLICA_HOST', default='')
+if DB_REPLICA_HOST:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': DB_REPLICA_HOST,
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['workflow.routers.ReplicaRouter']
+REPLICA_FIXACAO_SEGUNDOS = config('REPLICA_FIXACAO_SEGUNDOS', default=10, cast=int)
+REPLICA_ATRASO_MAXIMO = config('REPLICA_ATRASO_MAXIMO', default=5.0, cast=float)
+REPLICA_VERIFICACAO_SEGUNDOS = config('REPLICA_VERIFICACAO_SEGUNDOS', default=5.0, cast=float)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -127,11 +193,36 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
-# STATICFILES_DIRS = [BASE_DIR / 'static']
+# Bootstrap e Bootstrap Icons ficam no repositório (a intranet não acessa CDN)
+STATICFILES_DIRS = [BASE_DIR / 'static']
+
+# Em produção os estáticos têm o hash do conteúdo no nome e versões .gz/.br
+# geradas no collectstatic; o WhiteNoise os serve do próprio processo com
+# Cache-Control de 10 anos. Em DEBUG são servidos direto das pastas de origem.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+        else 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+WHITENOISE_USE_FINDERS = DEBUG
+WHITENOISE_AUTOREFRESH = DEBUG
+# Arquivos sem hash no nome (ex: favicon) podem mudar a qualquer deploy
+WHITENOISE_MAX_AGE = 0 if DEBUG else 3600
+
+# Páginas HTML menores que isso não compensam o gzip (workflow/middleware.py)
+COMPRESSAO_HTML_MINIMO_BYTES = config('COMPRESSAO_HTML_MINIMO_BYTES', default=1024, cast=int)
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Extração de texto dos anexos para busca (processos/extracao.py)
+EXTRACAO_TEXTO_ASSINCRONA = config('EXTRACAO_TEXTO_ASSINCRONA', default=True, cast=bool)
+EXTRACAO_TEXTO_MAX_BYTES = config('EXTRACAO_TEXTO_MAX_BYTES', default=5 * 1024 * 1024, cast=int)
+EXTRACAO_TEXTO_MAX_CARACTERES = config('EXTRACAO_TEXTO_MAX_CARACTERES', default=500_000, cast=int)
+EXTRACAO_TEXTO_TIMEOUT = config('EXTRACAO_TEXTO_TIMEOUT', default=10.0, cast=float)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -140,6 +231,40 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom User Model
 AUTH_USER_MODEL = 'usuarios.Usuario'
 
+# O usuário de cada requisição vem do cache (usuarios/backends.py)
+AUTHENTICATION_BACKENDS = ['usuarios.backends.UsuarioCacheBackend']
+
+# Sessões: db (padrão), cached_db (cache + banco) ou signed_cookies (só no cookie, sem banco).
+# cached_db só com cache compartilhado: com uma cópia por worker, o logout apaga só a do
+# worker que atendeu e os outros continuam aceitando a sessão revogada até o cache expirar.
+SESSAO_ARMAZENAMENTO = config(
+    'SESSAO_ARMAZENAMENTO', default='db', cast=Choices(['cached_db', 'signed_cookies', 'db'])
+)
+CACHES_POR_PROCESSO = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+}
+if SESSAO_ARMAZENAMENTO == 'cached_db' and CACHES['default']['BACKEND'] in CACHES_POR_PROCESSO:
+    raise ImproperlyConfigured(
+        f"SESSAO_ARMAZENAMENTO=cached_db exige um cache compartilhado entre workers e nós "
+        f"(CACHE_BACKEND={CACHES['default']['BACKEND']}); use db ou configure, por exemplo, o Redis."
+    )
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSAO_ARMAZENAMENTO}'
+# Limpeza das sessões expiradas no banco (workflow/sessoes.py); 0 desliga
+SESSOES_LIMPEZA_SEGUNDOS = config('SESSOES_LIMPEZA_SEGUNDOS', default=3600, cast=int)
+SESSOES_LIMPEZA_LOTE = config('SESSOES_LIMPEZA_LOTE', default=1000, cast=int)
+
+# Chaves de idempotência dos POSTs (workflow/idempotencia.py): validade e limpeza (0 desliga)
+IDEMPOTENCIA_TTL_SEGUNDOS = config('IDEMPOTENCIA_TTL_SEGUNDOS', default=86400, cast=int)
+IDEMPOTENCIA_LIMPEZA_SEGUNDOS = config('IDEMPOTENCIA_LIMPEZA_SEGUNDOS', default=3600, cast=int)
+IDEMPOTENCIA_LIMPEZA_LOTE = config('IDEMPOTENCIA_LIMPEZA_LOTE', default=1000, cast=int)
+# Chave "em andamento" há mais tempo que isso é de um worker que morreu e pode ser reaproveitada
+IDEMPOTENCIA_ABANDONO_SEGUNDOS = config('IDEMPOTENCIA_ABANDONO_SEGUNDOS', default=120, cast=int)
+
+# Fila de tarefas (processos/fila.py): por quanto tempo "pegar a próxima tarefa" reserva o processo
+FILA_RESERVA_SEGUNDOS = config('FILA_RESERVA_SEGUNDOS', default=900, cast=int)
+
 # Login URLs
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
@@ -149,6 +274,9 @@ LOGOUT_REDIRECT_URL = 'login'
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
+# Métricas Prometheus (/metrics); token opcional exigido como "Authorization: Bearer <token>"
+METRICAS_TOKEN = config('METRICAS_TOKEN', default='')
+
 # Email Configuration (opcional - para notificações) | não vai dar tempo de implementar
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
 EMAIL_HOST = config('EMAIL_HOST', default='localhost')
@@ -19,15 +19,17 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import RedirectView
+from workflow.metricas import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', RedirectView.as_view(url='/processos/', permanent=False)),
     path('auth/', include('usuarios.urls')),
     path('processos/', include('processos.urls')),
+    path('api/v1/', include('processos.urls_api')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 # Serve media files in development
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)